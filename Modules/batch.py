@@ -0,0 +1,235 @@
+#! /usr/bin/python
+
+# Author: Addison Martin
+# This script is a module for the Datason package
+# It runs a manifest of datason commands (one job per line) on a pool of
+# worker processes. Jobs with the largest inputs are started first so they
+# do not become stragglers at the end of the batch, and every worker keeps
+# the modules it has imported, so only the first job of each command in a
+# worker pays for imports. The output of every job is collected separately
+# and a summary with the exit code and timings of every job is written at
+# the end.
+# Manifest lines are either tab separated (the command followed by its
+# arguments, one per column) or JSON objects such as
+#   {"id": "sample1", "command": "inthisto", "args": ["-i", "s1.txt", "s1.png"]}
+# which may also give "stdin" (a file fed to the job as piped input) and
+# "size" (used instead of the size of the job's input files for ordering).
+# Empty lines and lines starting with # are ignored.
+
+import os, sys, json
+
+class Job:
+    # Class that holds one manifest entry
+    def __init__(self, job_id, command, args, stdin = None, size = None):
+        self.id = job_id
+        self.command = command
+        self.args = args
+        self.stdin = stdin
+        self.size = size if size != None else input_size(args, stdin)
+
+def input_size(args, stdin = None):
+    # Function that estimates the work of a job as the total size of the
+    # existing files among its arguments (and its stdin file)
+    size = 0
+    for arg in list(args) + ([stdin] if stdin != None else []):
+        if os.path.isfile(arg):
+            size += os.path.getsize(arg)
+    return(size)
+
+def read_manifest(lines):
+    # Function that parses manifest lines into a list of Jobs; raises
+    # ValueError naming the first bad line
+    jobs = []
+    for number, line in enumerate(lines, 1):
+        line = line.rstrip("\r\n")
+        if not line.strip() or line.lstrip().startswith("#"):
+            continue
+        if line.lstrip().startswith("{"):
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError as error:
+                raise ValueError(f"line {number} is not valid JSON ({error})")
+            if "command" not in entry:
+                raise ValueError(f"line {number} has no command")
+            args = entry.get("args", [])
+            if isinstance(args, str) or not all(isinstance(arg, str) for arg in args):
+                raise ValueError(f"line {number}: args must be a list of strings")
+            jobs.append(Job(str(entry.get("id", number)), entry["command"], args, entry.get("stdin"), entry.get("size")))
+        else:
+            fields = line.split("\t")
+            jobs.append(Job(str(number), fields[0].strip(), fields[1:]))
+    return(jobs)
+
+def run_job(job, runner, out_path):
+    # Function that runs one job in this process with its stdout and stderr
+    # sent to out_path and its stdin read from job.stdin (or empty), and
+    # returns a dict with its exit code and timings
+    import time, resource, traceback
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved_fds = [os.dup(1), os.dup(2)]
+    saved_stdin = sys.stdin
+    out = open(out_path, "wb")
+    os.dup2(out.fileno(), 1)
+    os.dup2(out.fileno(), 2)
+    sys.stdin = open(job.stdin if job.stdin != None else os.devnull, "r")
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    start_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    try:
+        code = runner(job.command, job.args)
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        seconds = time.perf_counter() - start_wall
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu_seconds = time.process_time() - start_cpu + (children.ru_utime - start_children.ru_utime) + (children.ru_stime - start_children.ru_stime)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        sys.stdin.close()
+        sys.stdin = saved_stdin
+        os.dup2(saved_fds[0], 1)
+        os.dup2(saved_fds[1], 2)
+        for fd in saved_fds: os.close(fd)
+        out.close()
+    return({"id": job.id, "command": job.command, "exit": code, "seconds": seconds, "cpu_seconds": cpu_seconds, "input_bytes": job.size, "worker": os.getpid(), "output": out_path})
+
+def _run_job_in_worker(job, runner, out_path):
+    # Function run in a worker process: runs a job and also returns the stages
+    # it recorded when instrumentation is on (see instrument.py), so the
+    # parent can add them to its own
+    import instrument
+    result = run_job(job, runner, out_path)
+    return(result, instrument.take_records() if instrument.enabled() else {})
+
+def run_batch(jobs, runner, out_dir, workers = 1, report = None):
+    # Function that runs all jobs, largest input first, on workers processes
+    # (in this process when workers is 1) and returns their results in
+    # manifest order; report is called with each result as it finishes.
+    # Stages recorded in the workers are merged into this process's stages
+    # (their times overlap, as the workers run side by side)
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    import instrument
+    order = sorted(range(len(jobs)), key = lambda i: jobs[i].size, reverse = True)
+    out_paths = [os.path.join(out_dir, f"{_safe_name(job.id)}.log") for job in jobs]
+    results = [None] * len(jobs)
+    if workers == 1 or len(jobs) == 1:
+        for i in order:
+            results[i] = run_job(jobs[i], runner, out_paths[i])
+            if report != None: report(results[i])
+    else:
+        # Workers drop the stage records they inherit when forked, so only
+        # their own are sent back
+        with ProcessPoolExecutor(max_workers = workers, initializer = instrument.take_records) as pool:
+            futures = {pool.submit(_run_job_in_worker, jobs[i], runner, out_paths[i]): i for i in order}
+            for future in as_completed(futures):
+                i = futures[future]
+                results[i], records = future.result()
+                instrument.merge_records(records)
+                if report != None: report(results[i])
+    return(results)
+
+def _safe_name(job_id):
+    return("".join(c if c.isalnum() or c in "-_." else "_" for c in job_id))
+
+def write_summary(results, stream):
+    # Function that writes one tab separated line per job
+    stream.write("id\tcommand\texit\tseconds\tcpu_seconds\tinput_bytes\tworker\toutput\n")
+    for result in results:
+        stream.write(f"{result['id']}\t{result['command']}\t{result['exit']}\t{result['seconds']:.3f}\t{result['cpu_seconds']:.3f}\t{result['input_bytes']}\t{result['worker']}\t{result['output']}\n")
+
+def main(argv = None, runner = None, commands = None):
+    import argparse
+
+    #####################
+    # Parsing arguments #
+    #####################
+    parser = argparse.ArgumentParser(description = "This module runs a manifest of datason commands on a pool of worker processes, which replaces running datason many times with GNU parallel or xargs. Each line of the manifest is one job: either the command and its arguments separated by tabs, or a JSON object with command, args and optionally id, stdin (file given to the job as piped input) and size. Jobs with the largest input files are started first. The output of every job is saved to its own log file and a summary of the exit code and timings of every job is printed (or saved with -s/--summary).")
+    parser.add_argument(
+        "-v", "--verbose",
+        action = "store_true",
+        default = False,
+        dest = "verbose")
+    parser.add_argument(
+        "manifest",
+        help = "File location of the manifest; if not provided script looks for pipe input",
+        type = str,
+        nargs = "?")
+    parser.add_argument(
+        "-j", "--jobs",
+        help = "Number of worker processes; 0 uses all cores (default 1)",
+        type = int,
+        default = 1,
+        dest = "jobs")
+    parser.add_argument(
+        "-o", "--out_dir",
+        help = "Directory for the output log of every job (default: the manifest path followed by .logs, or datason_batch.logs for piped manifests)",
+        type = str,
+        dest = "out_dir")
+    parser.add_argument(
+        "-s", "--summary",
+        help = "File location to save the tab separated job summary; if not provided it is printed",
+        type = str,
+        dest = "summary")
+    args = parser.parse_args(argv)
+    if args.verbose == True: print(f"The following arguments were received: {args}") # for troubleshooting
+    if args.jobs == 0: args.jobs = os.cpu_count()
+
+    if runner == None:
+        print("Note: batches must be run with 'datason batch'. Quitting...")
+        exit()
+
+    # Reading the manifest
+    if args.manifest != None:
+        with open(args.manifest) as f:
+            lines = f.readlines()
+    elif not sys.stdin.isatty():
+        lines = sys.stdin.readlines()
+    else:
+        print("No piped input to script and no manifest. Quitting...")
+        exit()
+    try:
+        jobs = read_manifest(lines)
+    except ValueError as error:
+        print(f"Note: manifest {error}. Quitting...")
+        exit()
+    for job in jobs:
+        if job.command not in commands or commands[job.command]["wrapper"] == True:
+            print(f"Note: job {job.id} uses unknown command {job.command!r}. Quitting...")
+            exit()
+    if len(jobs) == 0:
+        print("No jobs in manifest. Quitting...")
+        exit()
+
+    out_dir = args.out_dir if args.out_dir != None else (args.manifest + ".logs" if args.manifest != None else "datason_batch.logs")
+    os.makedirs(out_dir, exist_ok = True)
+    out_dir = os.path.abspath(out_dir)
+
+    # Importing the modules used by the manifest before the workers are
+    # started, so that they inherit them already imported
+    import importlib
+    for command in set(job.command for job in jobs):
+        importlib.import_module(commands[command]["module"])
+
+    def report(result):
+        if result["exit"] != 0: print(f"Job {result['id']} ({result['command']}) failed with exit code {result['exit']}; see {result['output']}", file = sys.stderr)
+        elif args.verbose == True: print(f"Job {result['id']} ({result['command']}) finished in {result['seconds']:.2f} s")
+
+    if args.verbose == True: print(f"Running {len(jobs)} job(s) on {min(args.jobs, len(jobs))} process(es); logs in {out_dir}")
+    results = run_batch(jobs, runner, out_dir, args.jobs, report)
+
+    # Summary
+    if args.summary != None:
+        with open(args.summary, "w") as f:
+            write_summary(results, f)
+        if args.verbose == True: print(f"Summary saved to {args.summary}")
+    else:
+        write_summary(results, sys.stdout)
+    failed = sum(1 for result in results if result["exit"] != 0)
+    print(f"{len(results) - failed} of {len(results)} job(s) succeeded", file = sys.stderr)
+    return(1 if failed > 0 else 0)
+
+
+if __name__ == "__main__":
+    main()
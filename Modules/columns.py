@@ -0,0 +1,180 @@
+#! /usr/bin/python
+
+# Author: Addison Martin
+# This script is a helper for the Datason package
+# It provides binary column input for inthisto and inthisto2d, so tools that
+# already produce numeric columns do not have to write them out as text only
+# for them to be parsed back. The input file is memory-mapped and its columns
+# are handed to the counters in chunks that are views of the mapping: there
+# is no parse step, nothing is copied up front (integers narrower than int64
+# are only widened one chunk at a time) and files larger than memory can be
+# counted; the pages of every chunk are dropped from the process once the
+# chunk is counted, so its memory use stays at a few chunks however large the
+# file is. Supported inputs are
+#   - .npy files (detected from their magic bytes): a 1D array, a 2D array
+#     whose columns are selected by index or a structured array whose
+#     fields are selected by name
+#   - raw little-endian int32 or int64 files; these have no header, so the
+#     type must be given and the values are stored row by row (one value per
+#     row for inthisto, x then y for inthisto2d)
+#   - Arrow IPC files (detected from their magic bytes; needs pyarrow) whose
+#     columns are selected by name
+
+import os, mmap
+import numpy
+
+NPY_MAGIC = b"\x93NUMPY"
+ARROW_MAGIC = b"ARROW1"
+RAW_TYPES = {"int32": "<i4", "int64": "<i8"}
+# Number of rows handed to the counters at once
+CHUNK_ROWS = 1 << 20
+
+class ColumnInputError(ValueError):
+    # Error raised for binary input that cannot be counted as integer columns
+    pass
+
+def binary_format(path):
+    # Function that returns "npy" or "arrow" for a binary column file, or
+    # None for anything else (text input, or raw integers which have no header);
+    # only regular files are looked at, as reading a pipe would consume it
+    if not os.path.isfile(path):
+        return(None)
+    with open(path, "rb") as f:
+        head = f.read(8)
+    if head.startswith(NPY_MAGIC):
+        return("npy")
+    if head.startswith(ARROW_MAGIC):
+        return("arrow")
+    return(None)
+
+def _check_integers(dtype, name):
+    if dtype.kind not in "iu" or (dtype.kind == "u" and dtype.itemsize == 8):
+        raise ColumnInputError(f"column {name} holds {dtype} values, not integers that fit in int64")
+
+def _select(names, columns, ncols):
+    # Function that returns the positions of the requested columns (names or
+    # indices) among names; the first ncols columns when none are requested
+    if columns == None:
+        if len(names) < ncols:
+            raise ColumnInputError(f"input has {len(names)} column(s) but {ncols} are needed")
+        return(list(range(ncols)))
+    if len(columns) != ncols:
+        raise ColumnInputError(f"{ncols} column(s) must be selected, not {len(columns)}")
+    positions = []
+    for column in columns:
+        if column in names:
+            positions.append(names.index(column))
+        elif column.lstrip("-").isdigit() and -len(names) <= int(column) < len(names):
+            positions.append(int(column) % len(names))
+        else:
+            raise ColumnInputError(f"input has no column {column} (columns: {', '.join(names)})")
+    return(positions)
+
+def _release(mapping, arrays):
+    # Function that drops the pages of a read-only file mapping that hold the
+    # given (already counted) arrays from the process; they are read back
+    # from the file if they are needed again
+    if not isinstance(mapping, mmap.mmap) or not hasattr(mmap, "MADV_DONTNEED"):
+        return
+    base = numpy.frombuffer(mapping, dtype = numpy.uint8).__array_interface__["data"][0]
+    for array in arrays:
+        if len(array) == 0: continue
+        low = array.__array_interface__["data"][0] - base
+        high = low + (len(array) - 1) * array.strides[0] + array.itemsize
+        start = low - low % mmap.PAGESIZE
+        mapping.madvise(mmap.MADV_DONTNEED, start, high - start)
+
+def _array_chunks(arrays, chunk_rows, mapping = None):
+    # Generator that yields row chunks (tuples of views) of equal length
+    # arrays; chunks are released from mapping (see _release) once counted
+    rows = len(arrays[0])
+    for start in range(0, rows, chunk_rows):
+        chunk = tuple(array[start:start + chunk_rows] for array in arrays)
+        yield(chunk)
+        _release(mapping, chunk)
+
+def _npy_columns(path, ncols, columns):
+    try:
+        array = numpy.load(path, mmap_mode = "r", allow_pickle = False)
+    except ValueError as error:
+        raise ColumnInputError(f"{path} cannot be mapped ({error})")
+    if array.dtype.names != None and array.ndim == 1:
+        # Structured array: columns are its named fields
+        names = list(array.dtype.names)
+        labels = [names[i] for i in _select(names, columns, ncols)]
+        arrays = [array[name] for name in labels]
+    elif array.ndim == 1 or array.ndim == 2:
+        # Plain array: columns are numbered; a 1D array is a single column
+        table = array.reshape(-1, 1) if array.ndim == 1 else array
+        names = [str(i) for i in range(table.shape[1])]
+        selected = _select(names, columns, ncols)
+        labels = []
+        arrays = [table[:, i] for i in selected]
+    else:
+        raise ColumnInputError(f"{path} holds a {array.ndim}D array; only 1D and 2D arrays are supported")
+    for name, column in zip(labels or selected, arrays):
+        _check_integers(column.dtype, name)
+    return(labels, _array_chunks(arrays, CHUNK_ROWS, array.base))
+
+def _raw_columns(path, ncols, raw_type):
+    # Raw files have no header: every row is ncols values of raw_type
+    dtype = numpy.dtype(RAW_TYPES[raw_type])
+    size = os.path.getsize(path)
+    if size % (dtype.itemsize * ncols) != 0:
+        raise ColumnInputError(f"{path} is {size} bytes, which is not a whole number of rows of {ncols} {raw_type} value(s)")
+    if size == 0:
+        return([], iter([]))
+    array = numpy.memmap(path, dtype = dtype, mode = "r")
+    table = array.reshape(-1, ncols)
+    return([], _array_chunks([table[:, i] for i in range(ncols)], CHUNK_ROWS, array.base))
+
+def _arrow_columns(path, ncols, columns):
+    try:
+        import pyarrow, pyarrow.ipc
+    except ImportError:
+        raise ColumnInputError("reading Arrow files needs the pyarrow package")
+    try:
+        reader = pyarrow.ipc.open_file(pyarrow.memory_map(path, "r"))
+    except (OSError, ValueError) as error:
+        raise ColumnInputError(f"{path} is not a valid Arrow IPC file ({error})")
+    names = reader.schema.names
+    selected = [names[i] for i in _select(names, columns, ncols)]
+    for name in selected:
+        field = reader.schema.field(name)
+        if not pyarrow.types.is_integer(field.type):
+            raise ColumnInputError(f"column {name} holds {field.type} values, not integers")
+        _check_integers(numpy.dtype(field.type.to_pandas_dtype()), name)
+    return(selected, _arrow_chunks(reader, selected))
+
+def _arrow_chunks(reader, selected):
+    # Generator that yields the selected columns of every record batch of an
+    # Arrow file as numpy views of the mapped batches (in chunks of at most
+    # CHUNK_ROWS rows); columns with missing values cannot be counted
+    for i in range(reader.num_record_batches):
+        batch = reader.get_batch(i)
+        arrays = []
+        for name in selected:
+            column = batch.column(name)
+            if column.null_count > 0:
+                raise ColumnInputError(f"column {name} has {column.null_count} missing value(s) in record batch {i}")
+            arrays.append(column.to_numpy(zero_copy_only = True))
+        if len(arrays[0]) > 0:
+            yield from _array_chunks(arrays, CHUNK_ROWS)
+
+def open_columns(path, ncols = 1, columns = None, raw_type = None):
+    # Function that opens a binary column file and returns (labels, chunks):
+    # the names of the selected columns (empty when the file has no names)
+    # and an iterator of tuples of ncols integer arrays, one chunk of rows at
+    # a time. columns selects the columns by name or index; raw_type
+    # ("int32" or "int64") reads a raw file. Raises ColumnInputError when the
+    # file cannot be read as integer columns
+    if raw_type != None:
+        if columns != None:
+            raise ColumnInputError("raw integer files have no columns to select")
+        return(_raw_columns(path, ncols, raw_type))
+    fmt = binary_format(path)
+    if fmt == "npy":
+        return(_npy_columns(path, ncols, columns))
+    if fmt == "arrow":
+        return(_arrow_columns(path, ncols, columns))
+    raise ColumnInputError(f"{path} is not a .npy or Arrow IPC file (raw integer files need their type)")
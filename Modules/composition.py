@@ -0,0 +1,279 @@
+#! /usr/bin/python
+
+# Author: Addison Martin
+# This script is a helper for the Datason package
+# It provides the base composition counting engine used by fastastats.
+# Sequences are counted as raw byte buffers with a single numpy bincount
+# over a uint8 view, so every symbol (ACGT plus all IUPAC codes, in either
+# case) is counted in one pass over the data instead of one Python
+# comparison per base.
+# KmerCounter counts every k-mer (k up to MAX_KMER_SIZE) of the same byte
+# buffers: bases are encoded in 2 bits (A=0, C=1, G=2, T/U=3) with a lookup
+# table, the packed index of every window of k bases is built with k shifted
+# passes over the whole sequence and the indices are counted in a dense array
+# of 4 ** k counts with bincount. Windows holding any other symbol (N, other
+# IUPAC codes) are skipped. For large k the dense array is only allocated
+# once enough distinct k-mers have been seen; until then the counts are kept
+# sparse, so counters of small inputs (and of every chunk of a file counted
+# in parallel) stay small.
+
+import numpy
+
+# Nucleotide symbols reported individually; anything else is reported as "other"
+IUPAC_SYMBOLS = "ACGTURYSWKMBDHVN"
+# Symbols that are certainly a G or C
+STRICT_GC_SYMBOLS = "GC"
+# Symbols that COULD indicate a G or C
+INCLUSIVE_GC_SYMBOLS = "GCRYKMSBDHVN"
+
+# Largest slice handed to bincount at once; bincount widens its input to
+# 64 bit integers internally so this bounds the temporary memory it uses
+_CHUNK = 1 << 22
+
+class Composition:
+    # Class that accumulates the per-symbol composition of byte sequences.
+    # Counts are kept for all 256 byte values and folded case-insensitively
+    # when they are reported. Compositions are mergeable so partial counts
+    # from different chunks, files or processes can be added together
+    def __init__(self):
+        self.counts = numpy.zeros(256, dtype = numpy.int64)
+
+    def add(self, sequence):
+        # Function that adds the bytes of one sequence to the counts and
+        # returns the counts of that sequence alone (for per-record tables)
+        view = numpy.frombuffer(sequence, dtype = numpy.uint8)
+        counts = numpy.zeros(256, dtype = numpy.int64)
+        for start in range(0, len(view), _CHUNK):
+            counts += numpy.bincount(view[start:start+_CHUNK], minlength = 256)
+        self.counts += counts
+        return(counts)
+
+    def merge(self, other):
+        # Function that adds the counts of another Composition to this one
+        self.counts += other.counts
+        return(self)
+
+    def total(self):
+        # Function that returns the total number of symbols counted
+        return(int(self.counts.sum()))
+
+    def count(self, symbols):
+        # Function that returns the number of times any of the given symbols
+        # was seen, ignoring case
+        return(sum(int(self.counts[ord(s.upper())] + self.counts[ord(s.lower())]) for s in set(symbols)))
+
+    def symbol_counts(self):
+        # Function that returns a dictionary of case-insensitive counts for
+        # each IUPAC symbol, with every other byte value summed under "other"
+        result = {symbol: self.count(symbol) for symbol in IUPAC_SYMBOLS}
+        result["other"] = self.total() - sum(result.values())
+        return(result)
+
+    def gc_content(self, inclusive = False):
+        # Function that returns the GC content of all counted symbols; when
+        # inclusive is True ambiguous symbols that could be a G or C also count
+        total = self.total()
+        if total == 0:
+            return(0.0)
+        if inclusive == True: return(self.count(INCLUSIVE_GC_SYMBOLS)/total)
+        else: return(self.count(STRICT_GC_SYMBOLS)/total)
+
+def count_symbols(counts, symbols):
+    # Function that returns the number of times any of the given symbols
+    # appears in an array of 256 byte counts (as returned by Composition.add),
+    # ignoring case
+    return(sum(int(counts[ord(s.upper())] + counts[ord(s.lower())]) for s in set(symbols)))
+
+# Largest k-mer size counted (4 ** 12 counts take 128 MB)
+MAX_KMER_SIZE = 12
+# Total size of the short sequences that are encoded together
+_KMER_BATCH = 1 << 20
+# Largest number of counts allocated densely up front (4 ** 8); larger
+# counters start sparse and become dense when an eighth of the k-mers is seen
+_DENSE_KMERS = 1 << 16
+KMER_BASES = "ACGT"
+# 2 bit code of every byte value; 4 marks symbols that are not a base
+_KMER_CODES = numpy.full(256, 4, dtype = numpy.uint8)
+for _code, _bases in enumerate(("Aa", "Cc", "Gg", "TtUu")):
+    for _base in _bases: _KMER_CODES[ord(_base)] = _code
+
+class KmerCounter:
+    # Class that counts the k-mers of byte sequences in a dense array indexed
+    # by the 2 bit packed k-mer (or, while few k-mers are seen and k is large,
+    # in sorted arrays of the packed k-mers seen and their counts). When
+    # canonical is True a k-mer and its
+    # reverse complement are counted together (under the smaller index).
+    # Short sequences are joined (separated by a symbol that is not a base, so
+    # no k-mer spans two sequences) and encoded together, and indices are
+    # counted in batches; counters are mergeable
+    def __init__(self, k, canonical = False):
+        if not 1 <= k <= MAX_KMER_SIZE:
+            raise ValueError(f"k-mer size must be between 1 and {MAX_KMER_SIZE}")
+        self.k = k
+        self.canonical = canonical
+        self.size = 4 ** k
+        self.counts = numpy.zeros(self.size, dtype = numpy.int64) if self.size <= _DENSE_KMERS else None
+        self.seen = numpy.zeros(0, dtype = numpy.uint32)
+        self.seen_counts = numpy.zeros(0, dtype = numpy.int64)
+        self.sequences = []
+        self.sequences_size = 0
+        self.pending = []
+        self.pending_size = 0
+
+    def add(self, sequence):
+        # Function that counts every k-mer of one sequence
+        if len(sequence) >= _KMER_BATCH:
+            self._add_sequence(sequence)
+            return
+        self.sequences.append(bytes(sequence))
+        self.sequences_size += len(sequence) + 1
+        if self.sequences_size >= _KMER_BATCH:
+            self._add_sequences()
+
+    def _add_sequences(self):
+        if self.sequences:
+            joined = b"\n".join(self.sequences)
+            self.sequences = []
+            self.sequences_size = 0
+            self._add_sequence(joined)
+
+    def _add_sequence(self, sequence):
+        k = self.k
+        codes = _KMER_CODES[numpy.frombuffer(sequence, dtype = numpy.uint8)]
+        # Long sequences are handled in pieces that overlap by k - 1 bases
+        for start in range(0, max(len(codes) - k + 1, 0), _CHUNK):
+            self._add_codes(codes[start:start + _CHUNK + k - 1])
+
+    def _add_codes(self, codes):
+        k = self.k
+        n = len(codes) - k + 1
+        bad = numpy.zeros(len(codes) + 1, dtype = numpy.int32)
+        numpy.cumsum(codes == 4, out = bad[1:])
+        valid = bad[k:] == bad[:n]
+        # 32 bit indices hold k-mers of up to 16 bases
+        bits = (codes & 3).astype(numpy.uint32)
+        index = numpy.zeros(n, dtype = numpy.uint32)
+        for j in range(k):
+            index <<= 2
+            index |= bits[j:j+n]
+        if self.canonical == True:
+            bits ^= 3
+            reverse = numpy.zeros(n, dtype = numpy.uint32)
+            for j in range(k):
+                reverse |= bits[j:j+n] << numpy.uint32(2 * j)
+            numpy.minimum(index, reverse, out = index)
+        index = index[valid]
+        self.pending.append(index)
+        self.pending_size += len(index)
+        # (dense counts are added once there are about as many indices as
+        # counts, so bincount's pass over the whole array is worth it)
+        if self.pending_size >= (max(_CHUNK, self.size) if self.counts is not None else _CHUNK):
+            self._flush()
+
+    def _flush(self):
+        self._add_sequences()
+        if self.pending:
+            index = numpy.concatenate(self.pending)
+            self.pending = []
+            self.pending_size = 0
+            if self.counts is None:
+                self._add_sparse(*numpy.unique(index, return_counts = True))
+            else:
+                self.counts += numpy.bincount(index, minlength = self.size)
+
+    def _add_sparse(self, index, counts):
+        # Function that adds the counts of the sorted, distinct packed k-mers
+        # index to the sparse counts, switching to a dense array once they
+        # would take a large part of its size
+        if len(self.seen) > 0:
+            index, inverse = numpy.unique(numpy.concatenate((self.seen, index)), return_inverse = True)
+            merged = numpy.zeros(len(index), dtype = numpy.int64)
+            numpy.add.at(merged, inverse, numpy.concatenate((self.seen_counts, counts)))
+            counts = merged
+        self.seen = index.astype(numpy.uint32)
+        self.seen_counts = counts.astype(numpy.int64)
+        if len(self.seen) > self.size // 8:
+            self._make_dense()
+
+    def _make_dense(self):
+        self.counts = numpy.zeros(self.size, dtype = numpy.int64)
+        self.counts[self.seen] = self.seen_counts
+        self.seen = numpy.zeros(0, dtype = numpy.uint32)
+        self.seen_counts = numpy.zeros(0, dtype = numpy.int64)
+
+    def merge(self, other):
+        # Function that adds the counts of another KmerCounter to this one
+        if other.k != self.k or other.canonical != self.canonical:
+            raise ValueError("cannot merge k-mer counts of different k-mer sizes")
+        self._flush()
+        other._flush()
+        if other.counts is not None:
+            if self.counts is None: self._make_dense()
+            self.counts += other.counts
+        elif self.counts is not None:
+            self.counts[other.seen] += other.seen_counts
+        else:
+            self._add_sparse(other.seen, other.seen_counts)
+        return(self)
+
+    def table(self):
+        # Function that returns the packed indices of the k-mers seen and
+        # their counts as two numpy arrays, in alphabetical order of k-mer
+        self._flush()
+        if self.counts is None:
+            return(self.seen.astype(numpy.int64), self.seen_counts.copy())
+        index = numpy.flatnonzero(self.counts)
+        return(index, self.counts[index])
+
+    def dense(self):
+        # Function that returns the counts of all 4 ** k k-mers as one array
+        # indexed by the packed k-mer
+        self._flush()
+        if self.counts is None: self._make_dense()
+        return(self.counts)
+
+    def total(self):
+        self._flush()
+        return(int(self.counts.sum()) if self.counts is not None else int(self.seen_counts.sum()))
+
+    def kmer_strings(self, index):
+        # Function that returns the k-mers with the given packed indices as a
+        # numpy array of strings
+        index = numpy.asarray(index, dtype = numpy.int64)
+        letters = numpy.array(list(KMER_BASES))
+        strings = letters[(index >> (2 * (self.k - 1))) & 3]
+        for j in range(1, self.k):
+            strings = numpy.char.add(strings, letters[(index >> (2 * (self.k - 1 - j))) & 3])
+        return(strings)
+
+    def spectrum(self):
+        # Function that returns the k-mer spectrum: an IntegerCounter of how
+        # many distinct k-mers were seen each number of times
+        from counting import IntegerCounter
+        spectrum = IntegerCounter()
+        spectrum.add_many(self.table()[1])
+        return(spectrum)
+
+    def write_tsv(self, stream, batch = 1 << 20):
+        # Function that writes one "k-mer<TAB>count" line per k-mer seen
+        index, counts = self.table()
+        for start in range(0, len(index), batch):
+            strings = self.kmer_strings(index[start:start+batch]).tolist()
+            stream.write("".join(f"{kmer}\t{count}\n" for kmer, count in zip(strings, counts[start:start+batch].tolist())))
+
+def dinucleotide_bias(dinucleotides, composition):
+    # Function that returns, for every dinucleotide XY, its count and its
+    # relative abundance: the frequency of XY divided by the product of the
+    # frequencies of X and Y (1 when bases follow each other at random; CpG is
+    # typically well below 1 in vertebrate DNA). dinucleotides is a
+    # (non-canonical) KmerCounter with k = 2 and composition the Composition
+    # of the same sequences
+    counts = dinucleotides.dense()
+    bases = numpy.array([composition.count(base) + (composition.count("U") if base == "T" else 0) for base in KMER_BASES], dtype = numpy.float64)
+    base_frequency = bases / bases.sum() if bases.sum() > 0 else bases
+    pair_frequency = counts / counts.sum() if counts.sum() > 0 else counts.astype(numpy.float64)
+    result = {}
+    for i in range(16):
+        expected = base_frequency[i >> 2] * base_frequency[i & 3]
+        result[KMER_BASES[i >> 2] + KMER_BASES[i & 3]] = (int(counts[i]), float(pair_frequency[i] / expected) if expected > 0 else float("nan"))
+    return(result)
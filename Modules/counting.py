@@ -0,0 +1,344 @@
+#! /usr/bin/python
+
+# Author: Addison Martin
+# This script is a helper for the Datason package
+# It provides IntegerCounter, a compact count-per-value table for integer
+# data (e.g. sequence lengths). Values are counted into a numpy array
+# indexed from an offset while the range of values is small and into a
+# sparse value -> count dictionary once the range gets wide, so memory is
+# proportional to the number of distinct values rather than the number
+# of values counted. Exact order statistics, N50/L50 and histogram bins are
+# all answered from the same table. PairCounter does the same for (x, y)
+# pairs and bin_edges computes integer/fixed/log/quantile bin edges.
+
+from array import array
+import numpy
+
+class IntegerCounter:
+    # Class that counts integer values. Values added one at a time are
+    # buffered and counted in batches; counters are mergeable
+    def __init__(self, max_dense_range = 1 << 22, batch_size = 1 << 16):
+        self.max_dense_range = max_dense_range
+        self.batch_size = batch_size
+        self.offset = None
+        self.dense = None
+        self.sparse = None
+        self.pending = array("q")
+
+    def add(self, value):
+        # Function that counts a single integer value
+        self.pending.append(value)
+        if len(self.pending) >= self.batch_size:
+            self._flush()
+
+    def add_many(self, values):
+        # Function that counts every value in an array (or list) of integers
+        values = numpy.asarray(values, dtype = numpy.int64)
+        if len(values) == 0:
+            return
+        low = int(values.min())
+        high = int(values.max())
+        if self.sparse is None and self._fit_dense(low, high) == True:
+            counts = numpy.bincount(values - low)
+            self.dense[low-self.offset:low-self.offset+len(counts)] += counts
+        else:
+            self._to_sparse()
+            unique, counts = numpy.unique(values, return_counts = True)
+            self.add_counts(unique, counts)
+
+    def add_counts(self, values, counts):
+        # Function that adds already-counted (value, count) pairs, e.g. a
+        # table produced by another counter or read back from disk
+        values = numpy.asarray(values, dtype = numpy.int64)
+        counts = numpy.asarray(counts, dtype = numpy.int64)
+        if len(values) == 0:
+            return
+        low = int(values.min())
+        high = int(values.max())
+        if self.sparse is None and self._fit_dense(low, high) == True:
+            numpy.add.at(self.dense, values - self.offset, counts)
+        else:
+            self._to_sparse()
+            sparse = self.sparse
+            for value, count in zip(values.tolist(), counts.tolist()):
+                sparse[value] = sparse.get(value, 0) + count
+
+    def merge(self, other):
+        # Function that adds the counts of another IntegerCounter to this one
+        self.add_counts(*other.table())
+        return(self)
+
+    def _flush(self):
+        if len(self.pending) > 0:
+            pending = self.pending
+            self.pending = array("q")
+            self.add_many(numpy.frombuffer(pending, dtype = numpy.int64))
+
+    def _fit_dense(self, low, high):
+        # Function that grows the dense array to cover low..high; returns False
+        # (leaving the counter unchanged) if that would exceed max_dense_range
+        if self.dense is None:
+            if high - low + 1 > self.max_dense_range: return(False)
+            self.offset = low
+            self.dense = numpy.zeros(high - low + 1, dtype = numpy.int64)
+            return(True)
+        new_low = min(low, self.offset)
+        new_high = max(high, self.offset + len(self.dense) - 1)
+        if new_high - new_low + 1 > self.max_dense_range: return(False)
+        if new_low != self.offset or new_high != self.offset + len(self.dense) - 1:
+            grown = numpy.zeros(new_high - new_low + 1, dtype = numpy.int64)
+            grown[self.offset-new_low:self.offset-new_low+len(self.dense)] = self.dense
+            self.dense = grown
+            self.offset = new_low
+        return(True)
+
+    def _to_sparse(self):
+        if self.sparse is not None:
+            return
+        self.sparse = {}
+        if self.dense is not None:
+            nonzero = numpy.flatnonzero(self.dense)
+            self.sparse = dict(zip((nonzero + self.offset).tolist(), self.dense[nonzero].tolist()))
+            self.dense = None
+            self.offset = None
+
+    def table(self):
+        # Function that returns the counts as two sorted numpy arrays: the
+        # distinct values seen and the number of times each was seen
+        self._flush()
+        if self.sparse is not None:
+            values = numpy.fromiter(self.sparse.keys(), dtype = numpy.int64, count = len(self.sparse))
+            counts = numpy.fromiter(self.sparse.values(), dtype = numpy.int64, count = len(self.sparse))
+            order = numpy.argsort(values)
+            return(values[order], counts[order])
+        if self.dense is None:
+            return(numpy.zeros(0, dtype = numpy.int64), numpy.zeros(0, dtype = numpy.int64))
+        nonzero = numpy.flatnonzero(self.dense)
+        return(nonzero + self.offset, self.dense[nonzero])
+
+    def total(self):
+        # Function that returns the number of values counted
+        return(int(self.table()[1].sum()))
+
+    def value_sum(self):
+        # Function that returns the sum of all values counted
+        values, counts = self.table()
+        return(int((values * counts).sum()))
+
+    def value_at_rank(self, rank):
+        # Function that returns the value with the given 0-based rank, i.e. the
+        # value at that position if all counted values were sorted
+        values, counts = self.table()
+        return(int(values[numpy.searchsorted(numpy.cumsum(counts), rank, side = "right")]))
+
+    def median(self):
+        # Function that returns the exact median (same result as
+        # statistics.median on the list of all values)
+        total = self.total()
+        low = self.value_at_rank((total - 1)//2)
+        high = self.value_at_rank(total//2)
+        if low == high: return(low)
+        return((low + high)/2)
+
+    def quantile(self, q):
+        # Function that returns the exact q quantile (0 <= q <= 1), linearly
+        # interpolated between ranks like numpy.quantile on all values
+        if not 0 <= q <= 1:
+            raise ValueError(f"quantile must be between 0 and 1, not {q}")
+        position = (self.total() - 1) * q
+        rank = int(position)
+        low = self.value_at_rank(rank)
+        if position == rank: return(low)
+        high = self.value_at_rank(rank + 1)
+        return(low + (high - low)*(position - rank))
+
+    def n50(self, fraction = 0.5):
+        # Function that returns the N50 and L50 as a tuple: N50 is the largest
+        # value such that values at least that large make up half of the sum
+        # of all values, and L50 is how many values that takes. Other Nx/Lx
+        # statistics can be computed with fraction (e.g. 0.9 for N90)
+        values, counts = self.table()
+        values = values[::-1]
+        counts = counts[::-1]
+        target = (values * counts).sum() * fraction
+        cumulative = numpy.cumsum(values * counts)
+        idx = int(numpy.searchsorted(cumulative, target, side = "left"))
+        before = int(cumulative[idx-1]) if idx > 0 else 0
+        needed = -(-(target - before) // values[idx]) if values[idx] > 0 else 1
+        return(int(values[idx]), int(counts[:idx].sum() + max(needed, 1)))
+
+    def histogram(self, bins = 10, value_range = None):
+        # Function that returns (counts, bin_edges) exactly as numpy.histogram
+        # would for the list of all counted values
+        values, counts = self.table()
+        return(numpy.histogram(values, bins = bins, range = value_range, weights = counts))
+
+def _merge_cells(x, y, counts):
+    # Function that adds up the counts of equal (x, y) cells and returns the
+    # distinct cells sorted by x, then y. Cells are sorted on a single int64
+    # key (x - min x) * span + (y - min y) when the coordinate ranges allow it
+    # and with lexsort otherwise; the stable sort takes close to linear time
+    # on input made of a few already sorted runs
+    if len(x) == 0:
+        return(x, y, counts)
+    low_x, high_x = int(x.min()), int(x.max())
+    low_y, high_y = int(y.min()), int(y.max())
+    span = high_y - low_y + 1
+    if (high_x - low_x + 1) * span < 1 << 62:
+        keys = (x - low_x) * span + (y - low_y)
+        order = numpy.argsort(keys, kind = "stable")
+        keys = keys[order]
+        new = keys[1:] != keys[:-1]
+    else:
+        order = numpy.lexsort((y, x))
+        new = (x[order][1:] != x[order][:-1]) | (y[order][1:] != y[order][:-1])
+    x, y, counts = x[order], y[order], counts[order]
+    starts = numpy.flatnonzero(numpy.r_[True, new])
+    return(x[starts], y[starts], numpy.add.reduceat(counts, starts))
+
+class PairCounter:
+    # Class that counts (x, y) pairs of integers, the 2D counterpart of
+    # IntegerCounter. While the bounding box of the pairs is small the two
+    # axes are encoded into a single linear index into a dense grid and counted
+    # with bincount; once the grid would be too large the counts switch to a
+    # sparse (COO) table of occupied cells, so memory depends on the number
+    # of occupied cells and not on the coordinate ranges. The sparse table is
+    # kept as a few sorted runs of cells: every block of pairs becomes a new
+    # run and runs of similar size are merged (as in a binary counter), so
+    # counting n pairs takes O(n log n) work however many blocks they come
+    # in. Counters are mergeable
+    def __init__(self, max_dense_cells = 1 << 22):
+        self.max_dense_cells = max_dense_cells
+        self.x0 = None
+        self.y0 = None
+        self.dense = None
+        self.sparse = None
+
+    def add_many(self, x, y):
+        # Function that counts every pair in two arrays (or lists) of integers
+        x = numpy.asarray(x, dtype = numpy.int64)
+        y = numpy.asarray(y, dtype = numpy.int64)
+        if len(x) == 0:
+            return
+        if self.sparse is None and self._fit_dense(int(x.min()), int(x.max()), int(y.min()), int(y.max())) == True:
+            nx, ny = self.dense.shape
+            index = (x - self.x0) * ny + (y - self.y0)
+            self.dense += numpy.bincount(index, minlength = nx * ny).reshape(nx, ny)
+        else:
+            self.add_counts(x, y, numpy.ones(len(x), dtype = numpy.int64))
+
+    def add_counts(self, x, y, counts):
+        # Function that adds already-counted (x, y, count) cells, e.g. a table
+        # produced by another counter or read back from disk
+        x = numpy.asarray(x, dtype = numpy.int64)
+        y = numpy.asarray(y, dtype = numpy.int64)
+        counts = numpy.asarray(counts, dtype = numpy.int64)
+        if len(x) == 0:
+            return
+        if self.sparse is None and self._fit_dense(int(x.min()), int(x.max()), int(y.min()), int(y.max())) == True:
+            numpy.add.at(self.dense, (x - self.x0, y - self.y0), counts)
+            return
+        self._to_sparse()
+        runs = self.sparse
+        runs.append(_merge_cells(x, y, counts))
+        # Merging the newest run into the one before while that one is no
+        # more than twice as large keeps the number of runs logarithmic
+        while len(runs) > 1 and len(runs[-2][0]) <= 2 * len(runs[-1][0]):
+            last = runs.pop()
+            before = runs.pop()
+            runs.append(_merge_cells(*(numpy.r_[a, b] for a, b in zip(before, last))))
+
+    def merge(self, other):
+        # Function that adds the counts of another PairCounter to this one
+        self.add_counts(*other.table())
+        return(self)
+
+    def _fit_dense(self, low_x, high_x, low_y, high_y):
+        # Function that grows the dense grid to cover the given bounds; returns
+        # False (leaving the counter unchanged) if it would exceed max_dense_cells
+        if self.dense is not None:
+            nx, ny = self.dense.shape
+            low_x, high_x = min(low_x, self.x0), max(high_x, self.x0 + nx - 1)
+            low_y, high_y = min(low_y, self.y0), max(high_y, self.y0 + ny - 1)
+        new_nx = high_x - low_x + 1
+        new_ny = high_y - low_y + 1
+        if new_nx * new_ny > self.max_dense_cells:
+            return(False)
+        if self.dense is None:
+            self.dense = numpy.zeros((new_nx, new_ny), dtype = numpy.int64)
+        elif (new_nx, new_ny) != self.dense.shape:
+            grown = numpy.zeros((new_nx, new_ny), dtype = numpy.int64)
+            grown[self.x0-low_x:self.x0-low_x+nx, self.y0-low_y:self.y0-low_y+ny] = self.dense
+            self.dense = grown
+        self.x0 = low_x
+        self.y0 = low_y
+        return(True)
+
+    def _to_sparse(self):
+        if self.sparse is not None:
+            return
+        runs = []
+        if self.dense is not None:
+            runs.append(self.table())
+            self.dense = None
+        self.sparse = runs
+
+    def table(self):
+        # Function that returns the occupied cells as three numpy arrays of
+        # equal length: x values, y values and counts (sorted by x, then y)
+        if self.sparse is not None:
+            if len(self.sparse) > 1:
+                self.sparse = [_merge_cells(*(numpy.concatenate(arrays) for arrays in zip(*self.sparse)))]
+            if self.sparse:
+                return(self.sparse[0])
+        if self.sparse is not None or self.dense is None:
+            return(numpy.zeros(0, dtype = numpy.int64), numpy.zeros(0, dtype = numpy.int64), numpy.zeros(0, dtype = numpy.int64))
+        ix, iy = numpy.nonzero(self.dense)
+        return(ix + self.x0, iy + self.y0, self.dense[ix, iy])
+
+    def total(self):
+        # Function that returns the number of pairs counted
+        return(int(self.table()[2].sum()))
+
+    def marginal(self, axis):
+        # Function that returns the counts of one axis (0 for x, 1 for y) as an
+        # IntegerCounter
+        table = self.table()
+        counter = IntegerCounter()
+        values, inverse = numpy.unique(table[axis], return_inverse = True)
+        counter.add_counts(values, numpy.bincount(inverse, weights = table[2]).astype(numpy.int64))
+        return(counter)
+
+    def histogram2d(self, edges_x, edges_y):
+        # Function that returns the 2D array of counts in the bins given by the
+        # edges, exactly as numpy.histogram2d would for the list of all pairs
+        x, y, counts = self.table()
+        return(numpy.histogram2d(x, y, bins = [edges_x, edges_y], weights = counts)[0])
+
+def bin_edges(counter, bins, binning = "integer"):
+    # Function that returns histogram bin edges for the values counted in an
+    # IntegerCounter. binning is one of:
+    #   integer  -- one bin centred on every integer; when the range of values
+    #               is wider than bins, each bin covers the same whole number
+    #               of integers instead
+    #   fixed    -- bins of equal width covering the range of values
+    #   log      -- bins of equal width on a log scale (values must be positive)
+    #   quantile -- bins holding roughly equal numbers of values
+    values, counts = counter.table()
+    low = int(values[0])
+    high = int(values[-1])
+    if binning == "integer":
+        width = -(-(high - low + 1) // bins)
+        return(low - 0.5 + numpy.arange(-(-(high - low + 1) // width) + 1) * width)
+    if binning == "fixed":
+        return(numpy.linspace(low - 0.5, high + 0.5, min(bins, high - low + 1) + 1))
+    if binning == "log":
+        if low <= 0:
+            raise ValueError("log binning needs all values to be positive")
+        return(numpy.geomspace(low - 0.5 if low > 1 else 0.5, high + 0.5, bins + 1))
+    if binning == "quantile":
+        cumulative = numpy.cumsum(counts)
+        targets = numpy.linspace(0, cumulative[-1], bins + 1)[1:-1]
+        inner = values[numpy.searchsorted(cumulative, targets, side = "left")] + 0.5
+        return(numpy.unique(numpy.r_[low - 0.5, inner, high + 0.5]))
+    raise ValueError(f"unknown binning: {binning}")
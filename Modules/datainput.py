@@ -0,0 +1,213 @@
+#! /usr/bin/python
+
+# Author: Addison Martin
+# This script is a helper for the Datason package
+# It provides the input layer used by modules that read large files. Input
+# is handed to the modules as an iterator of bytes-like blocks:
+#   - uncompressed files are memory-mapped window by window, so they are
+#     never copied into read buffers, and stdin is read in large blocks
+#   - gzip files (and gzip on stdin) are decompressed block by block
+#   - BGZF files (blocked gzip as written by bgzip/samtools) are split into
+#     their independent blocks which are decompressed in parallel threads
+# The format is detected from the first bytes of the input, not the name.
+# Blocks are fetched on a background thread that stays up to two blocks
+# ahead (double buffering), so while a module parses one block the next is
+# already being read or decompressed and the total time approaches the
+# larger of the I/O and processing times rather than their sum. The time
+# the module waits for blocks is timed as the "read" stage, which also
+# counts the bytes handed to the modules (see instrument.py).
+
+import sys, os, gzip, mmap, struct, zlib, queue, threading
+from concurrent.futures import ThreadPoolExecutor
+from instrument import timed_iter
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+def detect_format(head):
+    # Function that returns "bgzf", "gzip" or "plain" for the first bytes of an input
+    # BGZF is gzip with the FEXTRA flag set and a "BC" extra subfield
+    if head[:2] != GZIP_MAGIC:
+        return("plain")
+    if len(head) >= 16 and head[3] & 4 and head[12:14] == b"BC":
+        return("bgzf")
+    return("gzip")
+
+def file_format(path):
+    # Function that returns the detected format of the file at path, or None
+    # when it is not a regular file (a pipe, /dev/stdin, ...) as reading its
+    # first bytes would take them away from whoever reads it next
+    if not os.path.isfile(path):
+        return(None)
+    with open(path, "rb") as f:
+        return(detect_format(f.read(18)))
+
+def _read_bgzf_block(stream):
+    # Function that reads one raw BGZF block from a stream and returns the
+    # deflate payload of the block (or None at the end of the stream)
+    header = stream.read(12)
+    if len(header) < 12:
+        return(None)
+    if header[:2] != GZIP_MAGIC:
+        raise ValueError("Input is not a valid BGZF file")
+    xlen = struct.unpack("<H", header[10:12])[0]
+    extra = stream.read(xlen)
+    block_size = None
+    pos = 0
+    while pos + 4 <= len(extra):
+        subfield_id = extra[pos:pos+2]
+        subfield_len = struct.unpack("<H", extra[pos+2:pos+4])[0]
+        if subfield_id == b"BC":
+            block_size = struct.unpack("<H", extra[pos+4:pos+6])[0] + 1
+        pos += 4 + subfield_len
+    if block_size == None:
+        raise ValueError("Input is not a valid BGZF file (missing BC subfield)")
+    rest = stream.read(block_size - 12 - xlen)
+    # Trailing 8 bytes of each block are its CRC32 and uncompressed size
+    return(rest[:-8])
+
+def _inflate(payload):
+    return(zlib.decompress(payload, -15))
+
+def iter_bgzf_blocks(stream, threads = 4, batch = 64):
+    # Generator that yields the decompressed contents of a BGZF stream. Blocks
+    # are read sequentially and inflated in batches across worker threads
+    # (zlib releases the GIL while decompressing); output order is preserved
+    with ThreadPoolExecutor(max_workers = threads) as pool:
+        while True:
+            payloads = []
+            while len(payloads) < batch * threads:
+                payload = _read_bgzf_block(stream)
+                if payload == None: break
+                payloads.append(payload)
+            if not payloads:
+                break
+            data = b"".join(pool.map(_inflate, payloads))
+            if data:
+                yield data
+
+def prefetch(blocks, depth = 2, join_timeout = 10):
+    # Generator that yields the blocks of an iterable while a background
+    # thread already fetches the next ones (up to depth blocks ahead), so
+    # reading and decompressing overlap with the processing of the previous
+    # block; file reads and zlib release the GIL while they wait or work.
+    # Errors raised while fetching are raised here. If the consumer stops
+    # early the thread stops at its next block; the block it is reading is
+    # waited for (up to join_timeout seconds), as a thread still reading from
+    # stdin when the interpreter exits makes it abort
+    results = queue.Queue(maxsize = depth)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                results.put(item, timeout = 0.1)
+                return(True)
+            except queue.Full:
+                continue
+        return(False)
+
+    def fetch():
+        try:
+            for block in blocks:
+                if put((block, None)) == False: return
+            put((_END, None))
+        except BaseException as error:
+            put((_END, error))
+
+    thread = threading.Thread(target = fetch, name = "datason-prefetch", daemon = True)
+    thread.start()
+    try:
+        while True:
+            block, error = results.get()
+            if block is _END:
+                if error != None: raise error
+                return
+            yield block
+    finally:
+        stop.set()
+        thread.join(join_timeout)
+
+# Marker for the end of the blocks fetched by prefetch
+_END = object()
+
+def _stream_blocks(stream, block_size, threads, live):
+    # Generator that yields decompressed blocks from a buffered binary stream
+    head = stream.peek(18)[:18] if hasattr(stream, "peek") else b""
+    fmt = detect_format(head)
+    if fmt == "bgzf":
+        yield from iter_bgzf_blocks(stream, threads, 1 if live == True else 64)
+        return
+    if fmt == "gzip":
+        stream = gzip.GzipFile(fileobj = stream, mode = "rb")
+    read = stream.read1 if live == True and hasattr(stream, "read1") else stream.read
+    yield from iter(lambda: read(block_size), b"")
+
+def _mapped_blocks(f, block_size):
+    # Generator that yields an uncompressed regular file as read-only memory
+    # maps of about block_size bytes each, so its contents are never copied
+    # into buffers. Each window is advised as needed soon when it is mapped,
+    # which is one or two windows ahead of the one being processed (see
+    # prefetch), so the kernel reads it in while the previous one is parsed
+    size = os.fstat(f.fileno()).st_size
+    window = max(block_size - block_size % mmap.ALLOCATIONGRANULARITY, mmap.ALLOCATIONGRANULARITY)
+    for offset in range(0, size, window):
+        mm = mmap.mmap(f.fileno(), min(window, size - offset), access = mmap.ACCESS_READ, offset = offset)
+        if hasattr(mm, "madvise"): mm.madvise(mmap.MADV_WILLNEED)
+        yield mm
+
+def _file_blocks(path, block_size, threads):
+    # Generator that yields the (decompressed) contents of the file at path;
+    # uncompressed regular files are memory-mapped window by window
+    with open(path, "rb") as f:
+        if os.path.isfile(path) and detect_format(f.peek(18)[:18]) == "plain":
+            yield from _mapped_blocks(f, block_size)
+        else:
+            yield from _stream_blocks(f, block_size, threads, False)
+
+def _range_blocks(path, start, end, block_size):
+    # Generator that yields the bytes of a file between start and end
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = f.read(min(block_size, remaining))
+            if not block: break
+            remaining -= len(block)
+            yield block
+
+def iter_stream_blocks(stream, block_size = 1 << 22, threads = 4, live = False):
+    # Generator that yields decompressed blocks from a buffered binary stream
+    # (e.g. sys.stdin.buffer), detecting gzip and BGZF from its first bytes.
+    # Blocks are block_size bytes unless live is True, in which case whatever
+    # has arrived is handed over without waiting for a full block (for slow,
+    # long running streams that are reported on as they go)
+    yield from timed_iter(prefetch(_stream_blocks(stream, block_size, threads, live)), "read", count_bytes = True)
+
+def iter_file_blocks(path, block_size = 1 << 22, threads = 4):
+    # Generator that yields the (decompressed) contents of the file at path
+    yield from timed_iter(prefetch(_file_blocks(path, block_size, threads)), "read", count_bytes = True)
+
+def iter_range_blocks(path, start, end, block_size = 1 << 22):
+    # Generator that yields the bytes of the file at path between the offsets
+    # start and end (e.g. one chunk of a file split for parallel processing)
+    yield from timed_iter(prefetch(_range_blocks(path, start, end, block_size)), "read", count_bytes = True)
+
+def iter_input_blocks(path = None, block_size = 1 << 22, threads = 4, live = False):
+    # Generator that yields the contents of path, or of stdin when path is
+    # None (see iter_stream_blocks for live)
+    if path == None:
+        yield from iter_stream_blocks(sys.stdin.buffer, block_size, threads, live)
+    else:
+        yield from iter_file_blocks(path, block_size, threads)
+
+def input_blocks(path = None, verbose = False, live = False):
+    # Function that returns the blocks of a module's input: the file at path
+    # or, when path is None, piped input (quits when there is none)
+    if path != None:
+        if verbose == True: print(f"Received an -in argument; reading from file {path}")
+        return(iter_input_blocks(os.path.abspath(path)))
+    if verbose == True: print(f"Received no -in argument; using pipe input")
+    if sys.stdin.isatty():
+        print("No piped input to script and no in file. Quitting...")
+        exit()
+    return(iter_input_blocks(None, live = live))
@@ -7,25 +7,240 @@
 # likely a csv file). This is intended to quickly give you the index of
 # a column instead of opening a file and counting the headers manually. The
 # script will take in the file and print results to the command line
+# With --profile the whole file is streamed (in parallel chunks for large
+# uncompressed files) and every column is summarised: its inferred type,
+# number of nulls, minimum, maximum and approximate number of distinct
+# values. Memory use does not grow with the size of the file: rows are
+# handled in batches and distinct values are counted with HyperLogLog
+# sketches, which are merged across chunks
 
-import argparse, os
+import argparse, os, csv, gzip
+
+# Values counted as nulls when profiling
+NULL_VALUES = ["", "NA", "N/A", "NaN", "nan", "NULL", "null", "None", "."]
+_NULL_SET = set(NULL_VALUES)
+# Types a column can be inferred as; a column has the last (most general)
+# type that fits every non-null value
+TYPES = ["empty", "integer", "float", "string"]
+# Number of rows profiled at once
+BATCH_ROWS = 1 << 16
+
+def open_text(path):
+    # Function that opens a plain, gzip or bgzip compressed text file for reading
+    with open(path, "rb") as f:
+        compressed = f.read(2) == b"\x1f\x8b"
+    if compressed:
+        return(gzip.open(path, "rt", newline = "", errors = "replace"))
+    return(open(path, "r", newline = "", errors = "replace"))
+
+def row_reader(lines, sep):
+    # Function that splits lines into fields; single character separators are
+    # read as CSV (so quoted fields may hold separators, quotes and line
+    # breaks), longer separators are split on directly
+    if len(sep) == 1:
+        return(csv.reader(lines, delimiter = sep))
+    return(line.rstrip("\r\n").split(sep) for line in lines)
 
 def main_block(in_file, sep, starting_index):
     # Function that does the main task of parsing out the first row of the file,
     # splitting up the first row based on the seperator, and
-    # printing out the 
-    header = in_file.readline()
-    separated_header = header.split(sep)
-    i = starting_index
-    j = 0
+    # printing out the enumerated headers
+    separated_header = next(row_reader(in_file, sep), [])
     print(f"The file contains the following {len(separated_header)} column headers as indexed: (starting with index of {starting_index} as first index)")
-    for title in separated_header:
-        print(f"{i} - {separated_header[j]}")
-        i =+ 1
-        j =+ 1
+    for i, title in enumerate(separated_header, starting_index):
+        print(f"{i} - {title}")
+
+class ColumnProfile:
+    # Class that accumulates the summary of one column. Profiles are
+    # mergeable so chunks of a file can be profiled separately
+    def __init__(self):
+        from sketches import HyperLogLog
+        self.count = 0
+        self.nulls = 0
+        self.type = 0
+        self.num_min = None
+        self.num_max = None
+        self.str_min = None
+        self.str_max = None
+        self.distinct = HyperLogLog()
+
+    def add(self, values):
+        # Function that adds a batch of values (strings) of the column
+        # The values stay a list: a fixed width numpy string array would pad
+        # every value to the longest one in the batch
+        import numpy
+        present = [value for value in values if value not in _NULL_SET]
+        self.count += len(values)
+        self.nulls += len(values) - len(present)
+        if len(present) == 0:
+            return
+        self.distinct.add_strings(present)
+        self._update_strings(min(present), max(present))
+        # Numbers are only parsed until the column is known to hold strings
+        if self.type < TYPES.index("string"):
+            numbers = None
+            if self.type <= TYPES.index("integer"):
+                try:
+                    numbers = numpy.array(present, dtype = numpy.int64)
+                    self.type = TYPES.index("integer")
+                except (ValueError, OverflowError):
+                    pass
+            if numbers is None:
+                try:
+                    numbers = numpy.array(present, dtype = numpy.float64)
+                    self.type = TYPES.index("float")
+                except ValueError:
+                    self.type = TYPES.index("string")
+            if numbers is not None:
+                self._update_numbers(numbers.min().item(), numbers.max().item())
+
+    def _update_numbers(self, low, high):
+        if self.num_min == None or low < self.num_min: self.num_min = low
+        if self.num_max == None or high > self.num_max: self.num_max = high
+
+    def _update_strings(self, low, high):
+        if self.str_min == None or low < self.str_min: self.str_min = low
+        if self.str_max == None or high > self.str_max: self.str_max = high
+
+    def merge(self, other):
+        # Function that adds the profile of the same column from another chunk
+        self.count += other.count
+        self.nulls += other.nulls
+        self.type = max(self.type, other.type)
+        if other.num_min != None: self._update_numbers(other.num_min, other.num_max)
+        if other.str_min != None: self._update_strings(other.str_min, other.str_max)
+        self.distinct.merge(other.distinct)
+
+    def type_name(self):
+        return(TYPES[self.type])
+
+    def range(self):
+        # Function that returns the (minimum, maximum) of the column: numeric
+        # for numeric columns and alphabetical otherwise
+        if self.type_name() in ("integer", "float"):
+            return(self.num_min, self.num_max)
+        return(self.str_min, self.str_max)
+
+class TableProfile:
+    # Class that accumulates the ColumnProfiles of a table with ncols columns
+    def __init__(self, ncols):
+        self.rows = 0
+        self.ragged = 0
+        self.columns = [ColumnProfile() for _ in range(ncols)]
+
+    def add_rows(self, rows):
+        # Function that adds rows (lists of fields) in batches; rows with a
+        # different number of fields are counted, cut or padded with nulls
+        from itertools import islice
+        ncols = len(self.columns)
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, BATCH_ROWS))
+            if not batch:
+                break
+            if min(map(len, batch)) != ncols or max(map(len, batch)) != ncols:
+                batch = self._fix_lengths(batch, ncols)
+            if batch:
+                self._add_batch(batch)
+
+    def _fix_lengths(self, batch, ncols):
+        # Function that drops blank lines and cuts or pads ragged rows
+        fixed = []
+        for row in batch:
+            if len(row) != ncols:
+                if len(row) == 0 or row == [""]:
+                    continue
+                self.ragged += 1
+                row = (row + [""] * ncols)[:ncols]
+            fixed.append(row)
+        return(fixed)
+
+    def _add_batch(self, batch):
+        self.rows += len(batch)
+        for column, values in zip(self.columns, zip(*batch)):
+            column.add(values)
 
-def main():
-    parser = argparse.ArgumentParser(description = "This module takes as an input a text file (likely a csv) and will display all of the headers in the frst row of the file enumerated. This script was created when I found it annoying to have to manually count the headers names in my csv files to determine the index that I should use when wanting to isolate a particular column for a simple awk command. This module uses the comma character as its default separator, however other separators can be used with the -s/--sep flag. The --index flag can be used to change the first index (probably 0 or 1 because of either using zero- or one-based indexing; the default is set to zero to be in concordance with awk indexing).")
+    def merge(self, other):
+        self.rows += other.rows
+        self.ragged += other.ragged
+        for column, other_column in zip(self.columns, other.columns):
+            column.merge(other_column)
+
+def line_chunks(path, chunk_size):
+    # Function that splits an uncompressed file into (start, end) byte ranges
+    # of about chunk_size bytes that begin at the start of a line
+    size = os.path.getsize(path)
+    starts = [0]
+    with open(path, "rb") as f:
+        for guess in range(chunk_size, size, chunk_size):
+            if guess <= starts[-1]:
+                continue
+            f.seek(guess - 1)
+            f.readline()
+            if f.tell() < size:
+                starts.append(f.tell())
+    return(list(zip(starts, starts[1:] + [size])))
+
+def profile_range(path, start, end, sep, ncols):
+    # Function that profiles the lines of an uncompressed file that start in
+    # [start, end); the header line is skipped by the chunk starting at 0
+    def lines():
+        with open(path, "rb") as f:
+            f.seek(start)
+            pos = start
+            for line in f:
+                if pos >= end: break
+                pos += len(line)
+                yield(line.decode(errors = "replace"))
+    rows = row_reader(lines(), sep)
+    if start == 0:
+        next(rows, None)
+    profile = TableProfile(ncols)
+    profile.add_rows(rows)
+    return(profile)
+
+def profile_file(path, sep, ncols, jobs = 1, chunk_size = 64 << 20):
+    # Function that returns the TableProfile of a file. Large uncompressed
+    # files are split into line-aligned chunks profiled in a process pool
+    # when jobs > 1; compressed files are streamed in one process
+    with open(path, "rb") as f:
+        compressed = f.read(2) == b"\x1f\x8b"
+    if jobs > 1 and not compressed and os.path.getsize(path) > chunk_size:
+        from concurrent.futures import ProcessPoolExecutor
+        profile = TableProfile(ncols)
+        with ProcessPoolExecutor(max_workers = jobs) as pool:
+            for part in pool.map(profile_range, *zip(*[(path, start, end, sep, ncols) for start, end in line_chunks(path, chunk_size)])):
+                profile.merge(part)
+        return(profile)
+    with open_text(path) as in_file:
+        rows = row_reader(in_file, sep)
+        next(rows, None)
+        profile = TableProfile(ncols)
+        profile.add_rows(rows)
+    return(profile)
+
+def _format_value(value, width = 24):
+    if value == None: return("")
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15: value = int(value)
+    text = str(value)
+    return(text if len(text) <= width else text[:width - 3] + "...")
+
+def print_profile(profile, header, starting_index):
+    # Function that prints the profile of every column as a table
+    print(f"Rows: {profile.rows}")
+    print(f"Columns: {len(header)}")
+    if profile.ragged > 0:
+        print(f"Note: {profile.ragged} row(s) did not have {len(header)} fields; missing fields were counted as nulls and extra fields were ignored")
+    table = [["index", "name", "type", "nulls", "min", "max", "~distinct"]]
+    for i, (name, column) in enumerate(zip(header, profile.columns), starting_index):
+        low, high = column.range()
+        table.append([str(i), _format_value(name), column.type_name(), str(column.nulls), _format_value(low), _format_value(high), str(round(column.distinct.estimate()))])
+    widths = [max(len(row[k]) for row in table) for k in range(len(table[0]))]
+    for row in table:
+        print("  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip())
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "This module takes as an input a text file (likely a csv, optionally gzip compressed) and will display all of the headers in the frst row of the file enumerated. This script was created when I found it annoying to have to manually count the headers names in my csv files to determine the index that I should use when wanting to isolate a particular column for a simple awk command. This module uses the comma character as its default separator, however other separators can be used with the -s/--sep flag; quoted fields are read as in CSV. The --index flag can be used to change the first index (probably 0 or 1 because of either using zero- or one-based indexing; the default is set to zero to be in concordance with awk indexing). The --profile flag reads the whole file and displays the inferred type, number of nulls, minimum, maximum and approximate number of distinct values of every column.")
     parser.add_argument(
         "-v", "--verbose",
         action = "store_true",
@@ -37,7 +252,7 @@ def main():
         type = str)
     parser.add_argument(
         "-s", "--sep",
-        help = "Character (or string of characters) used as separator in this file",
+        help = "Character (or string of characters) used as separator in this file; \\t can be used for tabs",
         type = str,
         required = False,
         default = ",",
@@ -48,11 +263,45 @@ def main():
         type = int,
         required = False,
         default = 0)
-    args = parser.parse_args()
+    parser.add_argument(
+        "--profile",
+        help = "Reads the whole file and profiles every column",
+        action = "store_true",
+        dest = "profile")
+    parser.add_argument(
+        "-j", "--jobs",
+        help = "Number of processes used to profile large uncompressed files; 0 uses all cores (default 1). Files are split at line breaks, so quoted fields that contain line breaks need -j 1",
+        type = int,
+        default = 1,
+        dest = "jobs")
+    parser.add_argument(
+        "--chunk_size",
+        help = "Size in MB of the chunks that files are split into for -j (default 64)",
+        type = int,
+        default = 64,
+        dest = "chunk_size")
+    args = parser.parse_args(argv)
+    if args.verbose == True: print(f"The following arguments were received: {args}") # for troubleshooting
+    if args.sep == "\\t": args.sep = "\t"
+    if args.jobs == 0: args.jobs = os.cpu_count()
 
     print(f"Reading file: {os.path.abspath(args.in_file)}")
-    with open(args.in_file, "r") as in_file:
-        main_block(in_file, args.sep, args.index)
+    if args.profile == False:
+        with open_text(args.in_file) as in_file:
+            main_block(in_file, args.sep, args.index)
+        return
+
+    with open_text(args.in_file) as in_file:
+        header = next(row_reader(in_file, args.sep), [])
+    if len(header) == 0:
+        print("The file is empty. Quitting...")
+        exit()
+    if args.verbose == True: print(f"Profiling {len(header)} columns using {args.jobs} process(es)")
+    from instrument import stage
+    with stage("profile"):
+        profile = profile_file(args.in_file, args.sep, len(header), args.jobs, max(args.chunk_size, 1) << 20)
+    with stage("report"):
+        print_profile(profile, header, args.index)
 
 if __name__ == "__main__":
     main()
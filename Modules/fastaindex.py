@@ -0,0 +1,157 @@
+#! /usr/bin/python
+
+# Author: Addison Martin
+# This script is a helper for the Datason package
+# It reads and writes samtools-compatible fasta index (.fai) files and the
+# small JSON statistics sidecar (.dsstats) that fastastats keeps next to
+# indexed fasta files. Each .fai line holds the sequence name, its length,
+# the byte offset of its first base, the number of bases per line and the
+# number of bytes per line, which is enough to fetch any record (or any
+# sub-range of a record) straight from the file without scanning it.
+
+import os, json, hashlib
+import numpy
+from collections import namedtuple
+
+FaiEntry = namedtuple("FaiEntry", ["name", "length", "offset", "linebases", "linewidth"])
+
+SIDECAR_VERSION = 2
+# Number of bytes hashed at the start and at the end of a file for its signature
+_SIGNATURE_BYTES = 1 << 16
+# Size of the blocks of a file that are checksummed one by one in the sidecar
+_CHECKSUM_BLOCK = 1 << 22
+
+def index_records(buf, start = 0):
+    # Generator that scans a buffer (usually an mmap of an uncompressed fasta
+    # file) from start, which must be 0 or the offset of a ">" beginning a
+    # record. For every record it yields (record_offset, FaiEntry, sequence),
+    # where record_offset is the offset of the ">" and sequence is the record's
+    # bases with line breaks removed
+    size = len(buf)
+    if start == 0 and buf[0:1] != b">":
+        idx = buf.find(b"\n>")
+        if idx == -1: return
+        start = idx + 1
+    while start < size:
+        header_end = buf.find(b"\n", start)
+        if header_end == -1: header_end = size
+        next_record = buf.find(b"\n>", header_end)
+        end = size if next_record == -1 else next_record + 1
+        header = buf[start+1:header_end].strip()
+        region = buf[header_end+1:end]
+        first_line = region.find(b"\n")
+        if first_line == -1: first_line = len(region)
+        linewidth = first_line + 1
+        linebases = first_line - (1 if region[first_line-1:first_line] == b"\r" else 0)
+        sequence = region.translate(None, b"\r\n \t")
+        name = header.split()[0].decode() if header else ""
+        if not _uniform_lines(region, len(sequence), linebases, linewidth):
+            raise ValueError(f"different line length in sequence '{name}'")
+        yield(start, FaiEntry(name, len(sequence), header_end + 1, linebases, linewidth), sequence)
+        start = end
+
+def _uniform_lines(region, length, linebases, linewidth):
+    # Function that checks that every line of a record's sequence region has
+    # the same layout as its first line (only the last line may be shorter),
+    # which is what makes offsets computed from the .fai correct
+    region = region.rstrip(b"\r\n")
+    if length == 0:
+        return(len(region) == 0)
+    if linebases == 0:
+        return(False)
+    line_ends = numpy.flatnonzero(numpy.frombuffer(region, dtype = numpy.uint8) == 10)
+    if len(line_ends) != (length - 1) // linebases:
+        return(False)
+    if not numpy.array_equal(line_ends, numpy.arange(1, len(line_ends) + 1) * linewidth - 1):
+        return(False)
+    return(len(region) == (len(line_ends) * linewidth) + length - len(line_ends) * linebases)
+
+def fetch_sequence(buf, entry, begin = 0, end = None):
+    # Function that returns bases begin..end (0-based, end exclusive) of the
+    # record described by a FaiEntry, reading only that part of the buffer
+    if end == None or end > entry.length: end = entry.length
+    if begin >= end or entry.linebases == 0:
+        return(b"")
+    first = entry.offset + (begin // entry.linebases) * entry.linewidth + begin % entry.linebases
+    last = entry.offset + ((end - 1) // entry.linebases) * entry.linewidth + (end - 1) % entry.linebases
+    return(buf[first:last+1].translate(None, b"\r\n \t"))
+
+def read_fai(path):
+    # Function that reads a .fai file into a list of FaiEntry
+    entries = []
+    with open(path, "r") as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            entries.append(FaiEntry(fields[0], *[int(field) for field in fields[1:5]]))
+    return(entries)
+
+def write_fai(path, entries):
+    # Function that writes a list of FaiEntry as a .fai file
+    with open(path, "w") as f:
+        for entry in entries:
+            f.write("\t".join(str(field) for field in entry) + "\n")
+
+def file_signature(path, size):
+    # Function that returns a content hash of the first size bytes of a file,
+    # made from its first and last 64 KB so it is cheap to compute for any size
+    digest = hashlib.blake2b(str(size).encode(), digest_size = 16)
+    with open(path, "rb") as f:
+        digest.update(f.read(min(size, _SIGNATURE_BYTES)))
+        if size > _SIGNATURE_BYTES:
+            f.seek(max(_SIGNATURE_BYTES, size - _SIGNATURE_BYTES))
+            digest.update(f.read(size - max(_SIGNATURE_BYTES, size - _SIGNATURE_BYTES)))
+    return(digest.hexdigest())
+
+def block_checksums(path, size, known = [], known_size = 0):
+    # Function that returns the checksums of the first size bytes of a file,
+    # one per block of _CHECKSUM_BLOCK bytes (the last one may be shorter).
+    # known are the verified checksums of the first known_size bytes; those
+    # of whole blocks are reused rather than reading the blocks again
+    checksums = list(known[:min(known_size, size) // _CHECKSUM_BLOCK])
+    with open(path, "rb") as f:
+        f.seek(len(checksums) * _CHECKSUM_BLOCK)
+        remaining = size - len(checksums) * _CHECKSUM_BLOCK
+        while remaining > 0:
+            block = f.read(min(_CHECKSUM_BLOCK, remaining))
+            if not block: break
+            remaining -= len(block)
+            checksums.append(hashlib.blake2b(block, digest_size = 16).hexdigest())
+    return(checksums)
+
+def read_sidecar(path):
+    # Function that returns the sidecar dictionary stored at path, or None if
+    # there is no usable sidecar
+    try:
+        with open(path, "r") as f:
+            sidecar = json.load(f)
+    except (OSError, ValueError):
+        return(None)
+    if sidecar.get("version") != SIDECAR_VERSION:
+        return(None)
+    return(sidecar)
+
+def write_sidecar(path, sidecar):
+    # Function that writes the sidecar dictionary to path (atomically, so an
+    # interrupted run never leaves a half written sidecar behind)
+    sidecar["version"] = SIDECAR_VERSION
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(sidecar, f)
+    os.replace(temp_path, path)
+
+def sidecar_status(path, sidecar):
+    # Function that compares a sidecar with the current state of the fasta file
+    # at path. Returns "valid" if the file is unchanged (same size and
+    # modification time and the same signature), "appended" if the file only
+    # grew and "stale" otherwise. A file only counts as appended to if every
+    # block of the bytes it had when the sidecar was written still has its
+    # recorded checksum, so an edit anywhere in the old part (not just at its
+    # start or end) makes the saved statistics stale
+    if sidecar == None:
+        return("stale")
+    stat = os.stat(path)
+    if stat.st_size == sidecar["size"] and stat.st_mtime_ns == sidecar["mtime"] and file_signature(path, stat.st_size) == sidecar["hash"]:
+        return("valid")
+    if stat.st_size > sidecar["size"] and stat.st_mtime_ns >= sidecar["mtime"] and file_signature(path, sidecar["size"]) == sidecar["hash"] and block_checksums(path, sidecar["size"]) == sidecar["blocks"]:
+        return("appended")
+    return("stale")
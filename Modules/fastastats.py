@@ -5,13 +5,22 @@
 # This script takes as its input either a pipe or a file
 # The pipe or file is a fasta file. The script will spit out
 # various statistics for all sequences in the file and saves
-# a histogram of fasta lengths at the designated path.
+# a histogram of fasta lengths at the designated path (if one is given).
 # Intended for quick summative analysis of contents of fasta
-# files.
+# files. The same pass over the records can also count k-mers and
+# dinucleotides and write a table with the length, GC content and N count
+# of every record. Records can be filtered (by length or header) and
+# subsampled before they are counted, and the kept records written out as
+# fasta in the same pass.
 
-import matplotlib, sys, os, argparse, statistics
-import matplotlib.pyplot as plt
-matplotlib.use('Agg')
+import sys, os, argparse, mmap, re, shutil, gzip, hashlib
+import numpy
+from concurrent.futures import ProcessPoolExecutor
+from composition import Composition, KmerCounter, count_symbols, dinucleotide_bias, STRICT_GC_SYMBOLS, INCLUSIVE_GC_SYMBOLS, MAX_KMER_SIZE
+from counting import IntegerCounter
+from datainput import file_format, iter_file_blocks, iter_range_blocks, iter_stream_blocks
+from fastaindex import index_records, fetch_sequence, read_fai, write_fai, read_sidecar, write_sidecar, sidecar_status, file_signature, block_checksums
+from instrument import stage
 
 class Fasta:
     # Class to handle individual fasta sequences with their headers
@@ -19,65 +28,482 @@ class Fasta:
         self.head = str(header.replace("\n", "").replace(" ", ""))
         self.seq = str(sequence.replace("\n", "").replace(" ", ""))
 
-def import_fastas_as_list(source):
-    # Function that imports fasta files from either piped input or from file path
-    # Fasta sequences in the file will be returned as a list of all the
-    # fasta sequences in the file as Fasta objects (defined above)
-    # Source is intended to be the source as a string of characters
-    try:
-        # Removing comments that sometimes preceed actual fasta sequences in some fasta files
-        source = source[source.index(">"):]
-    except ValueError:
-        print("There was no greater than symbol in the file; it appears to not be a fasta file")
-        exit()
-    print(source)
-    split_fasta = source.split(">")
-    del split_fasta[0]
-    split_fasta = [fasta.split("\n",1) for fasta in split_fasta]
-    print(split_fasta)
-    return_list = [Fasta(fasta[0], fasta[1]) for fasta in split_fasta]
-    while return_list[0] == Fasta("",""):
-        del return_list[0]
-    return(return_list)
-
-def get_stats(fasta_list, inclusive_GC_status = False):
-    # Function that returns statistics about the Fasta obejcts in a list
-    # of Fasta objects. The returned statistics are returned as a tuple
-    # in the following order: GC content of all sequences, average sequence
-    # length, max sequence length, min sequence length, and median sequence
-    # length
-    if inclusive_GC_status == True: compare_set = set(["G", "C"])
-    else: compare_set = set(["G", "C", "R", "Y", "K", "M", "S", "B", "D", "H", "V", "N"])
-    total_bases = 0
-    g_or_c_bases = 0
-    fasta_count = 0
-    for fasta in fasta_list:
-        fasta_count += 1
-        total_bases += len(fasta.seq)
-        for base in fasta.seq:
-            if set(base) <= compare_set:
-                g_or_c_bases += 1
+def _records_from_blocks(blocks):
+    # Generator that turns an iterable of bytes-like blocks into fasta records
+    # Records are yielded one at a time as (header, sequence) tuples of bytes
+    # with the ">" and all line breaks/spaces removed. Only the record that is
+    # currently being assembled is held in memory, so memory use is bounded by
+    # the longest record rather than by the size of the input. Anything before
+    # the first line starting with ">" (e.g. comments) is skipped
+    parts = []
+    started = False
+    at_line_start = True
+    for block in blocks:
+        pos = 0
+        if not started:
+            # Looking for the first record in the input
+            if at_line_start and block[0:1] == b">":
+                started = True
             else:
+                idx = block.find(b"\n>")
+                if idx == -1:
+                    at_line_start = block[-1:] == b"\n"
+                    continue
+                pos = idx + 1
+                started = True
+        elif at_line_start and block[0:1] == b">" and parts:
+            # Record boundary falls exactly between two blocks
+            yield _make_record(parts)
+            parts = []
+        while True:
+            idx = block.find(b"\n>", pos)
+            if idx == -1:
+                parts.append(block[pos:])
+                break
+            parts.append(block[pos:idx+1])
+            yield _make_record(parts)
+            parts = []
+            pos = idx + 1
+        at_line_start = block[-1:] == b"\n"
+    if parts:
+        yield _make_record(parts)
+
+def _make_record(parts):
+    # Function that assembles the pieces of one record into a (header, sequence) tuple
+    record = parts[0] if len(parts) == 1 else b"".join(parts)
+    header, _, sequence = record.partition(b"\n")
+    return(header[1:].strip(), sequence.translate(None, b"\r\n \t"))
+
+def read_fasta_records(stream, block_size = 1 << 22):
+    # Generator that reads fasta records from a buffered binary stream
+    # (e.g. a file opened in "rb" mode or sys.stdin.buffer) block by block
+    # and yields them one at a time as (header, sequence) tuples of bytes;
+    # the next block is read in the background (see datainput.py)
+    return(_records_from_blocks(iter_stream_blocks(stream, block_size)))
+
+def import_fastas_as_list(stream):
+    # Function that imports all fasta sequences from a binary stream as a list
+    # of Fasta objects (defined above). Kept for callers that need random access
+    # to every record; get_stats works directly on read_fasta_records instead
+    return([Fasta(header.decode(), sequence.decode()) for header, sequence in read_fasta_records(stream)])
+
+class FastaStats:
+    # Class that accumulates statistics about fasta records: record count,
+    # total bases, min/max length, the distribution of lengths (as a compact
+    # count-per-length table, never a list of every length) and the base
+    # composition, and optionally k-mer counts (kmer_size, canonical) and
+    # dinucleotide counts. When record_sink (a text stream) is given a line
+    # with the ID, length, GC content and N count of every record is written
+    # to it as the record is added. Accumulators are mergeable, so statistics
+    # gathered for chunks of a file, or for several files, in different
+    # processes can be combined into exactly the statistics a serial run
+    # would produce
+    def __init__(self, kmer_size = None, canonical = False, dinucleotides = False, inclusive_gc = False, record_sink = None):
+        self.count = 0
+        self.total_bases = 0
+        self.min_length = None
+        self.max_length = None
+        self.lengths = IntegerCounter()
+        self.composition = Composition()
+        self.kmers = KmerCounter(kmer_size, canonical) if kmer_size != None else None
+        self.dinucleotides = KmerCounter(2) if dinucleotides == True else None
+        self.gc_symbols = INCLUSIVE_GC_SYMBOLS if inclusive_gc == True else STRICT_GC_SYMBOLS
+        self.record_sink = record_sink
+        # Records read but dropped by the filter stage (see filter_records)
+        self.skipped = 0
+
+    def add(self, sequence, header = None):
+        # Function that adds one sequence (and its header, used as the ID in
+        # the per-record table) to the statistics
+        length = len(sequence)
+        self.count += 1
+        self.total_bases += length
+        if self.min_length == None or length < self.min_length: self.min_length = length
+        if self.max_length == None or length > self.max_length: self.max_length = length
+        self.lengths.add(length)
+        counts = self.composition.add(sequence)
+        if self.kmers != None: self.kmers.add(sequence)
+        if self.dinucleotides != None: self.dinucleotides.add(sequence)
+        if self.record_sink != None:
+            record_id = header.split(None, 1)[0].decode(errors = "replace") if header else ""
+            gc = count_symbols(counts, self.gc_symbols) / length if length > 0 else 0.0
+            self.record_sink.write(f"{record_id}\t{length}\t{gc:.4f}\t{count_symbols(counts, 'N')}\n")
+
+    def merge(self, other):
+        # Function that adds the statistics of another FastaStats to this one
+        self.count += other.count
+        self.total_bases += other.total_bases
+        self.skipped += other.skipped
+        for length in (other.min_length, other.max_length):
+            if length == None: continue
+            if self.min_length == None or length < self.min_length: self.min_length = length
+            if self.max_length == None or length > self.max_length: self.max_length = length
+        self.lengths.merge(other.lengths)
+        self.composition.merge(other.composition)
+        if self.kmers != None and other.kmers != None: self.kmers.merge(other.kmers)
+        if self.dinucleotides != None and other.dinucleotides != None: self.dinucleotides.merge(other.dinucleotides)
+        return(self)
+
+    def mean(self):
+        return(self.total_bases/self.count)
+
+    def median(self):
+        return(self.lengths.median())
+
+    def to_dict(self):
+        # Function that returns the statistics as a JSON serializable dictionary
+        values, counts = self.lengths.table()
+        return({
+            "count": self.count,
+            "total_bases": self.total_bases,
+            "min_length": self.min_length,
+            "max_length": self.max_length,
+            "lengths": [values.tolist(), counts.tolist()],
+            "composition": self.composition.counts.tolist()})
+
+def stats_from_dict(data):
+    # Function that rebuilds a FastaStats from the output of FastaStats.to_dict
+    stats = FastaStats()
+    stats.count = data["count"]
+    stats.total_bases = data["total_bases"]
+    stats.min_length = data["min_length"]
+    stats.max_length = data["max_length"]
+    stats.lengths.add_counts(*data["lengths"])
+    stats.composition.counts += data["composition"]
+    return(stats)
+
+def collect_stats(records, stats = None):
+    # Function that consumes an iterable of (header, sequence) records as
+    # produced by read_fasta_records and returns a FastaStats accumulator
+    # (stats, or a new one). Records are consumed one at a time so the
+    # iterable can be a generator over a file of any size
+    if stats == None: stats = FastaStats()
+    for header, sequence in records:
+        stats.add(sequence, header)
+    return(stats)
+
+class RecordFilter:
+    # Class that decides which records pass the filter and sampling stage:
+    # records shorter than min_length, longer than max_length or whose header
+    # does not match the header_regex pattern are dropped; fraction keeps a
+    # deterministic subsample (a record is kept when a hash of its ID and the
+    # seed falls below the fraction, so the same records are kept in every
+    # run and by every worker process whatever order they are read in); and
+    # head keeps only the first that many records that pass the other tests
+    def __init__(self, min_length = None, max_length = None, header_regex = None, fraction = None, seed = 0, head = None):
+        self.min_length = min_length
+        self.max_length = max_length
+        self.header_regex = re.compile(header_regex.encode()) if header_regex != None else None
+        self.threshold = int(fraction * (1 << 64)) if fraction != None else None
+        self.key = str(seed).encode()
+        self.head = head
+        self.kept = 0
+
+    def keep(self, header, sequence):
+        # Function that returns True if the record passes and counts it as kept
+        length = len(sequence)
+        if self.min_length != None and length < self.min_length: return(False)
+        if self.max_length != None and length > self.max_length: return(False)
+        if self.header_regex != None and self.header_regex.search(header) == None: return(False)
+        if self.threshold != None:
+            record_id = header.split(None, 1)[0] if header else b""
+            if int.from_bytes(hashlib.blake2b(record_id, digest_size = 8, key = self.key).digest(), "little") >= self.threshold: return(False)
+        if self.full() == True: return(False)
+        self.kept += 1
+        return(True)
+
+    def full(self):
+        # Function that returns True once head records have been kept
+        return(self.head != None and self.kept >= self.head)
+
+# Line width of the fasta written for kept records
+FASTA_LINE_WIDTH = 60
+
+def write_fasta(sink, header, sequence, width = FASTA_LINE_WIDTH):
+    # Function that writes one record to a binary stream as fasta
+    lines = [sequence[i:i+width] for i in range(0, len(sequence), width)]
+    sink.write(b">" + header + b"\n" + b"".join(line + b"\n" for line in lines))
+
+def open_fasta_sink(path):
+    # Function that opens path to append fasta records to; gzip compressed
+    # when the name ends in .gz (appended gzip members form one valid file)
+    if path.endswith(".gz"):
+        return(gzip.open(path, "ab", compresslevel = 6))
+    return(open(path, "ab"))
+
+def filter_records(records, filters, stats = None, fasta_sink = None):
+    # Generator that passes on the (header, sequence) records that the
+    # RecordFilter filters keeps, counting the dropped ones in stats.skipped
+    # and writing the kept ones to fasta_sink (a binary stream) as they go.
+    # Once filters has kept its head records reading stops: records is
+    # closed, which also stops its background reading
+    if filters.full() == False:
+        for header, sequence in records:
+            if filters.keep(header, sequence) == False:
+                if stats != None: stats.skipped += 1
                 continue
-    len_fasta_list = [len(fasta.seq) for fasta in fasta_list]
-    return(g_or_c_bases/total_bases, total_bases/fasta_count, max(len_fasta_list), min(len_fasta_list), statistics.median(len_fasta_list))
-    #Tuple order: GC content, average, max, min, median
+            if fasta_sink != None: write_fasta(fasta_sink, header, sequence)
+            yield((header, sequence))
+            if filters.full() == True: break
+    if hasattr(records, "close"): records.close()
+
+def get_stats(records, inclusive_GC_status = False):
+    # Function that returns statistics about an iterable of (header, sequence)
+    # records. Base composition is counted in bulk on the raw bytes of each
+    # sequence and both GC content values are derived from that single pass.
+    # The returned statistics are returned as a tuple in the following order:
+    # GC content of all sequences, average sequence length, max sequence length,
+    # min sequence length, median sequence length, an IntegerCounter of sequence lengths,
+    # and the Composition of all sequences
+    stats = collect_stats(records)
+    if stats.count == 0:
+        print("There was no greater than symbol in the file; it appears to not be a fasta file")
+        exit()
+    return(stats.composition.gc_content(inclusive_GC_status), stats.mean(), stats.max_length, stats.min_length, stats.median(), stats.lengths, stats.composition)
+    #Tuple order: GC content, average, max, min, median, lengths, composition
+
+def find_chunks(path, chunk_size):
+    # Function that splits a fasta file into byte ranges of roughly chunk_size
+    # bytes. Every range (except possibly the first) starts exactly at a ">"
+    # at the start of a line, so each range holds only whole records
+    file_size = os.path.getsize(path)
+    boundaries = [0]
+    with open(path, "rb") as f:
+        offset = chunk_size
+        while offset < file_size:
+            f.seek(offset - 1)
+            position = offset - 1
+            boundary = file_size
+            for block in iter(lambda: f.read(1 << 16), b""):
+                idx = block.find(b"\n>")
+                if idx != -1:
+                    boundary = position + idx + 1
+                    break
+                # Keep the last byte so a boundary split across blocks is found
+                position += len(block) - 1
+                f.seek(position)
+                if len(block) == 1: break
+            if boundary >= file_size: break
+            boundaries.append(boundary)
+            offset = max(boundary, offset) + chunk_size
+    boundaries.append(file_size)
+    return(list(zip(boundaries[:-1], boundaries[1:])))
+
+def stats_for_range(path, start = None, end = None, threads = 1, options = {}, records_path = None, filters = None, fasta_path = None):
+    # Function that returns the FastaStats of the records in one byte range of
+    # an uncompressed file, or of the whole file when no range is given (the
+    # file is then decompressed if it is gzip/BGZF); used as the unit of work
+    # for the process pool. options are the keyword arguments of FastaStats
+    # and the per-record table is appended to records_path when it is given.
+    # With filters (a RecordFilter) only the records it keeps are counted,
+    # and they are appended as fasta to fasta_path when it is given
+    stats = FastaStats(**options)
+    if records_path != None: stats.record_sink = open(records_path, "a")
+    fasta_sink = open_fasta_sink(fasta_path) if fasta_path != None else None
+    try:
+        if start == None:
+            records = _records_from_blocks(iter_file_blocks(path, threads = threads))
+        else:
+            records = _records_from_blocks(iter_range_blocks(path, start, end))
+        if filters != None: records = filter_records(records, filters, stats, fasta_sink)
+        collect_stats(records, stats)
+    finally:
+        if stats.record_sink != None:
+            stats.record_sink.close()
+            stats.record_sink = None
+        if fasta_sink != None: fasta_sink.close()
+    return(stats)
+
+def _append_parts(path, part_paths):
+    # Function that appends the part files written by worker processes to
+    # path in order and removes them
+    if path == None: return
+    with open(path, "ab") as out_file:
+        for part_path in part_paths:
+            if not os.path.exists(part_path): continue
+            with open(part_path, "rb") as part:
+                shutil.copyfileobj(part, out_file)
+            os.remove(part_path)
+
+def stats_for_files(paths, jobs = 1, chunk_size = 64 << 20, threads = 1, options = {}, records_path = None, filters = None, fasta_path = None):
+    # Function that returns a list with one FastaStats per input file. Large
+    # uncompressed files are split into record-aligned chunks; compressed files
+    # are each one unit of work. When jobs > 1 the units are processed in a
+    # process pool and the chunk results are merged back together per file;
+    # each unit then writes its part of the per-record table (records_path)
+    # and of the kept records (fasta_path) to files of its own and the parts
+    # are appended in input order. A filter with a head limit keeps the first
+    # records of the inputs in order, so the units are then processed one
+    # after another and reading stops once the limit is reached
+    tasks = []
+    for i, path in enumerate(paths):
+        if file_format(path) == "plain" and os.path.getsize(path) > chunk_size:
+            tasks += [(i, path, start, end) for start, end in find_chunks(path, chunk_size)]
+        else:
+            tasks.append((i, path, None, None))
+    results = [FastaStats(**options) for _ in paths]
+    if jobs == 1 or len(tasks) == 1 or (filters != None and filters.head != None):
+        for i, path, start, end in tasks:
+            if filters != None and filters.full() == True: break
+            results[i].merge(stats_for_range(path, start, end, threads, options, records_path, filters, fasta_path))
+    else:
+        part_paths = [f"{records_path}.part{n}" if records_path != None else None for n in range(len(tasks))]
+        # (fasta parts keep a .gz ending so they are compressed like the output)
+        fasta_parts = [re.sub(r"(\.gz)?$", rf".part{n}\g<1>", fasta_path, count = 1) if fasta_path != None else None for n in range(len(tasks))]
+        # Largest units first so they do not become stragglers
+        order = sorted(range(len(tasks)), key = lambda n: os.path.getsize(tasks[n][1]) if tasks[n][2] == None else tasks[n][3] - tasks[n][2], reverse = True)
+        with ProcessPoolExecutor(max_workers = jobs) as pool:
+            futures = [(tasks[n][0], pool.submit(stats_for_range, *tasks[n][1:], threads, options, part_paths[n], filters, fasta_parts[n])) for n in order]
+            for i, future in futures:
+                results[i].merge(future.result())
+        _append_parts(records_path, part_paths)
+        _append_parts(fasta_path, fasta_parts)
+    return(results)
 
-def main():
+def indexed_stats(path, verbose = False):
+    # Function that returns the FastaStats of an uncompressed fasta file using
+    # a samtools-compatible .fai index and a .dsstats sidecar kept next to it.
+    # If the file is unchanged since the sidecar was written its statistics are
+    # returned without reading the file; if the file was only appended to, just
+    # the last previously indexed record and the new records are scanned
+    fai_path = path + ".fai"
+    sidecar_path = path + ".dsstats"
+    sidecar = read_sidecar(sidecar_path)
+    status = sidecar_status(path, sidecar) if os.path.exists(fai_path) else "stale"
+    if verbose == True: print(f"Index status of {path}: {status}")
+    if status == "valid":
+        return(stats_from_dict(sidecar["stats"]))
+    if status == "appended":
+        # The last record may have grown, so it is scanned again
+        entries = read_fai(fai_path)[:-1]
+        settled = stats_from_dict(sidecar["settled"])
+        start = sidecar["last_record"]
+    else:
+        entries = []
+        settled = FastaStats()
+        start = 0
+    size = os.path.getsize(path)
+    last_record = start
+    last_sequence = None
+    if size > 0:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as mm:
+            try:
+                for record_offset, entry, sequence in index_records(mm, start):
+                    # Statistics for all but the last record are "settled"; the last
+                    # record is kept apart so a later append can extend it
+                    if last_sequence != None: settled.add(last_sequence)
+                    entries.append(entry)
+                    last_record = record_offset
+                    last_sequence = sequence
+            except ValueError as error:
+                print(f"Note: {path} cannot be indexed ({error}); quitting")
+                exit()
+    stats = FastaStats().merge(settled)
+    if last_sequence != None: stats.add(last_sequence)
+    stat = os.stat(path)
+    # Checksums of the blocks of the old part were verified by sidecar_status
+    known = sidecar["blocks"] if status == "appended" else []
+    try:
+        write_fai(fai_path, entries)
+        write_sidecar(sidecar_path, {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "hash": file_signature(path, stat.st_size),
+            "blocks": block_checksums(path, stat.st_size, known, sidecar["size"] if status == "appended" else 0),
+            "last_record": last_record,
+            "settled": settled.to_dict(),
+            "stats": stats.to_dict()})
+    except OSError as error:
+        print(f"Note: could not write index for {path}: {error}")
+    return(stats)
+
+def parse_region(region):
+    # Function that splits a samtools style region ("name" or "name:begin-end",
+    # 1-based and inclusive) into (name, begin, end) with 0-based begin and
+    # exclusive end; begin/end are None when the whole record is wanted
+    match = re.fullmatch(r"(.+):([0-9,]+)-([0-9,]+)", region)
+    if match == None:
+        return(region, None, None)
+    return(match.group(1), int(match.group(2).replace(",", "")) - 1, int(match.group(3).replace(",", "")))
+
+def stats_for_ids(path, regions, verbose = False, options = {}, record_sink = None):
+    # Function that returns the FastaStats of selected records (or sub-ranges
+    # of records) of an uncompressed fasta file. The .fai index is used to read
+    # only the selected bytes; it is built first if it is missing or out of date
+    fai_path = path + ".fai"
+    if not os.path.exists(fai_path) or sidecar_status(path, read_sidecar(path + ".dsstats")) != "valid":
+        indexed_stats(path, verbose)
+    index = {entry.name: entry for entry in read_fai(fai_path)}
+    stats = FastaStats(record_sink = record_sink, **options)
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as mm:
+        for region in regions:
+            name, begin, end = region, None, None
+            if name not in index: name, begin, end = parse_region(region)
+            if name not in index:
+                print(f"Note: sequence ID not found in {path}\n  ID that caused failure: {region}")
+                exit()
+            stats.add(fetch_sequence(mm, index[name], begin or 0, end), region.encode())
+    stats.record_sink = None
+    return(stats)
+
+def print_stats(stats, inclusive_GC_status = False, composition = False, quantiles = []):
+    # Function that prints the statistics held by a FastaStats accumulator
+    n50, l50 = stats.lengths.n50()
+    print(f"Number of sequences: {stats.count}")
+    if stats.skipped > 0: print(f"Filtered out:        {stats.skipped}")
+    print(f"Average length: {stats.mean()}")
+    print(f"Maximum length: {stats.max_length}")
+    print(f"Minimum length: {stats.min_length}")
+    print(f"Median length:  {stats.median()}")
+    print(f"N50 length:     {n50}")
+    print(f"L50 count:      {l50}")
+    for q in quantiles:
+        print(f"Length quantile {q}: {stats.lengths.quantile(q)}")
+    print(f"GC Content:     {stats.composition.gc_content(inclusive_GC_status)}")
+    if composition == True:
+        print("Composition:")
+        for symbol, count in stats.composition.symbol_counts().items():
+            print(f"  {symbol}\t{count}")
+    if stats.kmers != None:
+        k = stats.kmers.k
+        index, counts = stats.kmers.table()
+        top = numpy.argsort(-counts, kind = "stable")[:5]
+        print(f"{k}-mers counted:  {int(counts.sum())}{' (canonical)' if stats.kmers.canonical == True else ''}")
+        print(f"Distinct {k}-mers: {len(index)} of {4 ** k} possible")
+        print(f"Most common {k}-mers: " + ", ".join(f"{kmer} ({count})" for kmer, count in zip(stats.kmers.kmer_strings(index[top]).tolist(), counts[top].tolist())))
+    if stats.dinucleotides != None:
+        print("Dinucleotides (count, observed/expected):")
+        for pair, (count, ratio) in dinucleotide_bias(stats.dinucleotides, stats.composition).items():
+            print(f"  {pair}\t{count}\t{ratio:.3f}")
+
+def _quantile_list(text):
+    # Function that parses the -q/--quantiles argument; argparse reports the
+    # error (and quits) for anything that is not a list of numbers in 0..1
+    try:
+        quantiles = [float(q) for q in text.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{text!r} is not a comma separated list of numbers")
+    for q in quantiles:
+        if not 0 <= q <= 1:
+            raise argparse.ArgumentTypeError(f"quantile {q} is not between 0 and 1")
+    return(quantiles)
+
+def main(argv = None):
     # Main block
 
     #Argument parsing
-    parser = argparse.ArgumentParser(description = "This module takes as an input a fasta file (or a piped fasta file) and will display various statistics about the sequences contained in that file. Specifically, it will display the average, maximum, minimum, and median sequence length as well as displaying the GC content of the entire file. The module will also save a png image of a histogram of fasta lengths at the path given to it.")
+    parser = argparse.ArgumentParser(description = "This module takes as an input one or more fasta files (or a piped fasta file), uncompressed or compressed with gzip/bgzip, and will display various statistics about the sequences contained in those files. Specifically, it will display the average, maximum, minimum, and median sequence length, N50/L50 and any requested length quantiles as well as displaying the GC content of the entire file. When several files are given statistics are shown for each file and for all files combined. Records can be filtered by length or header, subsampled or limited to the first few before they are counted, and the kept records saved as fasta in the same pass. The module will also save a png image of a histogram of fasta lengths at the path given to it with -o, and/or draw it in the terminal with --terminal.")
     parser.add_argument(
         "-o", "--out",
-        help = "Path to file where histogram of fasta lengths will be saved",
+        help = "Path to file where histogram of fasta lengths will be saved (png, svg, pdf, ... by extension, or .rgba/.raw for uncompressed raw RGBA pixels); if not provided only statistics are displayed",
         type = str,
         dest = "out",
-        required = True)
+        required = False)
     parser.add_argument(
         "-i", "--in",
-        help = "File location for input; if not provided script looks for pipe input",
+        help = "File location(s) for input; if not provided script looks for pipe input",
         type = str,
+        nargs = "+",
         required = False,
         dest = "in_file")
     parser.add_argument(
@@ -91,6 +517,55 @@ def main():
         action = "store_true",
         dest = "gc",
         required = False)
+    parser.add_argument(
+        "-c", "--composition",
+        help = "Flag that when used prints the count of every nucleotide symbol (case-insensitive) in all sequences",
+        action = "store_true",
+        dest = "composition",
+        required = False)
+    parser.add_argument(
+        "-q", "--quantiles",
+        help = "Comma separated list of length quantiles (between 0 and 1) to display (e.g. 0.1,0.9)",
+        type = _quantile_list,
+        default = [],
+        required = False)
+    parser.add_argument(
+        "-j", "--jobs",
+        help = "Number of worker processes used for input files (0 uses all cores; default 1)",
+        type = int,
+        default = 1,
+        required = False)
+    parser.add_argument(
+        "--threads",
+        help = "Number of threads used to decompress each BGZF input (default 4)",
+        type = int,
+        default = 4,
+        required = False)
+    parser.add_argument(
+        "--chunk_size",
+        help = "Size in megabytes of the record-aligned chunks that large input files are split into for parallel processing",
+        type = int,
+        default = 64,
+        required = False)
+    parser.add_argument(
+        "--index",
+        help = "Flag that when used builds (or reuses) a samtools-compatible .fai index and a .dsstats statistics sidecar next to each uncompressed input file, so repeated runs on unchanged files do not rescan them",
+        action = "store_true",
+        dest = "index",
+        required = False)
+    parser.add_argument(
+        "--ids",
+        help = "Only compute statistics for these sequence IDs or samtools style regions (e.g. chr1:1000-2000); uses the .fai index for random access",
+        type = str,
+        nargs = "+",
+        dest = "ids",
+        required = False)
+    parser.add_argument(
+        "--ids_file",
+        help = "File with one sequence ID or region per line to compute statistics for (like --ids)",
+        type = str,
+        dest = "ids_file",
+        required = False)
     parser.add_argument(
         "-b", "--bins",
         help = "Number of bins in histogram",
@@ -103,51 +578,235 @@ def main():
         type = str,
         default = "Fasta lengths",
         required = False)
-    args = parser.parse_args()
-
-    #Out file handling
-    outfile_path = os.path.abspath(args.out)
-    
-    #In file handling
-    if args.in_file != None:
-        #if in file is provided
-        if args.verbose == True: print(f"In file provided to script. Importing {args.in_file}")
-        with open(os.path.abspath(args.in_file), "r") as f:
-            source = f.read()
-    else:
-        #if no in file is provided (i.e. getting from pipe)
-        if args.verbose == True: print(f"No in file provided to script, Using pipe as input")
-        if sys.stdin.isatty():
-            source = sys.stdin.read()
-        else:
-            if args.verbose == True: print(f"No piped input found; quitting")
+    parser.add_argument(
+        "--terminal",
+        help = "Flag that when used draws the histogram of fasta lengths in the terminal with Unicode block characters",
+        action = "store_true",
+        dest = "terminal",
+        required = False)
+    parser.add_argument(
+        "-k", "--kmer_size",
+        help = f"Counts the k-mers of this size (1 to {MAX_KMER_SIZE}) in all sequences and prints a summary; k-mers holding N or other ambiguous symbols are skipped",
+        type = int,
+        dest = "kmer_size",
+        required = False)
+    parser.add_argument(
+        "--canonical",
+        help = "Flag that when used counts each k-mer together with its reverse complement (under whichever comes first alphabetically)",
+        action = "store_true",
+        dest = "canonical",
+        required = False)
+    parser.add_argument(
+        "--kmer_out",
+        help = "File location to save the count of every k-mer seen as tab separated k-mer and count (needs -k)",
+        type = str,
+        dest = "kmer_out",
+        required = False)
+    parser.add_argument(
+        "--kmer_spectrum",
+        help = "File location to save the k-mer spectrum: for every number of occurrences, how many distinct k-mers occur that many times (needs -k)",
+        type = str,
+        dest = "kmer_spectrum",
+        required = False)
+    parser.add_argument(
+        "--dinucleotides",
+        help = "Flag that when used prints the count of every dinucleotide and its relative abundance (observed frequency over the frequency expected from the base composition, e.g. CpG depletion)",
+        action = "store_true",
+        dest = "dinucleotides",
+        required = False)
+    parser.add_argument(
+        "--records_out",
+        help = "File location to save a tab separated table with the ID, length, GC content (inclusive with -g) and N count of every record, written as the records are read",
+        type = str,
+        dest = "records_out",
+        required = False)
+    parser.add_argument(
+        "--min_length", "--min-length",
+        help = "Only counts records at least this long",
+        type = int,
+        dest = "min_length",
+        required = False)
+    parser.add_argument(
+        "--max_length", "--max-length",
+        help = "Only counts records at most this long",
+        type = int,
+        dest = "max_length",
+        required = False)
+    parser.add_argument(
+        "--header_regex", "--header-regex",
+        help = "Only counts records whose header (without the >) matches this regular expression anywhere (e.g. '^chr[0-9]+ ')",
+        type = str,
+        dest = "header_regex",
+        required = False)
+    parser.add_argument(
+        "--sample",
+        help = "Only counts a random subset of about this fraction (0 to 1) of the records; the choice is made from a hash of each record's ID so the same records are kept in every run (see --seed) and in parallel runs",
+        type = float,
+        dest = "sample",
+        required = False)
+    parser.add_argument(
+        "--seed",
+        help = "Number that changes which records --sample keeps (default 0)",
+        type = int,
+        default = 0,
+        dest = "seed",
+        required = False)
+    parser.add_argument(
+        "--head",
+        help = "Only counts the first this many records (that pass the other filters) and stops reading there; inputs are then read one after another",
+        type = int,
+        dest = "head",
+        required = False)
+    parser.add_argument(
+        "--fasta_out", "--fasta-out",
+        help = "File location to save the records that are counted (i.e. that pass the filters) as fasta, written in the same pass as the statistics; gzip compressed when the name ends in .gz",
+        type = str,
+        dest = "fasta_out",
+        required = False)
+    args = parser.parse_args(argv)
+    if args.jobs < 0:
+        print("Note: -j/--jobs must be at least 0 (0 uses every CPU). Quitting...")
+        exit()
+    if args.bins < 1:
+        print("Note: -b/--bins must be at least 1. Quitting...")
+        exit()
+    if args.jobs == 0: args.jobs = os.cpu_count()
+    if args.chunk_size < 1: args.chunk_size = 1
+    if args.kmer_size != None and not 1 <= args.kmer_size <= MAX_KMER_SIZE:
+        print(f"Note: -k/--kmer_size must be between 1 and {MAX_KMER_SIZE}; quitting")
+        exit()
+    if (args.kmer_out != None or args.kmer_spectrum != None or args.canonical == True) and args.kmer_size == None:
+        print("Note: --kmer_out, --kmer_spectrum and --canonical need -k/--kmer_size; quitting")
+        exit()
+    # k-mers, dinucleotides and the per-record table are gathered in the same
+    # pass as the other statistics
+    options = {"kmer_size": args.kmer_size, "canonical": args.canonical, "dinucleotides": args.dinucleotides, "inclusive_gc": args.gc}
+    if args.index == True and (args.kmer_size != None or args.dinucleotides == True or args.records_out != None):
+        print("Note: --index reuses saved statistics without reading the sequences, so it cannot be combined with -k, --dinucleotides or --records_out; quitting")
+        exit()
+    # Filter and sampling stage between reading and counting the records
+    if args.sample != None and not 0 < args.sample <= 1:
+        print("Note: --sample must be a fraction between 0 and 1; quitting")
+        exit()
+    if args.head != None and args.head < 1:
+        print("Note: --head must be at least 1; quitting")
+        exit()
+    filtering = args.min_length != None or args.max_length != None or args.header_regex != None or args.sample != None or args.head != None or args.fasta_out != None
+    if filtering == True and (args.index == True or args.ids != None or args.ids_file != None):
+        print("Note: the filters and --fasta_out apply to records as they are read, so they cannot be combined with --index, --ids or --ids_file; quitting")
+        exit()
+    filters = None
+    if filtering == True:
+        try:
+            filters = RecordFilter(args.min_length, args.max_length, args.header_regex, args.sample, args.seed, args.head)
+        except re.error as error:
+            print(f"Note: --header_regex is not a valid regular expression ({error}); quitting")
             exit()
-    
-    #Importing fasta
-    fasta_list = import_fastas_as_list(source)
-    if args.verbose == True: print(f"Imported {len(fasta_list)} fasta sequences from {args.in_file}")
-    if args.verbose == True:
-        for fasta in fasta_list:
-            print(fasta.seq)
-        print([len(fasta.seq) for fasta in fasta_list])
-
-    #Analyzing and printing fasta sequence stats
+    if args.fasta_out != None:
+        fasta_path = os.path.abspath(args.fasta_out)
+        open(fasta_path, "wb").close()
+    else:
+        fasta_path = None
+    if args.records_out != None:
+        records_path = os.path.abspath(args.records_out)
+        with open(records_path, "w") as records_file:
+            records_file.write("id\tlength\tgc\tn_count\n")
+    else:
+        records_path = None
+
+    #In file handling and analyzing fasta sequence stats
+    # (records are parsed and counted in the same streaming pass, so reading,
+    # parsing and statistics are all timed in the "stats" stage)
     if args.verbose == True: print(f"Acquiring statistics on fasta sequences...")
-    stats = get_stats(fasta_list, args.gc)
-    print(f"Average length: {stats[1]}")
-    print(f"Maximum length: {stats[2]}")
-    print(f"Minimum length: {stats[3]}")
-    print(f"Median length:  {stats[4]}")
-    print(f"GC Content:     {stats[0]}")
-
-    #Exporting fasta length histogram
-    print(f"Saving histogram to {outfile_path}")
-    plt.hist([len(fasta.seq) for fasta in fasta_list], density = False, bins = args.bins)
-    plt.ylabel("Occurences")
-    plt.xlabel("Fasta sequence length")
-    plt.title(args.title)
-    plt.savefig(outfile_path)
-    plt.show()
+    with stage("stats"):
+        if args.in_file != None:
+            #if in file(s) are provided
+            if args.verbose == True: print(f"In file(s) provided to script. Importing {args.in_file} using {args.jobs} process(es)")
+            paths = [os.path.abspath(path) for path in args.in_file]
+            regions = args.ids or []
+            if args.ids_file != None:
+                with open(os.path.abspath(args.ids_file), "r") as ids_file:
+                    regions += [line.strip() for line in ids_file if line.strip()]
+            if (regions or args.index == True) and any(file_format(path) != "plain" for path in paths):
+                print("Note: --index, --ids and --ids_file need uncompressed fasta files (not pipes); quitting")
+                exit()
+            if regions:
+                if args.verbose == True: print(f"Computing statistics for {len(regions)} selected sequence(s)")
+                file_stats = []
+                for path in paths:
+                    records_file = open(records_path, "a") if records_path != None else None
+                    file_stats.append(stats_for_ids(path, regions, args.verbose, options, records_file))
+                    if records_file != None: records_file.close()
+            elif args.index == True:
+                file_stats = [indexed_stats(path, args.verbose) for path in paths]
+            else:
+                file_stats = stats_for_files(paths, args.jobs, args.chunk_size << 20, args.threads, options, records_path, filters, fasta_path)
+        else:
+            #if no in file is provided (i.e. getting from pipe)
+            if args.verbose == True: print(f"No in file provided to script, Using pipe as input")
+            if not sys.stdin.isatty():
+                pipe_stats = FastaStats(**options)
+                if records_path != None: pipe_stats.record_sink = open(records_path, "a")
+                fasta_sink = open_fasta_sink(fasta_path) if fasta_path != None else None
+                # With --head the pipe is read as data arrives (not in full
+                # blocks) so reading stops as soon as the records are found
+                records = _records_from_blocks(iter_stream_blocks(sys.stdin.buffer, threads = args.threads, live = args.head != None))
+                if filters != None: records = filter_records(records, filters, pipe_stats, fasta_sink)
+                file_stats = [collect_stats(records, pipe_stats)]
+                if records_path != None: pipe_stats.record_sink.close()
+                if fasta_sink != None: fasta_sink.close()
+            else:
+                print(f"No piped input found and no in file; quitting")
+                exit()
+
+    #Printing fasta sequence stats
+    stats = FastaStats(**options)
+    for file_stat in file_stats:
+        stats.merge(file_stat)
+    if stats.count == 0 and stats.skipped > 0:
+        print(f"None of the {stats.skipped} records read passed the filters; quitting")
+        exit()
+    if stats.count == 0:
+        print("There was no greater than symbol in the file; it appears to not be a fasta file")
+        exit()
+    with stage("report"):
+        if len(file_stats) > 1:
+            for path, file_stat in zip(args.in_file, file_stats):
+                print(f"== {path}")
+                if file_stat.count == 0: print("No fasta sequences kept by the filters" if filters != None else "No fasta sequences found")
+                else: print_stats(file_stat, args.gc, args.composition, args.quantiles)
+            print(f"== Combined ({len(file_stats)} files)")
+        print_stats(stats, args.gc, args.composition, args.quantiles)
+
+    # Saving k-mer counts and spectrum
+    if args.kmer_out != None:
+        with stage("kmer_out"):
+            with open(os.path.abspath(args.kmer_out), "w") as kmer_file:
+                stats.kmers.write_tsv(kmer_file)
+        print(f"{args.kmer_size}-mer counts saved to {args.kmer_out}")
+    if args.kmer_spectrum != None:
+        with stage("kmer_out"):
+            multiplicity, distinct = stats.kmers.spectrum().table()
+            with open(os.path.abspath(args.kmer_spectrum), "w") as spectrum_file:
+                spectrum_file.write("occurrences\tdistinct_kmers\n")
+                spectrum_file.write("".join(f"{m}\t{d}\n" for m, d in zip(multiplicity.tolist(), distinct.tolist())))
+        print(f"{args.kmer_size}-mer spectrum saved to {args.kmer_spectrum}")
+    if records_path != None: print(f"Per-record table saved to {args.records_out}")
+    if fasta_path != None: print(f"{stats.count} record(s) saved to {args.fasta_out}")
+
+    #Exporting fasta length histogram (matplotlib is only loaded if an image is requested)
+    if args.terminal == True:
+        with stage("terminal"):
+            from termplot import render_histogram, ROWS
+            print(render_histogram(*stats.lengths.histogram(ROWS)[::-1]))
+    if args.out != None:
+        with stage("histogram"):
+            counts, edges = stats.lengths.histogram(args.bins)
+        from histplot import plot_histogram
+        outfile_path = os.path.abspath(args.out)
+        with stage("plot"):
+            saved = plot_histogram(edges, counts, outfile_path, xlabel = "Fasta sequence length", ylabel = "Occurences", title = args.title)
+        print(f"Histogram saved to {saved}")
 
 if __name__ == "__main__":
     main()
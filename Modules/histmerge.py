@@ -0,0 +1,135 @@
+#! /usr/bin/python
+
+# Author: Addison Martin
+# This script is a module for the Datason package
+# This script takes as its input any number of partial histograms saved by
+# inthisto or inthisto2d with --counts_out (e.g. one per machine or per shard
+# of a large input) and adds their counts together. The merged counts are
+# then used exactly as inthisto/inthisto2d would use the counts of the whole
+# input: to save a histogram image, print statistics or the proportion
+# table, draw the histogram in the terminal or save the merged counts as a
+# new partial histogram (so partials can be merged in several rounds). Only
+# the count tables are needed, never the raw values. Sketches saved by
+# inthisto --approximate are merged the same way (all with the same
+# --sketch_size).
+
+def main(argv = None):
+    import os, argparse
+
+    #####################
+    # Parsing arguments #
+    #####################
+    parser = argparse.ArgumentParser(description = "This module merges partial histograms saved by inthisto or inthisto2d with --counts_out (dense or sparse, JSON or npz) into one and then makes the same outputs those modules make from the merged counts: a png image of the histogram, summary statistics, the proportion table (1D only), a terminal histogram or a new partial histogram with the merged counts. All partials must come from the same module.")
+    parser.add_argument(
+        "-v", "--verbose",
+        action = "store_true",
+        default = False,
+        dest = "verbose")
+    parser.add_argument(
+        "partials",
+        help = "File locations of the partial histograms to merge",
+        type = str,
+        nargs = "+")
+    parser.add_argument(
+        "-o", "--out",
+        help = "File location to save histogram image; the format follows the extension (png, svg, pdf, ... or .rgba/.raw for uncompressed raw RGBA pixels); if not provided only statistics are displayed",
+        type = str,
+        dest = "out")
+    parser.add_argument(
+        "-t", "--title",
+        help = "Title to put on graph; note that this must be one string with no spaces",
+        type = str,
+        dest = "title")
+    parser.add_argument(
+        "-b", "--bins",
+        help = "Maximum number of histogram bins (on each axis for 2D histograms), as for inthisto and inthisto2d (default 1000)",
+        type = int,
+        default = 1000,
+        dest = "bins")
+    parser.add_argument(
+        "--binning",
+        help = "How bins are chosen on each axis of 2D histograms, as for inthisto2d",
+        type = str,
+        choices = ["integer", "fixed", "log", "quantile"],
+        default = "integer",
+        dest = "binning")
+    parser.add_argument(
+        "-l", "--log",
+        help = "When this flag is present, axes in 2D plots will be in log scale",
+        action = "store_true",
+        dest = "log_scale")
+    parser.add_argument(
+        "-p", "--proportion",
+        help = "Turns proportion printing on (1D histograms only)",
+        action = "store_true",
+        dest = "prop")
+    parser.add_argument(
+        "--terminal",
+        help = "Draws the histogram in the terminal with Unicode block characters",
+        action = "store_true",
+        dest = "terminal")
+    parser.add_argument(
+        "--counts_out", "--counts-out",
+        help = "File location to save the merged counts as a new partial histogram (.json for JSON, otherwise compressed numpy .npz)",
+        type = str,
+        dest = "counts_out")
+    args = parser.parse_args(argv)
+    if args.verbose == True: print(f"The following arguments were received: {args}") # for troubleshooting
+    if args.bins < 1:
+        print("Note: -b/--bins must be at least 1. Quitting...")
+        exit()
+
+    # Heavy imports happen after argument parsing so --help stays fast
+    from partials import load_partial
+    from instrument import stage
+
+    ####################
+    # Merging partials #
+    ####################
+    merged = None
+    kind = None
+    labels = None
+    with stage("merge"):
+        for path in args.partials:
+            if not os.path.isfile(path):
+                print(f"Note: partial histogram {path} does not exist. Quitting...")
+                exit()
+            try:
+                counter, info = load_partial(path)
+            except ValueError as error:
+                print(f"Note: {error}. Quitting...")
+                exit()
+            if args.verbose == True: print(f"Read {info['total']} counts ({info['kind']}, {info['layout']}) from {path}")
+            if merged == None:
+                merged, kind, labels = counter, info["kind"], info["labels"]
+                continue
+            if info["kind"] != kind:
+                print(f"Note: {path} holds counts of {info['kind']} but {args.partials[0]} holds counts of {kind}; only partials from the same module can be merged. Quitting...")
+                exit()
+            # Axis labels are only kept when all partials agree on them
+            if info["labels"] != labels: labels = []
+            try:
+                merged.merge(counter)
+            except ValueError as error:
+                print(f"Note: {path} cannot be merged: {error}. Quitting...")
+                exit()
+    if merged.total() == 0:
+        print("No counts found in partial histograms. Quitting...")
+        exit()
+    if args.verbose == True: print(f"Merged {len(args.partials)} partial histogram(s) holding {merged.total()} counts")
+
+    ##########
+    # Output #
+    ##########
+    if kind == "integers" or kind == "sketch":
+        from inthisto import output_histogram
+        output_histogram(merged, args, labels[0] if labels else None)
+    else:
+        from inthisto2d import output_histogram2d
+        if args.prop == True: print("Note: proportion printing is only available for 1D histograms")
+        if labels: output_histogram2d(merged, args, labels[0], labels[1])
+        else: output_histogram2d(merged, args)
+
+
+if __name__ == "__main__":
+    main()
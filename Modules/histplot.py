@@ -0,0 +1,121 @@
+#! /usr/bin/python
+
+# Author: Addison Martin
+# This script is a helper for the Datason package
+# It is the plotting stage shared by the histogram modules. Histograms are
+# drawn from bin edges and precomputed counts with one vectorized call each,
+# so thousands of bins draw as fast as ten. The image format follows the
+# extension of the output path: png, svg, pdf, ... or .rgba/.raw for raw
+# pixels that skip compression altogether. matplotlib is only imported
+# (with the non-interactive Agg backend) when one of these functions is
+# called, i.e. only when an image is actually requested, so runs that only
+# print statistics never pay for loading it. Loading matplotlib and saving
+# the image are timed as their own stages (see instrument.py).
+
+from instrument import stage
+
+def _pyplot():
+    # Function that imports matplotlib on first use and returns pyplot
+    with stage("import_matplotlib"):
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    return(plt)
+
+# Formats saved without compression, for images that go straight into
+# another program: raw is 8-bit RGBA pixels row by row with no header (the
+# size is given by the returned description), svg is vector graphics
+RAW_EXTENSIONS = (".rgba", ".raw")
+
+# Size of the count labels above the bars, in points
+LABEL_FONT_SIZE = 7
+
+def _save(fig, outfile):
+    # Function that saves a figure in the format given by the extension of
+    # outfile (png when there is none) and returns a description of the image
+    import os
+    extension = os.path.splitext(outfile)[1].lower()
+    with stage("savefig"):
+        if extension in RAW_EXTENSIONS:
+            fig.canvas.draw()
+            pixels = fig.canvas.buffer_rgba()
+            with open(outfile, "wb") as f:
+                f.write(pixels)
+            height, width = pixels.shape[:2]
+            description = f"{outfile} (raw 8-bit RGBA, {width}x{height} pixels)"
+        else:
+            fig.savefig(outfile, format = None if extension[1:] in fig.canvas.get_supported_filetypes() else "png")
+            description = outfile
+    return(description)
+
+def _label_positions(counts, capacity):
+    # Function that picks which bars get a count label: every bar when there
+    # is room for all labels, otherwise the tallest bar of every group of
+    # neighbouring bars, with as many groups as there is room for (of two
+    # picks closer than a group width, only the taller is kept so that no
+    # labels overlap)
+    import numpy
+    counts = numpy.asarray(counts)
+    if len(counts) <= capacity:
+        return(numpy.flatnonzero(counts > 0).tolist())
+    step = -(-len(counts) // max(capacity, 1))
+    padded = numpy.full(-(-len(counts) // step) * step, -1.0)
+    padded[:len(counts)] = counts
+    picked = padded.reshape(-1, step).argmax(axis = 1) + numpy.arange(0, len(padded), step)
+    kept = []
+    for i in picked[counts[picked] > 0].tolist():
+        if kept and i - kept[-1] < step:
+            if counts[i] > counts[kept[-1]]: kept[-1] = i
+        else:
+            kept.append(i)
+    return(kept)
+
+def plot_histogram(edges, counts, outfile, xlabel = None, ylabel = "Counts", title = None, annotate = False):
+    # Function that saves a histogram of precomputed counts to outfile and
+    # returns a description of the saved image. All bars are drawn as one
+    # filled outline, so drawing time does not grow with the number of bars.
+    # annotate adds the count above the bars, thinned to the tallest bar of
+    # each group of neighbouring bars when there are too many to be legible
+    plt = _pyplot()
+    import numpy
+    counts = numpy.asarray(counts)
+    fig, ax = plt.subplots()
+    ax.stairs(counts, edges, fill = True)
+    if annotate == True and len(counts) > 0:
+        labels = [f"{count:g}" for count in counts.tolist()]
+        label_width = max(len(label) for label in labels) * LABEL_FONT_SIZE * 0.6 + 4
+        axes_width = ax.get_position().width * fig.get_figwidth() * 72
+        centers = (numpy.asarray(edges[:-1]) + numpy.asarray(edges[1:]))/2
+        for i in _label_positions(counts, int(axes_width // label_width)):
+            ax.text(centers[i], counts[i], labels[i], ha = "center", va = "bottom", fontsize = LABEL_FONT_SIZE)
+    if ylabel != None: ax.set_ylabel(ylabel)
+    if xlabel != None: ax.set_xlabel(xlabel)
+    if title != None: ax.set_title(title)
+    description = _save(fig, outfile)
+    plt.close(fig)
+    return(description)
+
+def plot_histogram2d(edges_x, edges_y, counts, outfile, log_scale = False, log_axes = False, xlabel = None, ylabel = None, title = None):
+    # Function that saves a 2D histogram of precomputed counts (indexed
+    # [x bin, y bin]) to outfile and returns a description of the saved
+    # image; log_scale uses a log colour scale and log_axes puts both axes in
+    # log scale
+    plt = _pyplot()
+    import matplotlib, numpy
+    if log_scale == True:
+        scale = matplotlib.colors.LogNorm()
+        counts = numpy.ma.masked_equal(counts, 0)
+    else:
+        scale = None
+    fig, ax = plt.subplots()
+    mesh = ax.pcolormesh(edges_x, edges_y, counts.T, norm = scale, cmap = plt.cm.Greys)
+    fig.colorbar(mesh)
+    if log_axes == True:
+        ax.set_xscale("log")
+        ax.set_yscale("log")
+    if xlabel != None: ax.set_xlabel(xlabel)
+    if ylabel != None: ax.set_ylabel(ylabel)
+    if title != None: ax.set_title(title)
+    description = _save(fig, outfile)
+    plt.close(fig)
+    return(description)
@@ -0,0 +1,175 @@
+#! /usr/bin/python
+
+# Author: Addison Martin
+# This script is a helper for the Datason package
+# It is the instrumentation layer shared by the modules. Code is divided into
+# named stages (reading, parsing, counting, plotting, ...) with
+#   with stage("parse"): ...
+# and for every stage the wall time, CPU time (including child processes),
+# bytes processed and peak memory (RSS) are recorded. Stages can be nested;
+# they are reported by their path (e.g. "inthisto/parse/read") and the times
+# of a stage exclude the time spent in the stages nested in it, so the times
+# of all stages add up to the whole run. A stage entered many times (e.g.
+# once per block) is reported once with the totals.
+# Instrumentation is off unless enable() is called (datason.py does so for
+# --profile_json); when off, stage() returns one shared do-nothing context
+# and timed_iter() returns the iterable unchanged, so it costs next to nothing.
+
+import time, contextlib
+
+_NULL_STAGE = contextlib.nullcontext()
+
+# State of the instrumentation: whether it is on, the stack of open stages,
+# totals per stage path and the optional profiler of one stage
+_enabled = False
+_stack = []
+_records = {}
+_profile_stage = None
+_profiler = None
+
+def enable(profile_stage = None):
+    # Function that turns instrumentation on; when profile_stage is given,
+    # every stage with that name is also run under cProfile
+    global _enabled, _profile_stage, _profiler
+    _enabled = True
+    _profile_stage = profile_stage
+    if profile_stage != None:
+        import cProfile
+        _profiler = cProfile.Profile()
+
+def enabled():
+    return(_enabled)
+
+def _peak_rss_kb():
+    # Function that returns the peak resident memory of this process in kB
+    # since the last reset (Linux), or since the process started
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return(int(line.split()[1]))
+    except OSError:
+        pass
+    import resource
+    return(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+def _reset_peak_rss():
+    # Function that resets the peak memory counter of this process (Linux)
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+def _cpu_seconds():
+    import resource
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return(time.process_time() + children.ru_utime + children.ru_stime)
+
+class _Stage:
+    # Class of the context that measures one entry into a stage
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        if _stack:
+            # The peak of the enclosing stage so far is kept before the counter is reset
+            parent = _stack[-1]
+            parent["peak_kb"] = max(parent["peak_kb"], _peak_rss_kb())
+        path = _stack[-1]["path"] + "/" + self.name if _stack else self.name
+        _reset_peak_rss()
+        self.frame = {"path": path, "peak_kb": 0, "bytes": 0, "child_wall": 0.0, "child_cpu": 0.0}
+        _stack.append(self.frame)
+        if _profiler != None and self.name == _profile_stage and not any(frame["path"].split("/")[-1] == _profile_stage for frame in _stack[:-1]):
+            self.profiling = True
+            _profiler.enable()
+        else:
+            self.profiling = False
+        self.frame["start_wall"] = time.perf_counter()
+        self.frame["start_cpu"] = _cpu_seconds()
+        return(self)
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.frame["start_wall"]
+        cpu = _cpu_seconds() - self.frame["start_cpu"]
+        if self.profiling == True:
+            _profiler.disable()
+        frame = _stack.pop()
+        peak_kb = max(frame["peak_kb"], _peak_rss_kb())
+        record = _records.setdefault(frame["path"], {"calls": 0, "seconds": 0.0, "cpu_seconds": 0.0, "bytes": 0, "peak_rss_mb": 0.0})
+        record["calls"] += 1
+        record["seconds"] += wall - frame["child_wall"]
+        record["cpu_seconds"] += cpu - frame["child_cpu"]
+        record["bytes"] += frame["bytes"]
+        record["peak_rss_mb"] = max(record["peak_rss_mb"], peak_kb / 1024)
+        if _stack:
+            _stack[-1]["child_wall"] += wall
+            _stack[-1]["child_cpu"] += cpu
+            _stack[-1]["peak_kb"] = max(_stack[-1]["peak_kb"], peak_kb)
+        return(False)
+
+def stage(name):
+    # Function that returns the context of a stage (a shared do-nothing
+    # context when instrumentation is off)
+    if _enabled == False:
+        return(_NULL_STAGE)
+    return(_Stage(name))
+
+def add_bytes(count):
+    # Function that adds to the bytes processed by the current stage
+    if _enabled == True and _stack:
+        _stack[-1]["bytes"] += count
+
+def timed_iter(iterable, name, count_bytes = False):
+    # Function that returns an iterator over iterable whose every step runs
+    # in the stage name (e.g. to time a generator that reads or parses
+    # lazily); when count_bytes is True the length of every item is added
+    # to the bytes of the stage
+    if _enabled == False:
+        return(iterable)
+    return(_timed_iter(iter(iterable), name, count_bytes))
+
+def _timed_iter(iterator, name, count_bytes):
+    while True:
+        with _Stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            if count_bytes == True: add_bytes(len(item))
+        yield(item)
+
+def take_records():
+    # Function that returns the totals recorded so far and clears them (used
+    # to send the records of a worker process back to its parent)
+    records = dict(_records)
+    _records.clear()
+    return(records)
+
+def merge_records(records):
+    # Function that adds totals recorded in another process
+    for path, other in records.items():
+        record = _records.setdefault(path, {"calls": 0, "seconds": 0.0, "cpu_seconds": 0.0, "bytes": 0, "peak_rss_mb": 0.0})
+        for key in ("calls", "seconds", "cpu_seconds", "bytes"):
+            record[key] += other[key]
+        record["peak_rss_mb"] = max(record["peak_rss_mb"], other["peak_rss_mb"])
+
+def report():
+    # Function that returns the recorded stages, slowest first, with the
+    # stage that took the most time
+    stages = [dict(stage = path, **record) for path, record in _records.items()]
+    stages.sort(key = lambda record: record["seconds"], reverse = True)
+    for record in stages:
+        record["mb_per_second"] = record["bytes"] / record["seconds"] / (1 << 20) if record["bytes"] and record["seconds"] > 0 else None
+    return({"stages": stages, "hot_stage": stages[0]["stage"] if stages else None, "total_seconds": sum(record["seconds"] for record in stages)})
+
+def write_json(path, extra = {}):
+    # Function that writes the report (and extra fields) as JSON to path and,
+    # if a stage was profiled, its pstats dump next to it
+    import json
+    data = dict(extra, **report())
+    if _profiler != None:
+        data["pstats"] = f"{path}.{_profile_stage}.pstats"
+        _profiler.dump_stats(data["pstats"])
+    with open(path, "w") as f:
+        json.dump(data, f, indent = 1)
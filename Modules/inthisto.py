@@ -7,50 +7,99 @@
 # on a new row. The script will plot a histogram of these numbers
 # at the specified file location. Originally intended to be
 # used with piping on unix but can also use input files
+# With --approximate the values are summarised in a fixed-size KLL sketch
+# (see sketches.py) instead of being counted exactly, so endless or very
+# large streams can be histogrammed in a memory ceiling set by
+# --sketch_size, and --snapshot_every remakes the outputs while the stream
+# is still running. Binary columns (.npy, raw int32/int64 or Arrow IPC files,
+# see columns.py) are counted straight from the memory-mapped file
 
-def main():
+# Widest range of values that is counted into a dense array (one slot per integer)
+DENSE_RANGE_LIMIT = 1 << 22
+
+def proportion_printing(counter, dense):
+    # Function for proportion printing
+    # which involves printing the proportion of data represented
+    # by each integer value. Proportions come straight from the counts
+    # in the counter (one pass over the data); when the range of values
+    # is small every integer in the range is listed (including those
+    # with no data) and when it is wide only the values that occur are
+    import numpy
+    print("")
+    values, counts = counter.table()
+    total = int(counts.sum())
+    if dense == True:
+        all_values = numpy.arange(values[0], values[-1] + 1)
+        all_counts = numpy.zeros(len(all_values), dtype = numpy.int64)
+        all_counts[values - values[0]] = counts
+        values, counts = all_values, all_counts
+    sorted_proportion = list(zip(values.tolist(), (counts/total).tolist()))
+    print(sorted_proportion)
+
+def output_histogram(counter, args, xlabel = None):
+    # Function that makes every output requested in args from the counts
+    # (an IntegerCounter, or a KLLSketch for approximate histograms): the
+    # proportion table, statistics, the terminal and image histograms and
+    # the partial histogram file (--counts_out). Shared by inthisto and the
+    # merge command, which makes the same outputs from merged partials
+    import os
+    from counting import bin_edges
+    from sketches import KLLSketch
+    from instrument import stage
+    values, counts = counter.table()
+    dense = values[-1] - values[0] < DENSE_RANGE_LIMIT
+    approximate = isinstance(counter, KLLSketch)
+
+    # Saving the counts for merging with the merge command
+    if args.counts_out != None:
+        from partials import save_partial
+        with stage("counts_out"):
+            save_partial(args.counts_out, counter, labels = [xlabel] if xlabel != None else [])
+        print(f"Counts saved to {args.counts_out}")
+
+    # Proprtion printing
+    if args.prop == True and approximate == True:
+        print("Note: proportions of every value are not available for approximate histograms")
+    elif args.prop == True:
+        with stage("proportions"):
+            proportion_printing(counter, dense)
+
+    # Stats-only output when no image is requested; count, minimum, maximum
+    # and mean are exact in approximate histograms too
+    if args.out == None:
+        print(f"Count:   {counter.total()}")
+        print(f"Minimum: {counter.min if approximate == True else int(values[0])}")
+        print(f"Maximum: {counter.max if approximate == True else int(values[-1])}")
+        print(f"Mean:    {counter.value_sum()/counter.total()}")
+        print(f"Median:  {counter.median()}")
+        if approximate == True: print(f"Median and histogram are estimated from {counter.retained()} kept values: ranks are within about {100*counter.rank_error():.2g}% of the count and bin counts within twice that")
+
+    # Getting bins from the counts: one bin per integer (centred on it) or,
+    # for a range wider than --bins, bins covering equal runs of integers
+    with stage("bins"):
+        bins = bin_edges(counter, args.bins)
+        bin_counts, bins = counter.histogram(bins)
+
+    # Plotting
+    if args.terminal == True:
+        with stage("terminal"):
+            from termplot import render_histogram, ROWS
+            term_counts, term_bins = counter.histogram(bin_edges(counter, ROWS))
+            print(render_histogram(term_bins, term_counts))
+    if args.out != None:
+        from histplot import plot_histogram
+        outfile = os.path.abspath(args.out)
+        with stage("plot"):
+            saved = plot_histogram(bins, bin_counts, outfile, xlabel = xlabel if xlabel != None else "Values", ylabel = "Counts", title = args.title, annotate = True)
+        print(f"Plot image saved to {saved}")
+
+def main(argv = None):
     import sys, os, argparse
-    import matplotlib.pyplot as plt
-    import matplotlib as mpl
-
-    def clean_list(list):
-    # Function for cleaning out blank items in the beginning/end of a list
-        while list[0] == "":
-            list.pop(0)
-        while list[-1] == "":
-            list.pop(-1)
-
-    def check_data(data):
-        # Function for checking if all items in a list are integers
-        # Protects script by quitting if not all items are integers
-        for datum in data:
-            try: int(datum)
-            except:
-                print(f"Note: One line from input was not an integer\n  Line that caused entry failure: {datum}")
-                exit()
-        
-    def proportion_printing(data, min_datum, max_datum):
-        # Function for proportion printing 
-        # which involves printing the proportion of data represented
-        # by each integer in the range of data values
-        print("")
-        total = len(data)
-        proportion = {}
-        for i in range(min_datum,max_datum,1):
-            percent = round((i-min_datum)/len(range(min_datum,max_datum,1)),2)*100
-            print(f"\r{percent}% complete")
-            count = 0
-            for datum in data:
-                if datum == i:
-                    count += 1
-            proportion[i]=count/total
-        sorted_proportion = sorted(proportion.items())
-        print(sorted_proportion)
 
     #####################
     # Parsing arguments #
     #####################
-    parser = argparse.ArgumentParser(description = "This module was originally conceived as a tool to pipe into an awk command from a csv file. Thus it takes as its input a list of integers separated by the newlines (whether from an input file or from a pipe). The module will then save a png image of a histogram of the integers in this list.")
+    parser = argparse.ArgumentParser(description = "This module was originally conceived as a tool to pipe into an awk command from a csv file. Thus it takes as its input a list of integers separated by the newlines (whether from an input file or from a pipe). The module will then save a png image of a histogram of the integers in this list (or, without an image path, display summary statistics; --terminal draws the histogram in the terminal).")
     parser.add_argument(
         "-v", "--verbose",
         action = "store_true",
@@ -58,14 +107,28 @@ def main():
         dest = "verbose")
     parser.add_argument(
         "out",
-        help = "File location to save histogram image",
-        type = str)
+        help = "File location to save histogram image; the format follows the extension (png, svg, pdf, ... or .rgba/.raw for uncompressed raw RGBA pixels); if not provided only statistics are displayed",
+        type = str,
+        nargs = "?")
     parser.add_argument(
         "-i", "--in",
-        help = "File location for input; if not provided script looks for pipe input",
+        help = "File location for input; if not provided script looks for pipe input. Binary .npy and Arrow IPC files are recognised and counted straight from the file without parsing",
         type = str,
         required = False,
         dest = "inf")
+    parser.add_argument(
+        "--raw",
+        help = "Reads the input file as raw little-endian integers of this type (one value after another, no header) instead of text",
+        type = str,
+        choices = ["int32", "int64"],
+        dest = "raw_type",
+        required = False)
+    parser.add_argument(
+        "--column",
+        help = "Name (Arrow files and structured .npy arrays) or index (2D .npy arrays) of the column to count in binary input; the first column by default",
+        type = str,
+        dest = "column",
+        required = False)
     parser.add_argument(
         "--header",
         help = "Flag that indicates the first data points are headers",
@@ -77,77 +140,146 @@ def main():
         help = "Title to put on graph; note that this must be one string with no spaces",
         type = str,
         dest = "title")
+    parser.add_argument(
+        "-b", "--bins",
+        help = "Maximum number of histogram bins; one bin is used per integer value unless the range of values is wider than this, in which case each bin covers the same whole number of integers (default 1000)",
+        type = int,
+        default = 1000,
+        dest = "bins",
+        required = False)
     parser.add_argument(
         "-p", "--proportion",
         help = "Turns proportion printing on",
         action = "store_true",
         dest = "prop",
         required = False)
-    args = parser.parse_args()
+    parser.add_argument(
+        "--terminal",
+        help = "Draws the histogram in the terminal with Unicode block characters",
+        action = "store_true",
+        dest = "terminal",
+        required = False)
+    parser.add_argument(
+        "--approximate",
+        help = "Summarises the values in a fixed-size quantile sketch instead of counting every value exactly, so memory stays the same however long the input is and however many distinct values it has; the median and histogram become estimates (see --sketch_size) while the count, minimum, maximum and mean stay exact",
+        action = "store_true",
+        dest = "approximate",
+        required = False)
+    parser.add_argument(
+        "--sketch_size", "--sketch-size",
+        help = "Size k of the sketch used by --approximate; at most about 3k values (8 bytes each) are kept and the rank of any value is off by at most about 2.3/k^0.97 of the number of values, i.e. 0.14%% for the default of 2000 (bin counts by twice that)",
+        type = int,
+        default = 2000,
+        dest = "sketch_size",
+        required = False)
+    parser.add_argument(
+        "--snapshot_every", "--snapshot-every",
+        help = "Remakes the outputs (image, --counts_out file and statistics) every this many seconds while the input is still being read, for long running or endless streams; stopping the stream with Ctrl-C makes the final outputs from the values read so far",
+        type = float,
+        dest = "snapshot_every",
+        required = False)
+    parser.add_argument(
+        "--counts_out", "--counts-out",
+        help = "File location to save the counts as a partial histogram (.json for JSON, otherwise compressed numpy .npz) that the merge command can combine with others",
+        type = str,
+        dest = "counts_out",
+        required = False)
+    args = parser.parse_args(argv)
     if args.verbose == True: print(f"The following arguments were received: {args}") # for troubleshooting
+    if args.bins < 1:
+        print("Note: -b/--bins must be at least 1. Quitting...")
+        exit()
+
+    # Heavy imports happen after argument parsing so --help stays fast;
+    # matplotlib is only imported by the plotting stage when an image is saved
+    import time
+    from counting import IntegerCounter
+    from sketches import KLLSketch
+    from datainput import input_blocks
+    from intparse import iter_line_blocks, split_header, iter_int_arrays, IntegerParseError
+    from columns import binary_format, open_columns, ColumnInputError
+    from instrument import stage, timed_iter
 
     #################
     # File handling #
     #################
 
     # Output file handling
-    outfile = os.path.abspath(args.out)
-    if args.verbose == True: print(f"Outputting histogram to {outfile}")
+    if args.out != None:
+        outfile = os.path.abspath(args.out)
+        if args.verbose == True: print(f"Outputting histogram to {outfile}")
     
-    # Input handling
-    if args.inf != None:
-        # In file if file is provided -- gets content of file as list called data
-        in_file = open(os.path.abspath(args.inf), "r")
-        data = in_file.read()
-        in_file.close()
-        data = data.split("\n")
-        if args.verbose == True: print(f"Received an -in argument; reading from file {args.inf}")
-    else:
-        # In file if file is not provided -- wrangles content of piped input as list called data
-        if args.verbose == True: print(f"Received no -in argument; using pipe input")
-        if sys.stdin.isatty():
-            print("No piped input to script and no in file. Quitting...")
+    # Input handling -- binary columns are counted in chunks straight from
+    # the memory-mapped file. Text input is read in large blocks of whole
+    # lines, fetched in the background while the previous block is parsed;
+    # snapshots of a live stream are made from whatever has arrived
+    xlabel = None
+    if args.raw_type != None and args.inf == None:
+        print("Note: --raw needs an input file (-i). Quitting...")
+        exit()
+    if args.inf != None and (args.raw_type != None or binary_format(args.inf) != None):
+        if args.verbose == True: print(f"Reading binary column input from {args.inf}")
+        if args.head == True: print("Note: --header is ignored for binary input; column names are used as labels")
+        try:
+            labels, chunks = open_columns(os.path.abspath(args.inf), 1, [args.column] if args.column != None else None, args.raw_type)
+        except ColumnInputError as error:
+            print(f"Note: {error}. Quitting...")
             exit()
-        else:
-            data = sys.stdin.readlines()
-            data = [datum.strip() for datum in data]
-    
-    # Handling of header flag
-    if args.head == True & args.verbose == True: print(f"Received --header flag: using first data as header")
-    elif args.head == False & args.verbose == True: print(f"Received no --header flag")
-    if args.head == True:
-        header = data.pop(0)
-    
-    # Cleaning input data
-    clean_list(data)
-    check_data(data)
-    data = [int(datum) for datum in data]
-    if args.verbose == True: print(f"Working with the following data: {data}")
-
-    # Getting statistics from data for plotting and exporting proportions
-    min_datum = min(data)-1
-    max_datum = max(data)+1
-    bins = range(min_datum,max_datum,1)
+        if labels: xlabel = labels[0]
+        arrays = (chunk[0] for chunk in timed_iter(chunks, "read"))
+    else:
+        if args.column != None: print("Note: --column only applies to binary input and is ignored")
+        line_blocks = iter_line_blocks(input_blocks(args.inf, args.verbose, live = args.snapshot_every != None))
 
-    # Proprtion printing
-    if args.prop == True:
-        proportion_printing(data, min_datum, max_datum)
+        # Handling of header flag
+        if args.head == True & args.verbose == True: print(f"Received --header flag: using first data as header")
+        elif args.head == False & args.verbose == True: print(f"Received no --header flag")
+        first_line = 1
+        if args.head == True:
+            xlabel, line_blocks = split_header(line_blocks)
+            first_line = 2
+        arrays = timed_iter(iter_int_arrays(line_blocks, first_line = first_line), "parse")
 
-    # Plotting
+    # Parsing, validating and counting input data in a single pass over
+    # each block; all proportions, bins and the plot are made from these
+    # counts. Counts are kept in a dense array indexed from the minimum value
+    # when the range is small and in a sparse table when it is wide, or
+    # summarised in a fixed-size sketch with --approximate
+    if args.approximate == True:
+        if args.sketch_size < 8:
+            print("Note: --sketch_size must be at least 8. Quitting...")
+            exit()
+        counter = KLLSketch(args.sketch_size)
+    else:
+        counter = IntegerCounter(max_dense_range = DENSE_RANGE_LIMIT)
+    last_snapshot = time.monotonic()
     try:
-        _, _, plot = plt.hist(data, density=False, align="mid", bins=bins)
-        for point in plot:
-            x = (point._x0+point._x1)/2
-            y = point._y1 + 0.05
-            plt.text(x,y, point._y1)
-    except:
-        plot = plt.hist(data,density=False, align="mid", bins=bins)
-    plt.ylabel('Counts')
-    if args.head == True: plt.xlabel(header)
-    else: plt.xlabel("Values")
-    if args.title != False: plt.title(args.title)
-    plt.savefig(outfile)
-    print(f"Plot image saved to {outfile}")
+        for data in arrays:
+            with stage("count"):
+                counter.add_many(data)
+            # Periodic snapshots of the outputs while the stream is running
+            if args.snapshot_every != None and time.monotonic() - last_snapshot >= args.snapshot_every and counter.total() > 0:
+                with stage("snapshot"):
+                    print(f"Snapshot after {counter.total()} values")
+                    output_histogram(counter, args, xlabel)
+                    sys.stdout.flush()
+                last_snapshot = time.monotonic()
+    except IntegerParseError as error:
+        print(f"Note: One line from input was not an integer\n  Line {error.line_number} caused entry failure: {error.line}")
+        exit()
+    except ColumnInputError as error:
+        print(f"Note: {error}. Quitting...")
+        exit()
+    except KeyboardInterrupt:
+        if args.snapshot_every == None: raise
+        print(f"Interrupted; using the {counter.total()} values read so far")
+    values, counts = counter.table()
+    if len(values) == 0:
+        print("No integers found in input. Quitting...")
+        exit()
+    if args.verbose == True: print(f"Counted {counter.total()} values ({len(values)} distinct{' values kept' if args.approximate == True else ''})")
+
+    output_histogram(counter, args, xlabel)
 
 
 if __name__ == "__main__":
@@ -7,45 +7,65 @@
 # delimiter between them. The script will plot a 2D histogram
 # of these numbers at the specified file location. Originally
 # intended to be used with piping on unix but can also use 
-# input files
-
-def main():
-    import sys, os, argparse
-    import matplotlib.pyplot as plt
-    import matplotlib as mpl
-
-    def clean_list(list):
-    # Function for cleaning out blank items in the beginning/end of a list
-        while list[0] == "":
-            list.pop(0)
-        while list[-1] == "":
-            list.pop(-1)
-
-    def check_data(data, sep):
-        # Function for checking if all items in a list of lists are integers
-        # Protects script by quitting if not all items are integers
-        for datum in data:
-            try: datum = datum.split(sep)
-            except:
-                print(f"Note: Seperator not found in one line\n Line that caused failure: {datum}")
-                exit()
-            for d in datum:
-                try: int(d)
-                except:
-                    print(f"Note: One line from input was not an integer\n  Line that caused entry failure: {datum}")
-                    exit()
-    
-    def check_lists(lista, listb):
-        # Function that checks that two list are equal in length
-        # Protects script by quitting if both lists are not equal in length
-        if len(lista) != len(listb):
-            print("Note: data lists provided to script are not equal to one another in length\n Check your data!")
+# input files. Binary columns (.npy, raw int32/int64 or Arrow IPC
+# files, see columns.py) are counted straight from the memory-mapped file
+
+def output_histogram2d(counter, args, xlabel = None, ylabel = None):
+    # Function that makes every output requested in args from the counts:
+    # statistics, the terminal and image histograms and the partial histogram
+    # file (--counts_out). Shared by inthisto2d and the merge command, which
+    # makes the same outputs from merged partials
+    import os
+    from counting import bin_edges
+    from instrument import stage
+
+    # Saving the counts for merging with the merge command
+    if args.counts_out != None:
+        from partials import save_partial
+        with stage("counts_out"):
+            save_partial(args.counts_out, counter, labels = [xlabel, ylabel] if xlabel != None else [])
+        print(f"Counts saved to {args.counts_out}")
+
+    # Stats-only output when no image is requested
+    if args.out == None:
+        x, y, counts = counter.table()
+        print(f"Pairs:          {counter.total()}")
+        print(f"Occupied cells: {len(counts)}")
+        print(f"X range:        {int(x.min())} to {int(x.max())}")
+        print(f"Y range:        {int(y.min())} to {int(y.max())}")
+        print(f"Max cell count: {int(counts.max())}")
+
+    # Getting bins on each axis and counting the pairs in them
+    with stage("bins"):
+        try:
+            edges_x = bin_edges(counter.marginal(0), args.bins, args.binning)
+            edges_y = bin_edges(counter.marginal(1), args.bins, args.binning)
+        except ValueError as error:
+            print(f"Note: {error}. Quitting...")
             exit()
+        binned = counter.histogram2d(edges_x, edges_y)
+
+    # Plotting the precomputed counts
+    if args.terminal == True:
+        with stage("terminal"):
+            from termplot import render_histogram2d, COLUMNS, ROWS
+            term_x = bin_edges(counter.marginal(0), COLUMNS, args.binning)
+            term_y = bin_edges(counter.marginal(1), ROWS, args.binning)
+            print(render_histogram2d(term_x, term_y, counter.histogram2d(term_x, term_y)))
+    if args.out != None:
+        from histplot import plot_histogram2d
+        outfile = os.path.abspath(args.out)
+        with stage("plot"):
+            saved = plot_histogram2d(edges_x, edges_y, binned, outfile, log_scale = args.log_scale, log_axes = args.binning == "log", xlabel = xlabel, ylabel = ylabel, title = args.title)
+        print(f"Plot image saved to {saved}")
+
+def main(argv = None):
+    import os, argparse
 
     #####################
     # Parsing arguments #
     #####################
-    parser = argparse.ArgumentParser(description = "This module is an extension of the intohisto module, except that it can take a two dimensional list where the x and y variables are separated by some character and each pair of x and y variables are separated by newlines. Similar to the above module, it can take an input from a file or from a pipe. The module will then save a png image of a two dimensional histogram from the values in the input.")
+    parser = argparse.ArgumentParser(description = "This module is an extension of the intohisto module, except that it can take a two dimensional list where the x and y variables are separated by some character and each pair of x and y variables are separated by newlines. Similar to the above module, it can take an input from a file or from a pipe. The module will then save a png image of a two dimensional histogram from the values in the input (or, without an image path, display summary statistics; --terminal draws the histogram in the terminal).")
     parser.add_argument(
         "-v", "--verbose",
         action = "store_true",
@@ -53,13 +73,25 @@ def main():
         dest = "verbose")
     parser.add_argument(
         "out",
-        help = "File location to save histogram image",
-        type = str)
+        help = "File location to save histogram image; the format follows the extension (png, svg, pdf, ... or .rgba/.raw for uncompressed raw RGBA pixels); if not provided only statistics are displayed",
+        type = str,
+        nargs = "?")
     parser.add_argument(
         "-i", "--in",
-        help = "File location for input; if not provided script looks for pipe input",
+        help = "File location for input; if not provided script looks for pipe input. Binary .npy and Arrow IPC files are recognised and counted straight from the file without parsing",
         type = str,
         dest = "inf")
+    parser.add_argument(
+        "--raw",
+        help = "Reads the input file as raw little-endian integers of this type (x and y of each pair one after another, no header) instead of text",
+        type = str,
+        choices = ["int32", "int64"],
+        dest = "raw_type")
+    parser.add_argument(
+        "--columns",
+        help = "Names (Arrow files and structured .npy arrays) or indices (2D .npy arrays) of the x and y columns in binary input, separated by a comma (e.g. length,depth); the first two columns by default",
+        type = str,
+        dest = "columns")
     parser.add_argument(
         "--header",
         help = "Flag that indicates the first data points are headers",
@@ -76,87 +108,110 @@ def main():
         type = str,
         dest = "sep",
         default = "\t")
+    parser.add_argument(
+        "-b", "--bins",
+        help = "Target number of bins on each axis; with the default integer binning one bin is used per integer value unless the range of values is wider than this, in which case each bin covers the same whole number of integers (default 1000)",
+        type = int,
+        default = 1000,
+        dest = "bins")
+    parser.add_argument(
+        "--binning",
+        help = "How bins are chosen on each axis: integer (one bin per integer value, or per equal run of integers when the range is wider than --bins), fixed (equal width), log (equal width on a log scale; values must be positive) or quantile (roughly equal counts)",
+        type = str,
+        choices = ["integer", "fixed", "log", "quantile"],
+        default = "integer",
+        dest = "binning")
     parser.add_argument(
         "-l", "--log",
         help = "When this flag is present, axes in plot will be in log scale",
         action = "store_true",
         dest = "log_scale")
-    args = parser.parse_args()
-    print(args)
+    parser.add_argument(
+        "--terminal",
+        help = "Draws the 2D histogram in the terminal with shaded Unicode block characters",
+        action = "store_true",
+        dest = "terminal")
+    parser.add_argument(
+        "--counts_out", "--counts-out",
+        help = "File location to save the counts as a partial histogram (.json for JSON, otherwise compressed numpy .npz) that the merge command can combine with others",
+        type = str,
+        dest = "counts_out")
+    args = parser.parse_args(argv)
+    if args.verbose == True: print(f"The following arguments were received: {args}") # for troubleshooting
+    if args.bins < 1:
+        print("Note: -b/--bins must be at least 1. Quitting...")
+        exit()
+
+    # Heavy imports happen after argument parsing so --help stays fast;
+    # matplotlib is only imported by the plotting stage when an image is saved
+    from counting import PairCounter
+    from datainput import input_blocks
+    from intparse import iter_line_blocks, split_header, iter_int_arrays, IntegerParseError
+    from columns import binary_format, open_columns, ColumnInputError
+    from instrument import stage, timed_iter
 
     #################
     # File handling #
     #################
 
     # Output file handling
-    outfile = os.path.abspath(args.out)
-    if args.verbose == True: print(f"Outputting histogram to {outfile}")
+    if args.out != None:
+        outfile = os.path.abspath(args.out)
+        if args.verbose == True: print(f"Outputting histogram to {outfile}")
     
-    # Input handling
-    if args.inf != None:
-        # In file if file is provided -- gets content of file as list called data
-        in_file = open(os.path.abspath(args.inf), "r")
-        data = in_file.read()
-        in_file.close()
-        data = data.split("\n")
-        if args.verbose == True: print(f"Received an -in argument; reading from file {args.inf}")
-    else:
-        # In file if file is not provided -- wrangles content of piped input as list called data
-        if args.verbose == True: print(f"Received no -in argument; using pipe input")
-        if sys.stdin.isatty():
-            print("No piped input to script and no in file. Quitting...")
+    # Input handling -- binary columns are counted in chunks straight from
+    # the memory-mapped file. Text input is read in large blocks of whole
+    # lines, fetched in the background while the previous block is parsed
+    header_x, header_y = None, None
+    if args.raw_type != None and args.inf == None:
+        print("Note: --raw needs an input file (-i). Quitting...")
+        exit()
+    if args.inf != None and (args.raw_type != None or binary_format(args.inf) != None):
+        if args.verbose == True: print(f"Reading binary column input from {args.inf}")
+        if args.head == True: print("Note: --header is ignored for binary input; column names are used as labels")
+        try:
+            labels, chunks = open_columns(os.path.abspath(args.inf), 2, args.columns.split(",") if args.columns != None else None, args.raw_type)
+        except ColumnInputError as error:
+            print(f"Note: {error}. Quitting...")
             exit()
-        else:
-            data = sys.stdin.readlines()
-            data = [datum.strip() for datum in data]
-    
-    # Cleaning input data
-    clean_list(data)
-    check_data(data, args.sep)
-    if args.verbose == True: print(f"Working with the following data: {data}")
-
-    # Handling of header flag
-    if args.head == True & args.verbose == True: print(f"Received --header flag: using first data as header")
-    elif args.head == False & args.verbose == True: print(f"Received no --header flag")
-    if args.head == True:
-        header = data.pop(0)
-        header_x = header.split(args.sep)[0]
-        header_y = header.split(args.sep)[1]
-
-    # Processing data into x and y lists
-    print(data)
-    data = [datum.split(args.sep) for datum in data]
-    data_x = [int(datum[0]) for datum in data]
-    data_y = [int(datum[1]) for datum in data]
-    print(data_x)
-    print(data_y)
-    check_lists(data_x, data_y)
-
-    # Getting statistics from data for plotting and exporting proportions
-    min_x = min(data_x) - 1
-    max_x = max(data_x)+1
-    min_y = min(data_y)-1
-    max_y = max(data_y)+1
-    bins_x = range(min_x, max_x, 1)
-    bins_y = range(min_y, max_y, 1)
-    n_bin_x = max_x - min_x
-    n_bin_y = max_y - min_y
-
-    # Plotting
-    if args.log_scale == True:
-        scale = mpl.colors.LogNorm()
+        if labels: header_x, header_y = labels
+        pairs = timed_iter(chunks, "read")
     else:
-        scale = None
-    plot = plt.hist2d(data_x, data_y, bins=[n_bin_x,n_bin_y], norm = scale, cmap=plt.cm.Greys)
-    plt.colorbar()
-    
-    if args.title != False: plt.title(args.title)
-    if args.head == True:
-        plt.xlabel(header_x)
-        plt.ylabel(header_y)
-    plt.savefig(outfile)
+        if args.columns != None: print("Note: --columns only applies to binary input and is ignored")
+        line_blocks = iter_line_blocks(input_blocks(args.inf, args.verbose))
+
+        # Handling of header flag
+        if args.head == True & args.verbose == True: print(f"Received --header flag: using first data as header")
+        elif args.head == False & args.verbose == True: print(f"Received no --header flag")
+        first_line = 1
+        if args.head == True:
+            header, line_blocks = split_header(line_blocks)
+            header_x = header.split(args.sep)[0]
+            header_y = header.split(args.sep)[1]
+            first_line = 2
+        pairs = ((data[:, 0], data[:, 1]) for data in timed_iter(iter_int_arrays(line_blocks, 2, args.sep, first_line), "parse"))
+
+    # Parsing, validating and counting both columns of the input in a single
+    # pass over each block. Pairs are counted into a dense grid while the range
+    # of coordinates is small and into a sparse table of occupied cells when
+    # it is wide, so the raw values are never kept
+    counter = PairCounter()
+    try:
+        for x, y in pairs:
+            with stage("count"):
+                counter.add_many(x, y)
+    except IntegerParseError as error:
+        print(f"Note: One line from input did not hold two integers separated by {args.sep!r}\n  Line {error.line_number} caused entry failure: {error.line}")
+        exit()
+    except ColumnInputError as error:
+        print(f"Note: {error}. Quitting...")
+        exit()
+    if counter.total() == 0:
+        print("No integers found in input. Quitting...")
+        exit()
+    if args.verbose == True: print(f"Counted {counter.total()} pairs of values in {len(counter.table()[2])} occupied cells")
 
-    print(f"Plot image saved to {outfile}")
+    output_histogram2d(counter, args, header_x, header_y)
 
 
 if __name__ == "__main__":
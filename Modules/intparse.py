@@ -0,0 +1,211 @@
+#! /usr/bin/python
+
+# Author: Addison Martin
+# This script is a helper for the Datason package
+# It provides the bulk integer parser used by inthisto and inthisto2d.
+# Input is cut into large blocks of whole lines and every block is parsed
+# straight into an int64 numpy array with vectorized operations; lines are
+# validated in the same pass (each value must look like something int()
+# accepts, with at most 18 digits) and the first bad line is reported with
+# its line number. Blank lines are skipped.
+
+import warnings
+import numpy
+
+# Default size of the line-aligned blocks that are parsed at once
+BLOCK_SIZE = 1 << 24
+# Longest run of digits that always fits in an int64
+_MAX_DIGITS = 18
+_POWERS_OF_TEN = 10 ** numpy.arange(_MAX_DIGITS, dtype = numpy.int64)
+_WHITESPACE = numpy.zeros(256, dtype = bool)
+_WHITESPACE[[ord(" "), ord("\t"), ord("\r"), ord("\v"), ord("\f")]] = True
+
+class IntegerParseError(ValueError):
+    # Error raised for the first line that does not hold the expected integers
+    def __init__(self, line_number, line, reason):
+        self.line_number = line_number
+        self.line = line
+        self.reason = reason
+        super().__init__(f"line {line_number}: {reason}: {line}")
+
+def iter_line_blocks(blocks, block_size = BLOCK_SIZE):
+    # Generator that re-cuts an iterable of bytes-like blocks (e.g. from
+    # datainput.iter_input_blocks) into blocks of roughly block_size bytes that
+    # each end at a line break; the last block is given a final line break
+    carry = b""
+    for block in blocks:
+        pos = 0
+        size = len(block)
+        while pos < size:
+            end = min(pos + block_size, size)
+            cut = block.rfind(b"\n", pos, end)
+            if cut == -1:
+                if end == size:
+                    carry += block[pos:end]
+                    break
+                cut = block.find(b"\n", end)
+                if cut == -1:
+                    carry += block[pos:]
+                    break
+            piece = block[pos:cut+1]
+            yield(carry + piece if carry else piece)
+            carry = b""
+            pos = cut + 1
+    if carry.strip():
+        yield(carry + b"\n")
+
+def split_header(line_blocks):
+    # Function that takes the first line off an iterator of line blocks and
+    # returns it (as a stripped string) with an iterator of the remaining blocks
+    line_blocks = iter(line_blocks)
+    for block in line_blocks:
+        cut = block.find(b"\n")
+        header = block[:cut].decode().strip()
+        rest = block[cut+1:]
+        def remaining():
+            if rest: yield rest
+            yield from line_blocks
+        return(header, remaining())
+    return(None, iter([]))
+
+def parse_int_block(buf, ncols = 1, sep = None, first_line = 1):
+    # Function that parses a block of whole lines, each holding ncols integers
+    # separated by sep, into an int64 array (shape (n,) for one column and
+    # (n, ncols) otherwise). first_line is the line number of the block's first
+    # line and is only used to report errors. Raises IntegerParseError for the
+    # first line that is not valid.
+    # Separators are first replaced by NUL bytes so that every delimiter is a
+    # single byte below "0". Clean blocks (only digits, "-" and delimiters) are
+    # then validated from the delimiter positions alone and converted by numpy's
+    # C text parser; anything else (whitespace, "+", blank lines) goes through
+    # the general byte-level parser
+    if ncols > 1:
+        if b"\x00" in buf:
+            _raise_for_line(buf, buf[:buf.index(b"\x00")].count(b"\n"), first_line, "not an integer")
+        sep = sep.encode() if isinstance(sep, str) else sep
+        buf = buf.replace(sep, b"\x00")
+    if not buf:
+        return(_empty(ncols))
+    values = _parse_clean(buf, ncols)
+    if values is None:
+        values = _parse_general(buf, ncols, first_line, ncols > 1 and not sep.strip())
+    if ncols > 1:
+        return(values.reshape(-1, ncols))
+    return(values)
+
+def _empty(ncols):
+    return(numpy.zeros((0, ncols) if ncols > 1 else 0, dtype = numpy.int64))
+
+def _parse_clean(buf, ncols):
+    # Function that parses a block made only of digits, "-" signs, NUL field
+    # separators and line breaks with exactly ncols non-empty fields on every
+    # line; returns None if the block is not like that
+    if buf.translate(None, b"0123456789-\n\x00"):
+        return(None)
+    a = numpy.frombuffer(buf, dtype = numpy.uint8)
+    special = numpy.flatnonzero(a < 48)
+    kind = a[special]
+    is_minus = kind == 45
+    minus = special[is_minus]
+    if len(minus):
+        # A sign must start its field and be followed by a digit
+        before = a[minus - 1] if minus[0] > 0 else numpy.r_[10, a[minus[1:] - 1]]
+        after = a[numpy.minimum(minus + 1, len(a) - 1)]
+        if not ((before < 45).all() and (after >= 48).all() and minus[-1] + 1 < len(a)):
+            return(None)
+    delimiters = special[~is_minus]
+    kinds = a[delimiters]
+    if len(kinds) % ncols != 0:
+        return(None)
+    kinds = kinds.reshape(-1, ncols)
+    if not ((kinds[:, -1] == 10).all() and (kinds[:, :-1] == 0).all()):
+        return(None)
+    # Every field holds at least one and at most _MAX_DIGITS characters
+    widths = numpy.diff(delimiters, prepend = -1) - 1
+    if len(widths) and (widths.min() < 1 or widths.max() > _MAX_DIGITS):
+        return(None)
+    if ncols > 1:
+        buf = buf.replace(b"\x00", b"\n")
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        values = numpy.fromstring(buf, dtype = numpy.int64, sep = "\n")
+    if len(values) != len(delimiters):
+        return(None)
+    return(values)
+
+def _parse_general(buf, ncols, first_line, whitespace_sep = False):
+    # Function that parses a block of lines one byte class at a time. Lines
+    # that hold only whitespace (including whitespace separators, when
+    # whitespace_sep is True) are skipped; on any other line every field
+    # must be an optional sign directly followed by one run of digits, with
+    # optional whitespace around it
+    a = numpy.frombuffer(buf, dtype = numpy.uint8)
+    is_newline = a == 10
+    line_of = numpy.cumsum(is_newline) - is_newline
+    n_lines = int(line_of[-1]) + 1
+    is_sep = a == 0
+    is_delimiter = is_newline | is_sep
+    token_of = numpy.cumsum(is_delimiter) - is_delimiter
+    n_tokens = int(token_of[-1]) + 1
+    is_digit = (a >= 48) & (a <= 57)
+    is_sign = (a == 45) | (a == 43)
+    is_space = _WHITESPACE[a]
+
+    # Line each token belongs to, and whether the line has any content
+    content = ~(is_space | is_delimiter)
+    has_content = numpy.bincount(line_of[content], minlength = n_lines) > 0
+    first_token_of_line = token_of[numpy.flatnonzero(numpy.r_[True, is_newline[:-1]])]
+    token_line = numpy.zeros(n_tokens, dtype = numpy.int64)
+    token_line[first_token_of_line] = numpy.arange(len(first_token_of_line))
+    token_line = numpy.maximum.accumulate(token_line)
+    keep = has_content[token_line]
+
+    # Collecting every kind of problem per line so the first bad line is reported
+    seps_in_line = numpy.bincount(line_of[is_sep], minlength = n_lines)
+    bad_line = seps_in_line != numpy.where(has_content, ncols - 1, seps_in_line if whitespace_sep else 0)
+    run_start = is_digit & ~numpy.r_[False, is_digit[:-1]]
+    sign_ok = is_sign & numpy.r_[is_digit[1:], False]
+    bad_token = numpy.bincount(token_of[~(is_digit | is_sign | is_space | is_delimiter)], minlength = n_tokens) > 0
+    bad_token |= numpy.bincount(token_of[run_start], minlength = n_tokens) != 1
+    bad_token |= numpy.bincount(token_of[is_sign], minlength = n_tokens) > 1
+    bad_token |= numpy.bincount(token_of[is_sign & ~sign_ok], minlength = n_tokens) > 0
+    bad_token |= numpy.bincount(token_of[is_digit], minlength = n_tokens) > _MAX_DIGITS
+    bad_line[token_line[bad_token & keep]] = True
+    if bad_line.any():
+        _raise_for_line(buf, int(numpy.argmax(bad_line)), first_line, "not an integer" if ncols == 1 else f"expected {ncols} integers per line")
+
+    # Digits of each token are weighted by powers of ten from the token's last
+    # digit and summed per token
+    digit_pos = numpy.flatnonzero(is_digit)
+    if len(digit_pos) == 0:
+        return(numpy.zeros(0, dtype = numpy.int64))
+    digit_token = token_of[digit_pos]
+    starts = numpy.flatnonzero(numpy.r_[True, digit_token[1:] != digit_token[:-1]])
+    ends = numpy.r_[starts[1:], len(digit_pos)] - 1
+    group = numpy.repeat(numpy.arange(len(starts)), ends - starts + 1)
+    exponent = ends[group] - numpy.arange(len(digit_pos))
+    weighted = (a[digit_pos].astype(numpy.int64) - 48) * _POWERS_OF_TEN[exponent]
+    values = numpy.add.reduceat(weighted, starts)
+    negative = numpy.zeros(n_tokens, dtype = bool)
+    negative[token_of[a == 45]] = True
+    values[negative[digit_token[starts]]] *= -1
+    return(values)
+
+def _raise_for_line(buf, line_index, first_line, reason):
+    # Function that raises an IntegerParseError for the given line of a block
+    line = bytes(buf).split(b"\n")[line_index].replace(b"\x00", b" ")
+    raise IntegerParseError(first_line + line_index, line.decode(errors = "replace").strip(), reason)
+
+def iter_int_arrays(line_blocks, ncols = 1, sep = None, first_line = 1):
+    # Generator that parses an iterable of line blocks (see iter_line_blocks)
+    # and yields one int64 array per block
+    for block in line_blocks:
+        yield(parse_int_block(block, ncols, sep, first_line))
+        first_line += block.count(b"\n")
+
+def read_int_array(line_blocks, ncols = 1, sep = None, first_line = 1):
+    # Function that parses all line blocks into one int64 array
+    arrays = list(iter_int_arrays(line_blocks, ncols, sep, first_line))
+    if not arrays:
+        return(_empty(ncols))
+    return(numpy.concatenate(arrays))
@@ -0,0 +1,112 @@
+#! /usr/bin/python
+
+# Author: Addison Martin
+# This script is a helper for the Datason package
+# It saves and loads partial histograms: the exact count of every value (or
+# (x, y) pair) that inthisto/inthisto2d counted, so that data spread over
+# several machines can be counted where it is and only these small tables
+# are brought together and merged (with the merge command) before plotting.
+# Counts are stored at integer resolution rather than in bins, so partials
+# with different ranges merge exactly. A partial is stored either
+#   - dense: the counts of every value (or cell) from an offset, for data
+#     with a small range, or
+#   - sparse: the values (or cells) that occur and their counts
+# whichever the counter used, as JSON (.json) or compressed numpy (.npz,
+# any other extension). Approximate histograms (inthisto --approximate) are
+# saved as the levels of their KLL sketch, which merge like exact counts.
+# Every partial records its total count, which is checked when it is loaded.
+# Files are written under a temporary name and then renamed, so a partial
+# that is rewritten while a stream is counted (--snapshot_every) is never
+# seen half written.
+
+import os, json
+import numpy
+from counting import IntegerCounter, PairCounter
+from sketches import KLLSketch
+
+PARTIAL_VERSION = 1
+
+def _layout(counter):
+    # Function that returns the kind and arrays of a counter's counts
+    if isinstance(counter, KLLSketch):
+        return("sketch", "levels", {"items": numpy.concatenate(counter.levels), "level_sizes": numpy.array([len(items) for items in counter.levels], dtype = numpy.int64)})
+    if isinstance(counter, IntegerCounter):
+        counter._flush()
+        if counter.sparse is None and counter.dense is not None:
+            nonzero = numpy.flatnonzero(counter.dense)
+            if len(nonzero) == 0:
+                return("integers", "sparse", {"values": numpy.zeros(0, dtype = numpy.int64), "counts": numpy.zeros(0, dtype = numpy.int64)})
+            counts = counter.dense[nonzero[0]:nonzero[-1] + 1]
+            return("integers", "dense", {"offset": numpy.int64(counter.offset + nonzero[0]), "counts": counts})
+        values, counts = counter.table()
+        return("integers", "sparse", {"values": values, "counts": counts})
+    if counter.sparse is None and counter.dense is not None:
+        rows = numpy.flatnonzero(counter.dense.any(axis = 1))
+        columns = numpy.flatnonzero(counter.dense.any(axis = 0))
+        if len(rows) > 0:
+            counts = counter.dense[rows[0]:rows[-1] + 1, columns[0]:columns[-1] + 1]
+            return("pairs", "dense", {"x0": numpy.int64(counter.x0 + rows[0]), "y0": numpy.int64(counter.y0 + columns[0]), "counts": counts})
+    x, y, counts = counter.table()
+    return("pairs", "sparse", {"x": x, "y": y, "counts": counts})
+
+def save_partial(path, counter, labels = None, meta = None):
+    # Function that saves the counts of an IntegerCounter or PairCounter to
+    # path; labels are the axis labels (e.g. from a header line) and meta any
+    # other JSON serializable information to keep with the counts
+    kind, layout, arrays = _layout(counter)
+    info = {"version": PARTIAL_VERSION, "kind": kind, "layout": layout, "total": counter.total(), "labels": labels or [], "meta": meta or {}}
+    if kind == "sketch":
+        info["sketch"] = {"k": counter.k, "sum": counter.sum, "min": counter.min, "max": counter.max}
+    temporary = f"{path}.tmp{os.getpid()}"
+    if path.endswith(".json"):
+        data = dict(info, **{name: array.tolist() for name, array in arrays.items()})
+        with open(temporary, "w") as f:
+            json.dump(data, f)
+    else:
+        with open(temporary, "wb") as f:
+            numpy.savez_compressed(f, info = numpy.array(json.dumps(info)), **arrays)
+    os.replace(temporary, path)
+
+def load_partial(path):
+    # Function that loads a partial histogram and returns (counter, info);
+    # raises ValueError if the file is not a valid partial
+    try:
+        if path.endswith(".json"):
+            with open(path) as f:
+                data = json.load(f)
+            info = {key: data[key] for key in ("version", "kind", "layout", "total", "labels", "meta", "sketch") if key in data}
+            arrays = {key: numpy.asarray(value, dtype = numpy.int64) for key, value in data.items() if key not in info}
+        else:
+            with numpy.load(path, allow_pickle = False) as data:
+                info = json.loads(str(data["info"]))
+                arrays = {key: data[key] for key in data.files if key != "info"}
+    except (OSError, KeyError, ValueError) as error:
+        raise ValueError(f"{path} is not a partial histogram ({error})")
+    if info["version"] > PARTIAL_VERSION:
+        raise ValueError(f"{path} was written by a newer version of datason")
+    if info["kind"] == "integers":
+        counter = IntegerCounter()
+        if info["layout"] == "dense":
+            counts = arrays["counts"]
+            nonzero = numpy.flatnonzero(counts)
+            counter.add_counts(nonzero + int(arrays["offset"]), counts[nonzero])
+        else:
+            counter.add_counts(arrays["values"], arrays["counts"])
+    elif info["kind"] == "pairs":
+        counter = PairCounter()
+        if info["layout"] == "dense":
+            x, y = numpy.nonzero(arrays["counts"])
+            counter.add_counts(x + int(arrays["x0"]), y + int(arrays["y0"]), arrays["counts"][x, y])
+        else:
+            counter.add_counts(arrays["x"], arrays["y"], arrays["counts"])
+    elif info["kind"] == "sketch":
+        counter = KLLSketch(info["sketch"]["k"])
+        counter.levels = numpy.split(arrays["items"], numpy.cumsum(arrays["level_sizes"])[:-1])
+        counter.count = info["total"]
+        counter.sum, counter.min, counter.max = info["sketch"]["sum"], info["sketch"]["min"], info["sketch"]["max"]
+    else:
+        raise ValueError(f"{path} holds an unknown kind of partial histogram ({info['kind']})")
+    total = int(counter.table()[-1].sum())
+    if total != info["total"]:
+        raise ValueError(f"{path} is damaged: its counts add up to {total} instead of {info['total']}")
+    return(counter, info)
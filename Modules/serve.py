@@ -0,0 +1,355 @@
+#! /usr/bin/python
+
+# Author: Addison Martin
+# This script is a module for the Datason package
+# It runs a persistent server that keeps the Datason modules (and numpy and
+# matplotlib) imported, so that running a command many times in a loop does
+# not pay for interpreter startup and imports each time. The server listens
+# on a local Unix socket; for every request it forks a copy of itself, which
+# is already warm, and the copy runs the command. The client hands its own
+# stdin, stdout and stderr to the server over the socket together with argv,
+# the working directory and the environment, so input and output go straight
+# between the command and the client's files/pipes, and the exit code is sent
+# back when the command is done. datason.py uses a running server on its own.
+# As the environment and the terminal are handed over, both sides check who
+# is on the other end: the socket is kept in a directory only its user can
+# access, and the client only talks to a socket owned by its own user whose
+# listening process runs as that user (and the server only serves clients
+# running as its own user); otherwise commands run without the server.
+
+import os, sys, socket, json, stat, struct
+
+# Size of the length prefix sent before every request
+_LENGTH_BYTES = 8
+# Seconds a command may keep running after its client has disconnected
+_HANGUP_GRACE = 0.5
+
+def socket_directory():
+    # Function that returns the per-user directory the server socket is kept
+    # in, under $XDG_RUNTIME_DIR or /tmp
+    base = os.environ.get("XDG_RUNTIME_DIR") or "/tmp"
+    return(os.path.join(base, f"datason-{os.getuid()}"))
+
+def socket_path():
+    # Function that returns the path of the server socket; DATASON_SOCKET can
+    # be set to run several servers or to put the socket somewhere else
+    # (datason.server_socket_path gives the same path without imports)
+    if os.environ.get("DATASON_SOCKET"):
+        return(os.environ["DATASON_SOCKET"])
+    return(os.path.join(socket_directory(), "datason.sock"))
+
+def _private_directory(path, create = False):
+    # Function that returns True if path is a directory (not a link) owned by
+    # this user that no other user can access; with create it is made first
+    # (mode 0700) if it does not exist
+    if create == True:
+        try:
+            os.mkdir(path, 0o700)
+        except FileExistsError:
+            pass
+    try:
+        info = os.lstat(path)
+    except OSError:
+        return(False)
+    return(stat.S_ISDIR(info.st_mode) and info.st_uid == os.getuid() and info.st_mode & 0o077 == 0)
+
+def trusted_socket(path):
+    # Function that returns True if path is a socket owned by this user and,
+    # in the default location, inside a private directory of this user
+    try:
+        info = os.lstat(path)
+    except OSError:
+        return(False)
+    if not stat.S_ISSOCK(info.st_mode) or info.st_uid != os.getuid():
+        return(False)
+    if os.path.dirname(path) == socket_directory() and _private_directory(socket_directory()) == False:
+        return(False)
+    return(True)
+
+def peer_uid(conn):
+    # Function that returns the user ID of the process at the other end of a
+    # connected Unix socket, or None where the system cannot tell (it is read
+    # with SO_PEERCRED, which is Linux only)
+    if not hasattr(socket, "SO_PEERCRED"):
+        return(None)
+    size = struct.calcsize("3i")
+    pid, uid, gid = struct.unpack("3i", conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, size))
+    return(uid)
+
+def _connect(path):
+    # Function that connects to the server; returns None if it is not running
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+    except OSError:
+        client.close()
+        return(None)
+    return(client)
+
+def _send_request(client, request, fds = ()):
+    payload = json.dumps(request).encode()
+    socket.send_fds(client, [len(payload).to_bytes(_LENGTH_BYTES, "big") + payload], list(fds))
+
+def _read_reply(client):
+    # Function that reads the one line reply to a request; the server keeps
+    # its end open, so the reply ends at the line break rather than at EOF
+    data = b""
+    while not data.endswith(b"\n"):
+        chunk = client.recv(4096)
+        if not chunk: break
+        data += chunk
+    return(json.loads(data) if data.endswith(b"\n") else None)
+
+def run_remote(command, argv, path = None):
+    # Function that runs a command on the server with this process's stdin,
+    # stdout, stderr, working directory and environment and returns its exit
+    # code; returns None if no server is running, or if the socket or the
+    # process listening on it do not belong to this user (nothing is sent then)
+    path = path or socket_path()
+    if trusted_socket(path) == False:
+        if os.path.exists(path): print(f"Note: not using the datason server socket {path} as it does not belong to this user (or is not private); running the command without it", file = sys.stderr)
+        return(None)
+    client = _connect(path)
+    if client == None:
+        return(None)
+    if peer_uid(client) != os.getuid():
+        client.close()
+        print(f"Note: not using the datason server on {path} as it does not run as this user; running the command without it", file = sys.stderr)
+        return(None)
+    try:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        _send_request(client, {"command": command, "argv": list(argv), "cwd": os.getcwd(), "env": dict(os.environ)}, [0, 1, 2])
+        reply = _read_reply(client)
+    except KeyboardInterrupt:
+        # Closing the connection makes the server stop the command
+        return(130)
+    finally:
+        client.close()
+    if reply == None:
+        print("Note: the datason server closed the connection before the command finished", file = sys.stderr)
+        return(1)
+    return(reply["exit"])
+
+def _receive_request(conn):
+    # Function that reads one request and the file descriptors sent with it
+    data, fds, _, _ = socket.recv_fds(conn, 1 << 16, 3)
+    while len(data) >= _LENGTH_BYTES and len(data) < _LENGTH_BYTES + int.from_bytes(data[:_LENGTH_BYTES], "big"):
+        chunk = conn.recv(1 << 16)
+        if not chunk: break
+        data += chunk
+    if len(data) < _LENGTH_BYTES:
+        raise ValueError("incomplete request")
+    return(json.loads(data[_LENGTH_BYTES:]), fds)
+
+def _run_request(request, fds, runner, commands):
+    # Function run in the forked copy of the server: takes over the client's
+    # files, working directory and environment and runs the command
+    import signal, traceback
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    for target, fd in enumerate(fds):
+        os.dup2(fd, target)
+        os.close(fd)
+    try:
+        os.chdir(request["cwd"])
+        os.environ.clear()
+        os.environ.update(request["env"])
+        if request["command"] not in commands or commands[request["command"]]["wrapper"] == True:
+            print(f"datason: unknown command {request['command']!r}", file = sys.stderr)
+            return(2)
+        return(runner(request["command"], request["argv"]))
+    except BaseException:
+        traceback.print_exc()
+        return(1)
+    finally:
+        for stream in (sys.stdout, sys.stderr):
+            try: stream.flush()
+            except Exception: pass
+
+def preload(commands, plotting = True):
+    # Function that imports every command module and the helpers they import
+    # when run, so that forked copies of the server start warm
+    import importlib
+    for name in ["numpy", "counting", "composition", "datainput", "intparse", "fastaindex", "termplot"]:
+        importlib.import_module(name)
+    for command, entry in commands.items():
+        if entry["wrapper"] == False:
+            importlib.import_module(entry["module"])
+    if plotting == True:
+        import histplot
+        histplot._pyplot()
+
+def serve(path, runner, commands, max_jobs = 4, idle_timeout = 600, verbose = False):
+    # Function that runs the server until it is stopped, receives SIGTERM or
+    # SIGINT, or has been idle for idle_timeout seconds (0 never times out).
+    # At most max_jobs commands run at once; further requests wait
+    import select, signal, time
+    if os.path.dirname(path) == socket_directory() and _private_directory(socket_directory(), create = True) == False:
+        print(f"Note: {socket_directory()} is not a directory that only this user can access, so the socket cannot be kept there. Quitting...")
+        return(1)
+    existing = _connect(path)
+    if existing != None:
+        existing.close()
+        print(f"Note: a datason server is already listening on {path}")
+        return(1)
+    if os.path.exists(path):
+        os.unlink(path)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o177)
+    try:
+        listener.bind(path)
+    finally:
+        os.umask(old_umask)
+    listener.listen(64)
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)
+
+    # Running commands: process id -> connection to its client (None once the
+    # client has gone), and process id -> time to stop a command whose
+    # client has gone
+    active = {}
+    hung_up = {}
+    last_activity = time.monotonic()
+    if verbose == True: print(f"Listening on {path} (at most {max_jobs} jobs at once)")
+    try:
+        while True:
+            for pid in list(active):
+                done, status = os.waitpid(pid, os.WNOHANG)
+                if done:
+                    if active[pid] != None: active[pid].close()
+                    del active[pid]
+                    hung_up.pop(pid, None)
+                    last_activity = time.monotonic()
+                    if verbose == True: print(f"Job {pid} finished with status {os.waitstatus_to_exitcode(status)}")
+                elif pid in hung_up and time.monotonic() > hung_up[pid]:
+                    # The client went away before its command finished
+                    try: os.kill(pid, signal.SIGTERM)
+                    except ProcessLookupError: pass
+                    del hung_up[pid]
+            if not active and idle_timeout > 0 and time.monotonic() - last_activity > idle_timeout:
+                if verbose == True: print(f"Idle for {idle_timeout} seconds; shutting down")
+                break
+            watched = [conn for conn in active.values() if conn != None]
+            waiting = [listener] if len(active) < max_jobs else []
+            readable, _, _ = select.select(waiting + watched, [], [], 0.2)
+            for ready in readable:
+                if ready is not listener:
+                    # A client only ever closes its end, which it also does
+                    # right after the reply; the command is stopped if it is
+                    # still running shortly after
+                    for pid, conn in active.items():
+                        if conn is ready:
+                            conn.close()
+                            active[pid] = None
+                            hung_up[pid] = time.monotonic() + _HANGUP_GRACE
+                            break
+                    continue
+                conn, _ = listener.accept()
+                last_activity = time.monotonic()
+                # Only processes of the user running the server are served
+                if peer_uid(conn) != os.getuid():
+                    if verbose == True: print("Dropped a request from another user")
+                    conn.close()
+                    continue
+                try:
+                    request, fds = _receive_request(conn)
+                except (OSError, ValueError) as error:
+                    if verbose == True: print(f"Dropped a bad request: {error}")
+                    conn.close()
+                    continue
+                if request.get("stop") == True:
+                    conn.sendall(json.dumps({"exit": 0}).encode() + b"\n")
+                    conn.close()
+                    if verbose == True: print("Received a stop request; shutting down")
+                    return(0)
+                if len(fds) != 3:
+                    for fd in fds: os.close(fd)
+                    conn.close()
+                    continue
+                sys.stdout.flush()
+                sys.stderr.flush()
+                pid = os.fork()
+                if pid == 0:
+                    listener.close()
+                    code = _run_request(request, fds, runner, commands)
+                    try: conn.sendall(json.dumps({"exit": code}).encode() + b"\n")
+                    except OSError: pass
+                    os._exit(0)
+                for fd in fds: os.close(fd)
+                active[pid] = conn
+                if verbose == True: print(f"Job {pid}: datason {request['command']} {' '.join(request['argv'])}")
+    except KeyboardInterrupt:
+        if verbose == True: print("Shutting down")
+    finally:
+        listener.close()
+        try: os.unlink(path)
+        except FileNotFoundError: pass
+    return(0)
+
+def main(argv = None, runner = None, commands = None):
+    import argparse
+
+    #####################
+    # Parsing arguments #
+    #####################
+    parser = argparse.ArgumentParser(description = "This module starts a server that keeps the Datason modules imported so that repeated datason commands start instantly. While it runs, datason commands are sent to it automatically (set DATASON_NO_SERVER=1 to run a command without it). The server listens on a Unix socket only reachable by the current user, and commands are only sent to a server running as the current user (checked with SO_PEERCRED, so on Linux only).")
+    parser.add_argument(
+        "-v", "--verbose",
+        action = "store_true",
+        default = False,
+        dest = "verbose")
+    parser.add_argument(
+        "--socket",
+        help = "Path of the Unix socket to listen on (default $DATASON_SOCKET, or datason.sock in a private datason-<uid> directory in $XDG_RUNTIME_DIR or /tmp)",
+        type = str,
+        dest = "socket")
+    parser.add_argument(
+        "-j", "--jobs",
+        help = "Maximum number of commands run at the same time; further commands wait (default 4)",
+        type = int,
+        default = 4,
+        dest = "jobs")
+    parser.add_argument(
+        "--idle_timeout",
+        help = "Seconds without any command after which the server shuts down; 0 keeps it running (default 600)",
+        type = float,
+        default = 600,
+        dest = "idle_timeout")
+    parser.add_argument(
+        "--no_plotting",
+        help = "Does not preload matplotlib (saves memory if no images are made)",
+        action = "store_true",
+        dest = "no_plotting")
+    parser.add_argument(
+        "--stop",
+        help = "Stops a running server instead of starting one",
+        action = "store_true",
+        dest = "stop")
+    args = parser.parse_args(argv)
+    if args.verbose == True: print(f"The following arguments were received: {args}") # for troubleshooting
+    path = os.path.abspath(args.socket) if args.socket != None else socket_path()
+
+    if args.stop == True:
+        client = _connect(path)
+        if client == None:
+            print(f"No datason server is listening on {path}")
+            return(1)
+        _send_request(client, {"stop": True})
+        _read_reply(client)
+        client.close()
+        print(f"Stopped the datason server on {path}")
+        return(0)
+
+    if runner == None:
+        print("Note: the server must be started with 'datason serve'. Quitting...")
+        exit()
+    if args.verbose == True: print("Preloading modules...")
+    preload(commands, plotting = not args.no_plotting)
+    return(serve(path, runner, commands, max(args.jobs, 1), args.idle_timeout, args.verbose))
+
+
+if __name__ == "__main__":
+    main()
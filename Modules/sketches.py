@@ -0,0 +1,230 @@
+#! /usr/bin/python
+
+# Author: Addison Martin
+# This script is a helper for the Datason package
+# It provides small fixed-size summaries ("sketches") of data that is too
+# large to keep. Sketches of different chunks, files or processes can be
+# merged, giving the same result as one sketch of all of the data.
+#   - HyperLogLog estimates the number of distinct values with a relative
+#     error of about 1.04 / sqrt(2 ** precision) in 2 ** precision bytes
+#   - KLLSketch keeps a weighted sample of at most about 3 * k numbers from
+#     which quantiles, ranks and histograms are estimated; the rank of any
+#     value is off by at most about rank_error(k) (2.3 / k ** 0.97, e.g. 0.14%
+#     for k = 2000) of the number of values, so each histogram bin count is
+#     off by at most twice that
+# Values are hashed with hash_strings, a vectorized 64 bit hash that (unlike
+# Python's hash()) gives the same hashes in every process.
+
+import numpy
+
+_MULTIPLIER = numpy.uint64(0x9E3779B97F4A7C15)
+_MIX_1 = numpy.uint64(0xBF58476D1CE4E5B9)
+_MIX_2 = numpy.uint64(0x94D049BB133111EB)
+
+def _mix(h):
+    # Function that scrambles the bits of an array of uint64 (splitmix64 finalizer)
+    h = h ^ (h >> numpy.uint64(30))
+    h = h * _MIX_1
+    h = h ^ (h >> numpy.uint64(27))
+    h = h * _MIX_2
+    return(h ^ (h >> numpy.uint64(31)))
+
+def hash_strings(values):
+    # Function that returns an array of 64 bit hashes of a list of strings.
+    # The strings are laid out as fixed width numpy arrays of code points,
+    # which are hashed 64 bits (two code points) at a time across all strings;
+    # each string only takes the words it fills, so its hash does not depend
+    # on the padding. Strings are laid out in groups of similar length
+    # (between 2 ** (n - 1) and 2 ** n code points), so one long string does
+    # not pad all the others to its length
+    values = numpy.asarray(values, dtype = object)
+    hashes = numpy.zeros(len(values), dtype = numpy.uint64)
+    if len(values) == 0:
+        return(hashes)
+    lengths = numpy.fromiter(map(len, values), dtype = numpy.int64, count = len(values))
+    groups = numpy.frexp(lengths)[1]
+    for group in numpy.unique(groups):
+        selected = numpy.flatnonzero(groups == group)
+        hashes[selected] = _hash_fixed(values[selected].astype(str), lengths[selected])
+    return(hashes)
+
+def _hash_fixed(values, lengths):
+    # Function that hashes a fixed width numpy string array (see hash_strings)
+    width = values.dtype.itemsize // 4
+    if width % 2 == 1:
+        values = values.astype(f"U{width + 1}")
+        width += 1
+    words = values.view(numpy.uint64).reshape(len(values), width // 2)
+    n_words = (lengths + 1) // 2
+    with numpy.errstate(over = "ignore"):
+        h = _mix((lengths.astype(numpy.uint64) + numpy.uint64(1)) * _MULTIPLIER)
+        for column in range(words.shape[1]):
+            h = numpy.where(n_words > column, _mix((h ^ words[:, column]) * _MULTIPLIER), h)
+    return(h)
+
+def _leading_zeros(x):
+    # Function that returns the number of leading zero bits of every uint64
+    n = numpy.zeros(len(x), dtype = numpy.uint8)
+    for shift in (32, 16, 8, 4, 2, 1):
+        small = x < (numpy.uint64(1) << numpy.uint64(64 - shift))
+        n[small] += shift
+        x = numpy.where(small, x << numpy.uint64(shift), x)
+    n[x == 0] += 1
+    return(n)
+
+class HyperLogLog:
+    # Class that estimates the number of distinct values among everything
+    # added to it; precision sets the number of registers (2 ** precision)
+    def __init__(self, precision = 14):
+        self.precision = precision
+        self.registers = numpy.zeros(1 << precision, dtype = numpy.uint8)
+
+    def add_hashes(self, hashes):
+        # Function that adds an array of uint64 hashes (see hash_strings)
+        hashes = numpy.asarray(hashes, dtype = numpy.uint64)
+        if len(hashes) == 0:
+            return
+        p = numpy.uint64(self.precision)
+        index = (hashes >> (numpy.uint64(64) - p)).astype(numpy.intp)
+        rank = numpy.minimum(_leading_zeros(hashes << p), 64 - self.precision) + 1
+        numpy.maximum.at(self.registers, index, rank.astype(numpy.uint8))
+
+    def add_strings(self, values):
+        # Function that adds a list of strings
+        self.add_hashes(hash_strings(values))
+
+    def merge(self, other):
+        # Function that adds the values seen by another HyperLogLog of the same precision
+        if other.precision != self.precision:
+            raise ValueError("cannot merge HyperLogLog sketches of different precision")
+        numpy.maximum(self.registers, other.registers, out = self.registers)
+
+    def estimate(self):
+        # Function that returns the estimated number of distinct values
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / numpy.sum(numpy.ldexp(1.0, -self.registers.astype(numpy.int64)))
+        zeros = int(numpy.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and zeros > 0:
+            # Linear counting is more accurate for small cardinalities
+            return(float(m * numpy.log(m / zeros)))
+        return(float(raw))
+
+def rank_error(k):
+    # Function that returns the usual largest error of the estimated ranks
+    # (and so of the counts below any value) of a KLLSketch, as a fraction
+    # of the number of values seen; errors are random and almost always
+    # (99%) smaller than this
+    return(2.3 / k ** 0.97)
+
+class KLLSketch:
+    # Class that summarises a stream of numbers in bounded memory (a KLL
+    # quantile sketch). Values are kept in levels; every value of level h
+    # stands for 2 ** h values of the stream. When a level gets full it is
+    # sorted and every other value (starting at random from the first or the
+    # second) is moved one level up, halving the values kept at the cost of a
+    # small random rank error. Lower levels hold fewer values (each 2/3 of the
+    # one above it, with k at the top) so at most about 3 * k values are kept
+    # however long the stream is. The number, sum, minimum and maximum of the
+    # values are kept exactly. Sketches with the same k are mergeable
+    def __init__(self, k = 2000, seed = 0):
+        self.k = k
+        self.levels = [numpy.zeros(0, dtype = numpy.int64)]
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+        self.rng = numpy.random.default_rng(seed)
+
+    def _capacity(self, level):
+        return(max(int(numpy.ceil(self.k * (2/3) ** (len(self.levels) - 1 - level))), 2))
+
+    def add_many(self, values):
+        # Function that adds every value in an array (or list) of integers
+        values = numpy.asarray(values, dtype = numpy.int64)
+        if len(values) == 0:
+            return
+        self.count += len(values)
+        self.sum += int(values.sum())
+        low = int(values.min())
+        high = int(values.max())
+        self.min = low if self.min == None else min(self.min, low)
+        self.max = high if self.max == None else max(self.max, high)
+        self.levels[0] = numpy.concatenate([self.levels[0], values])
+        self._compress()
+
+    def _compress(self):
+        # Function that compacts full levels until every level fits
+        level = 0
+        while level < len(self.levels):
+            if len(self.levels[level]) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(numpy.zeros(0, dtype = numpy.int64))
+                items = numpy.sort(self.levels[level])
+                even = len(items) - len(items) % 2
+                self.levels[level + 1] = numpy.concatenate([self.levels[level + 1], items[int(self.rng.integers(2)):even:2]])
+                self.levels[level] = items[even:]
+                # Adding a level lowers the capacity of the ones below it
+                level = 0
+            else:
+                level += 1
+
+    def merge(self, other):
+        # Function that adds the values summarised by another KLLSketch
+        if other.k != self.k:
+            raise ValueError("cannot merge KLL sketches with different k")
+        if other.count == 0:
+            return(self)
+        while len(self.levels) < len(other.levels):
+            self.levels.append(numpy.zeros(0, dtype = numpy.int64))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = numpy.concatenate([self.levels[level], items])
+        self.count += other.count
+        self.sum += other.sum
+        self.min = other.min if self.min == None else min(self.min, other.min)
+        self.max = other.max if self.max == None else max(self.max, other.max)
+        self._compress()
+        return(self)
+
+    def retained(self):
+        # Function that returns the number of values kept
+        return(sum(len(items) for items in self.levels))
+
+    def rank_error(self):
+        return(rank_error(self.k))
+
+    def table(self):
+        # Function that returns the kept values as two sorted numpy arrays:
+        # the distinct values and the number of stream values each stands for
+        # (which add up to the number of values seen), like
+        # IntegerCounter.table
+        items = numpy.concatenate(self.levels)
+        weights = numpy.concatenate([numpy.full(len(items), 1 << level, dtype = numpy.int64) for level, items in enumerate(self.levels)])
+        values, inverse = numpy.unique(items, return_inverse = True)
+        return(values, numpy.bincount(inverse.ravel(), weights = weights, minlength = len(values)).astype(numpy.int64))
+
+    def total(self):
+        return(self.count)
+
+    def value_sum(self):
+        return(self.sum)
+
+    def quantile(self, q):
+        # Function that returns the estimated q quantile (0 <= q <= 1); the
+        # minimum and maximum are exact
+        if not 0 <= q <= 1:
+            raise ValueError(f"quantile must be between 0 and 1, not {q}")
+        if q == 0: return(self.min)
+        if q == 1: return(self.max)
+        values, counts = self.table()
+        cumulative = numpy.cumsum(counts)
+        return(int(values[min(int(numpy.searchsorted(cumulative, q * self.count, side = "left")), len(values) - 1)]))
+
+    def median(self):
+        return(self.quantile(0.5))
+
+    def histogram(self, bins = 10, value_range = None):
+        # Function that returns estimated (counts, bin_edges) as
+        # numpy.histogram would give for all values seen
+        values, counts = self.table()
+        return(numpy.histogram(values, bins = bins, range = value_range, weights = counts))
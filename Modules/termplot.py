@@ -0,0 +1,65 @@
+#! /usr/bin/python
+
+# Author: Addison Martin
+# This script is a helper for the Datason package
+# It renders histograms as Unicode block characters for a quick look in a
+# terminal (e.g. over SSH) without matplotlib. Bins are merged down to the
+# number of rows (or columns) that fit, and bars are drawn with eighth-block
+# characters so they have sub-character resolution.
+
+import numpy
+
+# Default size of the plots; modules bin their data to this resolution
+ROWS = 20
+COLUMNS = 60
+
+_EIGHTHS = " ▏▎▍▌▋▊▉█"
+_SHADES = " ░▒▓█"
+
+def _merge_bins(edges, counts, n):
+    # Function that merges adjacent bins so that at most n bins remain
+    if len(counts) <= n:
+        return(edges, counts)
+    groups = numpy.linspace(0, len(counts), n + 1).astype(int)
+    return(edges[groups], numpy.add.reduceat(counts, groups[:-1]))
+
+def _format_edge(value):
+    if float(value).is_integer(): return(str(int(value)))
+    return(f"{value:.6g}")
+
+def render_histogram(edges, counts, rows = ROWS, width = 50):
+    # Function that returns a horizontal bar chart of a histogram as a string;
+    # each line shows a bin range, a bar and the count of the bin
+    edges, counts = _merge_bins(numpy.asarray(edges), numpy.asarray(counts), rows)
+    labels = [f"[{_format_edge(low)}, {_format_edge(high)})" for low, high in zip(edges[:-1], edges[1:])]
+    label_width = max(len(label) for label in labels)
+    peak = counts.max() if len(counts) and counts.max() > 0 else 1
+    lines = []
+    for label, count in zip(labels, counts):
+        eighths = int(round(count / peak * width * 8))
+        bar = "█" * (eighths // 8) + (_EIGHTHS[eighths % 8] if eighths % 8 else "")
+        lines.append(f"{label:>{label_width}} │{bar:<{width}} {_format_edge(count)}")
+    return("\n".join(lines))
+
+def render_histogram2d(edges_x, edges_y, counts, rows = ROWS, columns = COLUMNS):
+    # Function that returns a 2D histogram (counts indexed [x bin, y bin]) as a
+    # string of shaded blocks, y increasing upwards, darker meaning more counts
+    counts = numpy.asarray(counts)
+    edges_x, counts = _merge_bins(numpy.asarray(edges_x), counts, columns)
+    edges_y, counts_t = _merge_bins(numpy.asarray(edges_y), counts.T, rows)
+    counts = counts_t.T
+    peak = counts.max() if counts.size and counts.max() > 0 else 1
+    levels = numpy.ceil(counts / peak * (len(_SHADES) - 1)).astype(int)
+    top = _format_edge(edges_y[-1])
+    bottom = _format_edge(edges_y[0])
+    margin = max(len(top), len(bottom))
+    lines = []
+    for row in range(levels.shape[1] - 1, -1, -1):
+        label = top if row == levels.shape[1] - 1 else bottom if row == 0 else ""
+        lines.append(f"{label:>{margin}} │" + "".join(_SHADES[level] for level in levels[:, row]))
+    lines.append(" " * margin + " └" + "─" * levels.shape[0])
+    left = _format_edge(edges_x[0])
+    right = _format_edge(edges_x[-1])
+    lines.append(" " * (margin + 2) + left + right.rjust(max(levels.shape[0] - len(left), len(right) + 1)))
+    lines.append(f"max count per cell: {_format_edge(peak)}")
+    return("\n".join(lines))
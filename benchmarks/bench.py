@@ -0,0 +1,312 @@
+#! /usr/bin/python
+
+# Author: Addison Martin
+# This script is part of the Datason benchmarks
+# It times the stages of every module on synthetic inputs (see generators.py)
+# and records the wall time, CPU time and peak memory (RSS) of each stage.
+# Every case runs in a fresh python process so imports and memory are
+# measured from a clean start, and each case is repeated, keeping the fastest
+# time of every stage. Results are saved as JSON and can be compared against
+# a stored baseline: a stage that is slower (or uses more memory) than the
+# baseline by more than the tolerance is reported as a regression and the
+# script exits with status 1, so it can be used as a gate before merging.
+# Everything runs offline with the modules in this repository.
+#   python benchmarks/bench.py                       run and compare to baseline_small.json
+#   python benchmarks/bench.py --save_baseline       run and store a new baseline
+
+import os, sys, json, time, argparse, platform, subprocess, contextlib
+
+directory = os.path.dirname(os.path.realpath(__file__))
+repository = os.path.dirname(directory)
+sys.path.insert(0, os.path.join(repository, "Modules"))
+sys.path.insert(0, directory)
+
+# The stages are measured the same way as by the instrumentation of the modules
+from instrument import _peak_rss_kb, _reset_peak_rss
+
+# Sizes of the synthetic inputs for each preset
+PRESETS = {
+    "small": {"fasta_records": 2000, "fasta_mean_length": 2000, "integers": 500000, "pairs": 300000, "repeat": 3},
+    "large": {"fasta_records": 20000, "fasta_mean_length": 10000, "integers": 10000000, "pairs": 5000000, "repeat": 3}}
+
+#################
+# Stage timing #
+#################
+
+class StageTimer:
+    # Class that records the wall time, CPU time and peak memory of named
+    # stages run inside its stage() context
+    def __init__(self):
+        self.stages = {}
+
+    @contextlib.contextmanager
+    def stage(self, name, quiet = True):
+        # Context in which one stage runs; output is discarded when quiet.
+        # CPU time and peak memory include child processes the stage ran
+        import resource
+        _reset_peak_rss()
+        with open(os.devnull, "w") as devnull, contextlib.ExitStack() as stack:
+            if quiet == True: stack.enter_context(contextlib.redirect_stdout(devnull))
+            start_wall = time.perf_counter()
+            start_cpu = time.process_time()
+            start_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+            yield
+            children = resource.getrusage(resource.RUSAGE_CHILDREN)
+            self.stages[name] = {
+                "seconds": time.perf_counter() - start_wall,
+                "cpu_seconds": time.process_time() - start_cpu + (children.ru_utime - start_children.ru_utime) + (children.ru_stime - start_children.ru_stime),
+                "peak_rss_mb": max(_peak_rss_kb(), children.ru_maxrss if children.ru_maxrss > start_children.ru_maxrss else 0) / 1024}
+
+#########
+# Cases #
+#########
+
+def case_fastastats(paths, timer):
+    from fastastats import read_fasta_records, import_fastas_as_list, collect_stats, print_stats
+    import fastastats
+    path = paths["fasta"]
+    with timer.stage("import_fastas_as_list"):
+        with open(path, "rb") as f:
+            fastas = import_fastas_as_list(f)
+    del fastas
+    with timer.stage("parse"):
+        with open(path, "rb") as f:
+            records = list(read_fasta_records(f))
+    with timer.stage("stats"):
+        stats = collect_stats(records)
+    del records
+    with timer.stage("report"):
+        print_stats(stats, composition = True, quantiles = [0.1, 0.9])
+    with timer.stage("histogram"):
+        counts, edges = stats.lengths.histogram(200)
+    with timer.stage("plot"):
+        from histplot import plot_histogram
+        plot_histogram(edges, counts, paths["png"])
+    with timer.stage("cli"):
+        fastastats.main(["-i", path])
+    with timer.stage("cli_kmers"):
+        fastastats.main(["-i", path, "-k", "8", "--dinucleotides"])
+
+def case_inthisto(paths, timer):
+    from datainput import iter_input_blocks
+    from intparse import iter_line_blocks, read_int_array
+    from counting import IntegerCounter, bin_edges
+    import inthisto
+    path = paths["integers"]
+    with timer.stage("parse"):
+        values = read_int_array(iter_line_blocks(iter_input_blocks(path)))
+    with timer.stage("count"):
+        counter = IntegerCounter()
+        counter.add_many(values)
+        counter.table()
+    with timer.stage("bins"):
+        counts, edges = counter.histogram(bin_edges(counter, 1000))
+    with timer.stage("plot"):
+        from histplot import plot_histogram
+        plot_histogram(edges, counts, paths["png"], annotate = True)
+    with timer.stage("cli"):
+        inthisto.main(["-i", path])
+    with timer.stage("cli_proportions"):
+        inthisto.main(["-i", path, "-p"])
+
+def case_inthisto2d(paths, timer):
+    from datainput import iter_input_blocks
+    from intparse import iter_line_blocks, read_int_array
+    from counting import PairCounter, bin_edges
+    import inthisto2d
+    path = paths["pairs"]
+    with timer.stage("parse"):
+        values = read_int_array(iter_line_blocks(iter_input_blocks(path)), 2, "\t")
+    with timer.stage("count"):
+        counter = PairCounter()
+        counter.add_many(values[:, 0], values[:, 1])
+    with timer.stage("bins"):
+        edges_x = bin_edges(counter.marginal(0), 1000)
+        edges_y = bin_edges(counter.marginal(1), 1000)
+        binned = counter.histogram2d(edges_x, edges_y)
+    with timer.stage("plot"):
+        from histplot import plot_histogram2d
+        plot_histogram2d(edges_x, edges_y, binned, paths["png"])
+    with timer.stage("cli"):
+        inthisto2d.main(["-i", path])
+
+def case_startup(paths, timer):
+    # Cold start of the command line tool: a fresh interpreter per command
+    datason = os.path.join(repository, "datason.py")
+    env = dict(os.environ, DATASON_NO_SERVER = "1")
+    commands = {
+        "help": [sys.executable, datason, "--help"],
+        "inthisto_tiny": [sys.executable, datason, "inthisto", "-i", paths["tiny"]],
+        "enum_headers": [sys.executable, datason, "enum_headers", paths["tiny"]]}
+    for name, command in commands.items():
+        with timer.stage(name):
+            subprocess.run(command, env = env, stdout = subprocess.DEVNULL, check = True)
+
+CASES = {"fastastats": case_fastastats, "inthisto": case_inthisto, "inthisto2d": case_inthisto2d, "startup": case_startup}
+
+def prepare_data(data_dir, preset):
+    # Function that writes the synthetic inputs of a preset (unless they
+    # already exist) and returns their paths
+    import generators
+    sizes = PRESETS[preset]
+    os.makedirs(data_dir, exist_ok = True)
+    paths = {
+        "fasta": os.path.join(data_dir, f"fasta_{sizes['fasta_records']}_{sizes['fasta_mean_length']}.fa"),
+        "integers": os.path.join(data_dir, f"integers_{sizes['integers']}.txt"),
+        "pairs": os.path.join(data_dir, f"pairs_{sizes['pairs']}.tsv"),
+        "tiny": os.path.join(data_dir, "tiny.txt"),
+        "png": os.path.join(data_dir, "plot.png")}
+    writers = {
+        "fasta": lambda path: generators.write_fasta(path, sizes["fasta_records"], sizes["fasta_mean_length"]),
+        "integers": lambda path: generators.write_integers(path, sizes["integers"], 0, 5000, "zipf"),
+        "pairs": lambda path: generators.write_pairs(path, sizes["pairs"], 0, 2000),
+        "tiny": lambda path: generators.write_integers(path, 10)}
+    for name, writer in writers.items():
+        if not os.path.exists(paths[name]):
+            # Written under a temporary name so interrupted runs leave no partial inputs
+            writer(paths[name] + ".tmp")
+            os.replace(paths[name] + ".tmp", paths[name])
+    return(paths)
+
+def run_case(name, paths, repeat):
+    # Function that runs one case in fresh processes repeat times and returns
+    # the best time (and largest peak memory) of every stage
+    best = {}
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, os.path.realpath(__file__), "--run_case", name, "--paths", json.dumps(paths)], stdout = subprocess.PIPE, check = True).stdout
+        for stage, result in json.loads(output).items():
+            if stage not in best:
+                best[stage] = result
+                continue
+            for key in ("seconds", "cpu_seconds"):
+                best[stage][key] = min(best[stage][key], result[key])
+            best[stage]["peak_rss_mb"] = max(best[stage]["peak_rss_mb"], result["peak_rss_mb"])
+    return(best)
+
+def compare(results, baseline, tolerance, memory_tolerance, min_seconds = 0.02, min_mb = 8):
+    # Function that returns a list of regressions of results against a
+    # baseline; differences smaller than min_seconds or min_mb are ignored
+    # as noise
+    regressions = []
+    for case, stages in baseline["cases"].items():
+        for stage, base in stages.items():
+            current = results["cases"].get(case, {}).get(stage)
+            if current == None:
+                continue
+            if current["seconds"] > base["seconds"] * (1 + tolerance) and current["seconds"] - base["seconds"] > min_seconds:
+                regressions.append(f"{case}/{stage}: {current['seconds']:.3f} s vs {base['seconds']:.3f} s in baseline")
+            if current["peak_rss_mb"] > base["peak_rss_mb"] * (1 + memory_tolerance) and current["peak_rss_mb"] - base["peak_rss_mb"] > min_mb:
+                regressions.append(f"{case}/{stage}: {current['peak_rss_mb']:.1f} MB vs {base['peak_rss_mb']:.1f} MB in baseline")
+    return(regressions)
+
+def print_results(results, baseline = None):
+    print(f"{'stage':<36}{'seconds':>10}{'cpu':>10}{'peak MB':>10}{'baseline s':>12}")
+    for case, stages in results["cases"].items():
+        for stage, result in stages.items():
+            base = baseline["cases"].get(case, {}).get(stage) if baseline != None else None
+            base_text = f"{base['seconds']:.3f}" if base != None else ""
+            print(f"{case + '/' + stage:<36}{result['seconds']:>10.3f}{result['cpu_seconds']:>10.3f}{result['peak_rss_mb']:>10.1f}{base_text:>12}")
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Times every stage of the Datason modules on deterministic synthetic data and compares the results with a stored baseline")
+    parser.add_argument(
+        "--preset",
+        help = "Size of the synthetic inputs (default small)",
+        choices = list(PRESETS),
+        default = "small",
+        dest = "preset")
+    parser.add_argument(
+        "--cases",
+        help = "Cases to run (default all)",
+        nargs = "+",
+        choices = list(CASES),
+        default = list(CASES),
+        dest = "cases")
+    parser.add_argument(
+        "--repeat",
+        help = "Number of runs of each case; the fastest is kept (default from the preset)",
+        type = int,
+        dest = "repeat")
+    parser.add_argument(
+        "--data_dir",
+        help = "Directory for the synthetic inputs, which are reused between runs (default benchmarks/data)",
+        type = str,
+        default = os.path.join(directory, "data"),
+        dest = "data_dir")
+    parser.add_argument(
+        "-o", "--out",
+        help = "File location to save the results as JSON",
+        type = str,
+        dest = "out")
+    parser.add_argument(
+        "--baseline",
+        help = "Baseline results to compare against (default benchmarks/baseline_<preset>.json if it exists)",
+        type = str,
+        dest = "baseline")
+    parser.add_argument(
+        "--save_baseline",
+        help = "Saves the results as the new baseline instead of comparing",
+        action = "store_true",
+        dest = "save_baseline")
+    parser.add_argument(
+        "--tolerance",
+        help = "Allowed slowdown of a stage as a fraction of its baseline time (default 0.25)",
+        type = float,
+        default = 0.25,
+        dest = "tolerance")
+    parser.add_argument(
+        "--memory_tolerance",
+        help = "Allowed increase of the peak memory of a stage as a fraction of its baseline (default 0.25)",
+        type = float,
+        default = 0.25,
+        dest = "memory_tolerance")
+    parser.add_argument("--run_case", help = argparse.SUPPRESS, dest = "run_case")
+    parser.add_argument("--paths", help = argparse.SUPPRESS, dest = "paths")
+    args = parser.parse_args(argv)
+
+    # Child process: runs one case and reports its stages as JSON
+    if args.run_case != None:
+        timer = StageTimer()
+        CASES[args.run_case](json.loads(args.paths), timer)
+        print(json.dumps(timer.stages))
+        return(0)
+
+    import numpy
+    paths = prepare_data(os.path.join(args.data_dir, args.preset), args.preset)
+    repeat = args.repeat if args.repeat != None else PRESETS[args.preset]["repeat"]
+    results = {
+        "meta": {"preset": args.preset, "repeat": repeat, "python": platform.python_version(), "numpy": numpy.__version__, "machine": platform.machine(), "cpus": os.cpu_count(), "date": time.strftime("%Y-%m-%d")},
+        "cases": {}}
+    for case in args.cases:
+        results["cases"][case] = run_case(case, paths, repeat)
+
+    baseline_path = args.baseline if args.baseline != None else os.path.join(directory, f"baseline_{args.preset}.json")
+    if args.out != None:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent = 1)
+    if args.save_baseline == True:
+        with open(baseline_path, "w") as f:
+            json.dump(results, f, indent = 1)
+        print_results(results)
+        print(f"Baseline saved to {baseline_path}")
+        return(0)
+    if not os.path.exists(baseline_path):
+        print_results(results)
+        print(f"No baseline at {baseline_path}; use --save_baseline to store one")
+        return(0)
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print_results(results, baseline)
+    if baseline["meta"].get("machine") != results["meta"]["machine"] or baseline["meta"].get("cpus") != results["meta"]["cpus"]:
+        print("Note: the baseline was recorded on a different kind of machine; timings may not be comparable")
+    regressions = compare(results, baseline, args.tolerance, args.memory_tolerance)
+    if regressions:
+        print(f"{len(regressions)} regression(s) against {baseline_path}:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return(1)
+    print(f"No regressions against {baseline_path}")
+    return(0)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+#! /usr/bin/python
+
+# Author: Addison Martin
+# This script is part of the Datason benchmarks
+# It writes synthetic input files for the benchmarks. Every generator is
+# deterministic: the same parameters and seed always give byte-identical
+# files, so timings from different runs (and machines) measure the same work.
+#   - fasta: records with lengths drawn from a fixed, uniform or lognormal
+#     distribution, bases drawn from ACGT with a configurable fraction of
+#     ambiguous IUPAC symbols, wrapped at a fixed line width
+#   - integers: one integer per line, uniform or skewed (zipf) over a range
+#   - pairs: two integers per line, a cloud of correlated coordinates
+# Can also be run on its own to write a file, e.g.
+#   python benchmarks/generators.py fasta out.fa --records 1000
+
+import argparse
+import numpy
+
+_BASES = numpy.frombuffer(b"ACGT", dtype = numpy.uint8)
+_AMBIGUOUS = numpy.frombuffer(b"RYSWKMBDHVN", dtype = numpy.uint8)
+
+def fasta_lengths(rng, records, mean_length, distribution = "lognormal", sigma = 0.8):
+    # Function that draws the length of every record
+    if distribution == "fixed":
+        lengths = numpy.full(records, mean_length)
+    elif distribution == "uniform":
+        lengths = rng.integers(1, 2 * mean_length, records)
+    elif distribution == "lognormal":
+        # Parameterised so the mean of the lengths is mean_length
+        lengths = rng.lognormal(numpy.log(mean_length) - sigma ** 2 / 2, sigma, records)
+    else:
+        raise ValueError(f"unknown length distribution {distribution!r}")
+    return(numpy.maximum(lengths, 1).astype(numpy.int64))
+
+def write_fasta(path, records = 1000, mean_length = 1000, distribution = "lognormal", iupac_fraction = 0.01, line_width = 60, seed = 0):
+    # Function that writes a synthetic fasta file and returns its size in bytes
+    rng = numpy.random.default_rng(seed)
+    lengths = fasta_lengths(rng, records, mean_length, distribution)
+    size = 0
+    with open(path, "wb") as f:
+        for i, length in enumerate(lengths):
+            bases = _BASES[rng.integers(0, 4, length)]
+            ambiguous = rng.random(length) < iupac_fraction
+            bases[ambiguous] = _AMBIGUOUS[rng.integers(0, len(_AMBIGUOUS), int(ambiguous.sum()))]
+            sequence = bases.tobytes()
+            lines = [sequence[start:start+line_width] for start in range(0, length, line_width)]
+            record = b">seq%d length=%d\n" % (i, length) + b"\n".join(lines) + b"\n"
+            f.write(record)
+            size += len(record)
+    return(size)
+
+def integer_values(rng, count, low = 0, high = 1000, skew = "uniform", zipf_a = 1.5):
+    # Function that draws count integers in [low, high]
+    if skew == "uniform":
+        return(rng.integers(low, high + 1, count))
+    if skew == "zipf":
+        # Most values are close to low with a long tail towards high
+        return(low + (rng.zipf(zipf_a, count) - 1) % (high - low + 1))
+    raise ValueError(f"unknown skew {skew!r}")
+
+def write_integers(path, count = 100000, low = 0, high = 1000, skew = "uniform", seed = 0):
+    # Function that writes one integer per line and returns the size in bytes
+    rng = numpy.random.default_rng(seed)
+    values = integer_values(rng, count, low, high, skew)
+    data = ("\n".join(map(str, values.tolist())) + "\n").encode()
+    with open(path, "wb") as f:
+        f.write(data)
+    return(len(data))
+
+def write_pairs(path, count = 100000, low = 0, high = 1000, correlation = 0.7, sep = "\t", seed = 0):
+    # Function that writes two correlated integers per line (x, then y) and
+    # returns the size in bytes
+    rng = numpy.random.default_rng(seed)
+    center = (low + high) / 2
+    spread = (high - low) / 6
+    x = rng.normal(0, 1, count)
+    y = correlation * x + numpy.sqrt(1 - correlation ** 2) * rng.normal(0, 1, count)
+    x = numpy.clip(numpy.rint(center + spread * x), low, high).astype(numpy.int64)
+    y = numpy.clip(numpy.rint(center + spread * y), low, high).astype(numpy.int64)
+    data = "".join(f"{a}{sep}{b}\n" for a, b in zip(x.tolist(), y.tolist())).encode()
+    with open(path, "wb") as f:
+        f.write(data)
+    return(len(data))
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Writes deterministic synthetic inputs for the Datason benchmarks")
+    parser.add_argument(
+        "kind",
+        help = "Kind of file to write",
+        choices = ["fasta", "integers", "pairs"])
+    parser.add_argument(
+        "out",
+        help = "File location to write to",
+        type = str)
+    parser.add_argument(
+        "--records",
+        help = "Number of fasta records (fasta) or lines (integers, pairs)",
+        type = int,
+        default = 1000,
+        dest = "records")
+    parser.add_argument(
+        "--mean_length",
+        help = "Mean fasta record length",
+        type = int,
+        default = 1000,
+        dest = "mean_length")
+    parser.add_argument(
+        "--distribution",
+        help = "Distribution of fasta record lengths",
+        choices = ["fixed", "uniform", "lognormal"],
+        default = "lognormal",
+        dest = "distribution")
+    parser.add_argument(
+        "--iupac_fraction",
+        help = "Fraction of bases that are ambiguous IUPAC symbols",
+        type = float,
+        default = 0.01,
+        dest = "iupac_fraction")
+    parser.add_argument(
+        "--high",
+        help = "Largest integer (integers, pairs); the smallest is 0",
+        type = int,
+        default = 1000,
+        dest = "high")
+    parser.add_argument(
+        "--skew",
+        help = "Distribution of integers",
+        choices = ["uniform", "zipf"],
+        default = "uniform",
+        dest = "skew")
+    parser.add_argument(
+        "--seed",
+        type = int,
+        default = 0,
+        dest = "seed")
+    args = parser.parse_args(argv)
+    if args.kind == "fasta":
+        size = write_fasta(args.out, args.records, args.mean_length, args.distribution, args.iupac_fraction, seed = args.seed)
+    elif args.kind == "integers":
+        size = write_integers(args.out, args.records, 0, args.high, args.skew, args.seed)
+    else:
+        size = write_pairs(args.out, args.records, 0, args.high, seed = args.seed)
+    print(f"Wrote {size} bytes to {args.out}")
+
+if __name__ == "__main__":
+    main()
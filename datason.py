@@ -7,24 +7,128 @@
 # This script will take in command line and then execute the proper script
 # This wrapper script functions by importing modules for command scripts
 # so the .py files for modules must be kept in directory with this script
+# Modules are imported lazily (only the selected one) and their main(argv)
+# is called in this same process, so no shell or second interpreter is started.
+# When a server started with 'datason serve' is running, commands are sent to
+# it instead, where the modules are already imported
 
-import argparse, os, subprocess
+import os, sys, importlib
 
-def main():
-    # Gets directory of this script to locate module py files
-    # Assumption here is that module py files are in the same
-    # directory as this script
-    directory = os.path.dirname(os.path.realpath(__file__)) 
+# Gets directory of this script to locate module py files
+# Assumption here is that module py files are in the Modules
+# directory next to this script
+directory = os.path.dirname(os.path.realpath(__file__))
+module_directory = os.path.join(directory, "Modules")
 
-    # Dictionary to associate command with a .py file
-    module_dict = {
-        "inthisto" : directory+"/Modules/"+"inthisto.py",
-        "inthisto2d" : directory+"/Modules/"+"inthisto2d.py",
-        "fastastats" : directory+"/Modules/"+"fastastats.py",
-        "enum_headers" : directory+"/Modules/"+"enum_headers.py"}
+# Registry associating each command with the module (in the Modules directory)
+# that implements it and a one line summary; modules are only imported when
+# their command is run
+module_dict = {}
+
+def register(command, module_name, summary = "", wrapper = False):
+    # Function that declares a command; module_name must name a module in the
+    # Modules directory that defines main(argv). Wrapper commands run other
+    # commands: their main is also given run_command and this registry
+    module_dict[command] = {"module": module_name, "summary": summary, "wrapper": wrapper}
+
+register("inthisto", "inthisto", "Histogram of a list of integers")
+register("inthisto2d", "inthisto2d", "2D histogram of pairs of integers")
+register("fastastats", "fastastats", "Statistics about the sequences in fasta files")
+register("merge", "histmerge", "Merge partial histograms saved with --counts_out and plot them")
+register("enum_headers", "enum_headers", "Enumerate the column headers of a text file")
+register("serve", "serve", "Keep modules loaded in a server so repeated commands start instantly", wrapper = True)
+register("batch", "batch", "Run a manifest of commands on a pool of worker processes", wrapper = True)
+
+def print_help():
+    # Function that prints the top level usage and the list of commands
+    print("usage: datason [-m] command [... flags/arguments for selected module ...]\n")
+    print("Datason: a command line utility tool for various data and file wrangling tasks\n")
+    print("commands:")
+    for command, entry in module_dict.items():
+        print(f"  {command:<14}{entry['summary']}")
+    print("\noptions:\n  -m, --main_verbose      print what the wrapper is doing")
+    print("  --profile_json PATH     save the time, CPU time, bytes and peak memory of every stage as JSON")
+    print("  --profile_stage NAME    with --profile_json, also save a cProfile dump of the stage NAME")
+    print("\nUse 'datason [command] --help' for the options of a command")
+
+def load_module(command):
+    # Function that imports the module registered for a command
+    if module_directory not in sys.path:
+        sys.path.insert(0, module_directory)
+    return(importlib.import_module(module_dict[command]["module"]))
+
+def run_command(command, argv, *extra):
+    # Function that runs a command in this process and returns its exit code;
+    # extra arguments are passed on to the main function of the module
+    if module_directory not in sys.path:
+        sys.path.insert(0, module_directory)
+    from instrument import stage
+    with stage("import"):
+        module = load_module(command)
+    # Makes usage/help messages of the module read "datason <command>"
+    sys.argv = [f"datason {command}"] + list(argv)
+    try:
+        with stage(command):
+            code = module.main(list(argv), *extra)
+    except SystemExit as exit_status:
+        if exit_status.code == None: return(0)
+        if isinstance(exit_status.code, int): return(exit_status.code)
+        print(exit_status.code, file = sys.stderr)
+        return(1)
+    if isinstance(code, int): return(code)
+    return(0)
+
+def server_socket_path():
+    # Function that returns the path of the server socket using only os, so
+    # the wrapper can look for a server without importing anything; it must
+    # give the same path as serve.socket_path
+    if os.environ.get("DATASON_SOCKET"):
+        return(os.environ["DATASON_SOCKET"])
+    base = os.environ.get("XDG_RUNTIME_DIR") or "/tmp"
+    return(os.path.join(base, f"datason-{os.getuid()}", "datason.sock"))
+
+def run_on_server(command, argv):
+    # Function that sends a command to a running server and returns its exit
+    # code, or None when there is no server (or DATASON_NO_SERVER is set); the
+    # socket is looked for before serve (and the socket module) is imported,
+    # so this costs nothing when no server runs
+    if os.environ.get("DATASON_NO_SERVER"):
+        return(None)
+    path = server_socket_path()
+    if not os.path.exists(path):
+        return(None)
+    if module_directory not in sys.path:
+        sys.path.insert(0, module_directory)
+    import serve
+    return(serve.run_remote(command, argv, path))
+
+def run_profiled(base_args, rest_args):
+    # Function that runs a command in this process (never on the server) with
+    # instrumentation on and writes the time, CPU time, bytes and peak memory
+    # of every stage to the --profile_json file
+    import time
+    if module_directory not in sys.path:
+        sys.path.insert(0, module_directory)
+    import instrument
+    instrument.enable(base_args.profile_stage)
+    start = time.perf_counter()
+    if module_dict[base_args.command]["wrapper"] == True:
+        code = run_command(base_args.command, rest_args, run_command, module_dict)
+    else:
+        code = run_command(base_args.command, rest_args)
+    instrument.write_json(base_args.profile_json, {"command": base_args.command, "argv": rest_args, "exit": code, "wall_seconds": time.perf_counter() - start})
+    if base_args.verbose_main == True: print(f"Stage profile saved to {base_args.profile_json}")
+    return(code)
+
+def main(argv = None):
+    if argv == None: argv = sys.argv[1:]
+    if len(argv) == 0 or argv[0] in ("-h", "--help"):
+        print_help()
+        return(0)
 
     # Parsing top level arguments
-    parser = argparse.ArgumentParser(add_help = False)
+    import argparse
+    parser = argparse.ArgumentParser(prog = "datason", add_help = False, allow_abbrev = False)
     parser.add_argument(
         "command",
         type = str,
@@ -34,18 +138,31 @@ def main():
         action = "store_true",
         default = False,
         dest = "verbose_main")
+    parser.add_argument(
+        "--profile_json", "--profile-json",
+        type = str,
+        dest = "profile_json")
+    parser.add_argument(
+        "--profile_stage", "--profile-stage",
+        type = str,
+        dest = "profile_stage")
 
-    # Parsing top level params, running appropriate script, and passing rest of commands to script
-    base_args, rest_args = parser.parse_known_args()
+    # Parsing top level params, running appropriate module, and passing rest of commands to module
+    base_args, rest_args = parser.parse_known_args(argv)
     if base_args.verbose_main == True: print(f"Verbose status: {base_args.verbose_main}")
     if base_args.verbose_main == True: print(f"Command: {base_args.command}")
     if base_args.verbose_main == True: print(f"Rest of arguments: {rest_args}")
-
-    #Assembling command to execute modules
-    module_path = module_dict.get(base_args.command)
-    command = "python3 " + module_path + " " + " ".join(rest_args)
-    if base_args.verbose_main == True: print(f"Command to run: {command}\n Running command...")
-    subprocess.call(command, shell=True)
+    if base_args.profile_json != None:
+        return(run_profiled(base_args, rest_args))
+    if module_dict[base_args.command]["wrapper"] == True:
+        # Wrapper commands run other commands through this wrapper and its registry
+        return(run_command(base_args.command, rest_args, run_command, module_dict))
+    code = run_on_server(base_args.command, rest_args)
+    if code != None:
+        if base_args.verbose_main == True: print(f"Ran module {module_dict[base_args.command]['module']} on the datason server")
+        return(code)
+    if base_args.verbose_main == True: print(f"Running module {module_dict[base_args.command]['module']} in process...")
+    return(run_command(base_args.command, rest_args))
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,49 @@
+#! /usr/bin/python
+
+# Author: Addison Martin
+# Tests for the Datason package
+# fastastats -i must read pipes (/dev/stdin, FIFOs, process substitution)
+# without losing the first bytes of the input to format detection
+
+import os, sys, random, threading, subprocess
+
+FASTASTATS = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "Modules", "fastastats.py")
+
+def _write_fasta(path, records):
+    rng = random.Random(7)
+    with open(path, "w") as f:
+        for i in range(records):
+            f.write(f">record{i}\n{''.join(rng.choice('ACGT') for _ in range(rng.randint(50, 300)))}\n")
+
+def _fastastats(args, data = None):
+    # Runs fastastats; data (bytes) is written to its stdin through a pipe
+    env = dict(os.environ, DATASON_NO_SERVER = "1")
+    result = subprocess.run([sys.executable, FASTASTATS] + args, input = data, capture_output = True, env = env, timeout = 120)
+    assert result.returncode == 0, result.stderr
+    return(result.stdout.decode())
+
+def test_dev_stdin_matches_file(tmp_path):
+    for records in (5000, 2):
+        path = str(tmp_path / f"in{records}.fa")
+        _write_fasta(path, records)
+        expected = _fastastats(["-i", path])
+        assert f"Number of sequences: {records}\n" in expected
+        with open(path, "rb") as f:
+            assert _fastastats(["-i", "/dev/stdin"], f.read()) == expected
+
+def test_fifo_matches_file(tmp_path):
+    path = str(tmp_path / "in.fa")
+    fifo = str(tmp_path / "in.fifo")
+    _write_fasta(path, 5000)
+    os.mkfifo(fifo)
+    expected = _fastastats(["-i", path])
+
+    def feed():
+        with open(path, "rb") as source, open(fifo, "wb") as sink:
+            sink.write(source.read())
+    writer = threading.Thread(target = feed)
+    writer.start()
+    try:
+        assert _fastastats(["-i", fifo]) == expected
+    finally:
+        writer.join(10)